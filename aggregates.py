@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Totals of tracks by activity and period, maintained incrementally.
+
+The store is a sqlite3 database consisting of two tables:
+1) files: size, mtime, day, activity, user id, total time and total distance
+   of each track, read from the header (see parse_track_informations())
+   without decoding the trackpoints.
+2) days: rollups of the files by (day, activity, user id), i.e. number of
+   tracks, total time and total distance.  Days are in localtime of the
+   start of the tracks.
+Only files which are new or changed (size and mtime) since the last update
+are read; the rollup of the day is updated by the difference, and files
+removed from the disk are subtracted.  Periods (day, week, month and year;
+weeks start on Monday, %W of strftime) are summed from the days.  Routes
+have no start times and are not counted.
+
+Usage:
+    python aggregates.py totals.sqlite update input_files_or_directories
+    python aggregates.py totals.sqlite report [--period month] [--activity
+        Running] [--user 1] [--format {csv,json}] [-o FILE]
+"""
+import sys
+import csv
+import json
+import struct
+import sqlite3
+import argparse
+from pathlib import Path
+
+import nst
+import compress
+
+PERIODS = {'day': 'day', 'week': "strftime('%Y-W%W', day)",
+           'month': 'substr(day, 1, 7)', 'year': 'substr(day, 1, 4)'}
+COLUMNS = ('period', 'activity', 'user_id', 'tracks', 'total_time',
+           'total_distance') # Of reports; times in s and distances in km.
+
+def read_header(in_file):
+    """Day, activity, user id, total time and distance of a track file.
+
+    Returns:
+        a tuple of them, or None if it is not a track or not readable.
+    """
+    import convert_nst_files_to_gpx as converter # Header parsers.
+
+    nst.initialize_variables()
+    nst.use_config(in_file.parent) # Custom activities in config.dat.
+    try:
+        with nst.open_input(in_file) as f:
+            version = converter.check_file_type_version(f)
+            if nst.FILE_TYPE != nst.TRACK: return None
+            converter.parse_track_informations(f, version)
+    except (SystemExit, OSError, struct.error):
+        return None
+    return header_values()
+
+def header_values():
+    """Values of the header, see read_header(), from nst.py (or None)."""
+    day = nst.format_datetime(nst.START_LOCALTIME)[:10]
+    if day.startswith('INVALID'): return None
+    return (day, nst.activity_type, nst.USER_ID, nst.total_time,
+            nst.total_distance)
+
+def _key(in_file):
+    """Path of a file as the key, the same however it is given."""
+    return str(Path(in_file).resolve())
+
+class Aggregates(object):
+    """A sqlite3 database of tracks and their daily rollups."""
+    def __init__(self, path):
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL, day TEXT,
+                activity TEXT, user_id INTEGER, total_time REAL,
+                total_distance REAL);
+            CREATE TABLE IF NOT EXISTS days (
+                day TEXT, activity TEXT, user_id INTEGER, tracks INTEGER,
+                total_time REAL, total_distance REAL,
+                PRIMARY KEY (day, activity, user_id));''')
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def is_current(self, in_file):
+        """True if the file is counted and not changed since then."""
+        stat = Path(in_file).stat()
+        row = self.connection.execute(
+            'SELECT size, mtime FROM files WHERE path = ?',
+            (_key(in_file), )).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime)
+
+    def _roll(self, sign, day, activity, user_id, total_time,
+              total_distance):
+        """Adds (sign=1) or subtracts (sign=-1) a track to/from the day."""
+        self.connection.execute(
+            'INSERT INTO days VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (day, activity, user_id) DO UPDATE SET '
+            'tracks = tracks + excluded.tracks, '
+            'total_time = total_time + excluded.total_time, '
+            'total_distance = total_distance + excluded.total_distance',
+            (day, activity, user_id, sign, sign * total_time,
+             sign * total_distance))
+
+    def remove(self, in_file):
+        """Subtracts a file from the rollups if it is counted."""
+        row = self.connection.execute(
+            'SELECT day, activity, user_id, total_time, total_distance '
+            'FROM files WHERE path = ?', (_key(in_file), )).fetchone()
+        if row is None: return
+        self._roll(-1, *row)
+        self.connection.execute('DELETE FROM days WHERE tracks <= 0')
+        self.connection.execute('DELETE FROM files WHERE path = ?',
+                                (_key(in_file), ))
+
+    def add(self, in_file, values):
+        """Adds (or replaces) a file of the values from read_header()."""
+        self.remove(in_file)
+        if values is None: return
+        stat = Path(in_file).stat()
+        self.connection.execute(
+            'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (_key(in_file), stat.st_size, stat.st_mtime, *values))
+        self._roll(1, *values)
+
+    def update(self, in_files):
+        """Reads the files which are new or changed, and removes the missing.
+
+        Returns:
+            numbers of files added (or replaced) and removed.
+        """
+        added = 0
+        for in_file in in_files:
+            if self.is_current(in_file): continue
+            self.add(in_file, read_header(in_file))
+            added += 1
+        removed = [path for (path, ) in self.connection.execute(
+            'SELECT path FROM files') if not Path(path).exists()]
+        for path in removed: self.remove(path)
+        self.connection.commit()
+        return added, len(removed)
+
+    def totals(self, period='month', activity=None, user_id=None):
+        """Totals by period, activity and user id.
+
+        Returns:
+            a list of tuples of COLUMNS, sorted by period and activity.
+        """
+        (conditions, parameters) = ([], [])
+        for (column, value) in (('activity', activity), ('user_id', user_id)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+        where = f'WHERE {" AND ".join(conditions)} ' if conditions else ''
+        return self.connection.execute(
+            f'SELECT {PERIODS[period]} AS period, activity, user_id, '
+            'SUM(tracks), SUM(total_time), SUM(total_distance) FROM days '
+            f'{where}GROUP BY period, activity, user_id '
+            'ORDER BY period, activity, user_id', parameters).fetchall()
+
+def write_report(rows, path=None, file_format='csv'):
+    """Writes rows of totals as CSV or JSON (a list of objects).
+
+    Args:
+        rows: a list from Aggregates.totals().
+        path (optional): a path object, compressed if the suffix is .gz or
+            .xz (see compress.py).  Stdout if None.
+        file_format (optional): 'csv' or 'json'.
+    """
+    with (compress.open_output(path, mode='wt') if path is not None
+          else open(sys.stdout.fileno(), mode='w', newline='',
+                    closefd=False)) as f:
+        if file_format == 'json':
+            json.dump([dict(zip(COLUMNS, row)) for row in rows], f, indent=1)
+            f.write('\n')
+        else:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Totals of Symbian SportsTracker tracks by period.')
+    parser.add_argument('database', type=Path,
+                        help='sqlite3 file of the totals.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser(
+        'update', help='add new/changed files and remove missing ones.')
+    command.add_argument('in_file', type=Path, nargs='+',
+                         help='track files or directories of W*.dat.')
+    command = commands.add_parser('report', help='totals by period.')
+    command.add_argument('--period', choices=tuple(PERIODS), default='month')
+    command.add_argument('--activity', help='e.g. Running (default: all).')
+    command.add_argument('--user', type=int, help='user id (default: all).')
+    command.add_argument('--format', choices=('csv', 'json'), default='csv')
+    command.add_argument('-o', '--output', type=Path, metavar='FILE',
+                         help='write to the file instead of stdout.')
+    args = parser.parse_args()
+
+    import convert_nst_files_to_gpx as converter # Header parsers.
+    aggregates = Aggregates(args.database)
+    try:
+        if args.command == 'update':
+            (added, removed) = aggregates.update(
+                converter.find_files(args.in_file, ('W*.dat', )))
+            print(f'Added: {added}, removed: {removed}', file=sys.stderr)
+        else:
+            write_report(aggregates.totals(args.period, args.activity,
+                                           args.user),
+                         args.output, args.format)
+    finally:
+        aggregates.close()
+
+
+if __name__ == '__main__':
+    main()
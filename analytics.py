@@ -0,0 +1,178 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for analyzing tracks of Symbian (Nokia) SportsTracker files.
+
+analyze() takes a list of trackpt_store (see store_trackpt() in nst.py) and
+computes the followings in O(n) per track:
+1) splits per km (or per mile) of distance.
+2) best efforts, the fastest time over standard distances, by a two-pointer
+   sliding window over the cumulative distance (dist).
+3) elevation gain and loss with hysteresis.
+4) moving time.
+Times are totaltime (t_time), which excludes pauses, as in SportsTracker.
+PersonalRecords collects the best efforts of many tracks, e.g. in a batch
+conversion, to make a table of personal records by activities.
+"""
+import csv
+from pathlib import Path
+
+import nst
+import compress
+
+UNITS = {'km': 1000, 'mi': 1609.344} # Meters per unit.
+EFFORTS = {'km': (1000, 5000, 10000, 21097.5, 42195), # Meters.
+           'mi': (1609.344, 5000, 10000, 21097.5, 42195)}
+HYSTERESIS = 5 # Min. change of altitude (m) counted as gain or loss.
+MIN_SPEED = 0.5 # Min. speed (m/s) counted as moving.
+
+def splits(trackpts, unit=UNITS['km']):
+    """Split times at every unit of distance.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        unit (optional): length of a split in meters.  Defaults to 1 km.
+
+    Returns:
+        a list of tuples (distance_m, split_time_s, elapsed_t_time_s).  The
+        last one is a partial split if the track does not end at a unit.
+    """
+    if not trackpts: return []
+    (result, last_t_time, next_mark) = ([], trackpts[0].t_time, unit)
+    previous = trackpts[0]
+    for tp in trackpts[1:]:
+        dist = tp.dist / 100 # Meters.
+        while dist >= next_mark:
+            # Interpolate the t_time at the mark.
+            (d_0, d_1) = (previous.dist / 100, dist)
+            t_mark = previous.t_time + (tp.t_time - previous.t_time) * (
+                (next_mark - d_0) / (d_1 - d_0) if d_1 > d_0 else 1)
+            result.append((next_mark, t_mark - last_t_time, t_mark))
+            (last_t_time, next_mark) = (t_mark, next_mark + unit)
+        previous = tp
+    dist = previous.dist / 100
+    if dist > next_mark - unit and previous.t_time > last_t_time:
+        result.append((dist, previous.t_time - last_t_time, previous.t_time))
+    return result
+
+def best_effort(trackpts, distance):
+    """The fastest time over the distance by using a two-pointer window.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        distance: in meters.
+
+    Returns:
+        (time_s, start_index, stop_index) or None if the track is shorter.
+    """
+    distance *= 100 # Int. distance (cm) as in dist.
+    (best, left) = (None, 0)
+    for right in range(len(trackpts)):
+        if trackpts[right].dist - trackpts[left].dist < distance: continue
+        # Shrink the window as long as it covers the distance.
+        while trackpts[right].dist - trackpts[left + 1].dist >= distance:
+            left += 1
+        time = trackpts[right].t_time - trackpts[left].t_time
+        if best is None or time < best[0]: best = (time, left, right)
+    return best
+
+def elevation_gain_loss(trackpts, hysteresis=HYSTERESIS):
+    """Elevation gain and loss (m), ignoring changes less than hysteresis."""
+    if not trackpts: return 0, 0
+    (gain, loss, reference) = (0, 0, trackpts[0].z_ax)
+    for tp in trackpts[1:]:
+        delta = tp.z_ax - reference
+        if delta >= hysteresis:
+            (gain, reference) = (gain + delta, tp.z_ax)
+        elif delta <= -hysteresis:
+            (loss, reference) = (loss - delta, tp.z_ax)
+    return gain, loss
+
+def moving_time(trackpts, min_speed=MIN_SPEED):
+    """Sum of t_time intervals (s) in which speed >= min_speed (m/s)."""
+    total = 0
+    for (previous, tp) in zip(trackpts[:-1], trackpts[1:]):
+        dt_time = tp.t_time - previous.t_time
+        speed = (tp.dist - previous.dist) / 100 / dt_time if dt_time > 0 else 0
+        if speed >= min_speed: total += dt_time
+    return total
+
+def analyze(trackpts, unit='km'):
+    """Analyze a track, see module-level docstring.
+
+    Returns:
+        a dict of distance (m), total_time, moving_time (s), gain, loss (m),
+        splits (see splits()) and best_efforts ({distance_m: time_s}).
+    """
+    (gain, loss) = elevation_gain_loss(trackpts)
+    best_efforts = {}
+    for distance in EFFORTS[unit]:
+        effort = best_effort(trackpts, distance)
+        if effort is None: break # Longer distances are not reached either.
+        best_efforts[distance] = effort[0]
+    return {
+        'distance': trackpts[-1].dist / 100 if trackpts else 0,
+        'total_time': trackpts[-1].t_time if trackpts else 0,
+        'moving_time': moving_time(trackpts), 'gain': gain, 'loss': loss,
+        'splits': splits(trackpts, UNITS[unit]), 'best_efforts': best_efforts}
+
+def format_distance(distance, unit='km'):
+    """Names a distance (m) of efforts, e.g. '5 km' or '1 mi'.
+
+    >>> format_distance(5000)
+    '5 km'
+    >>> format_distance(1609.344, 'mi')
+    '1 mi'
+    """
+    value = distance / UNITS[unit]
+    return f'{round(value, 3):g} {unit}'
+
+def print_splits(analysis, unit='km', file=None):
+    """Print a table of splits, e.g. to stderr."""
+    for (i, (distance, split_time, t_time)) in enumerate(analysis['splits']):
+        print(f'{i + 1}\t{format_distance(distance, unit)}\t'
+              f'{nst.format_timedelta(split_time)}\t'
+              f'{nst.format_timedelta(t_time)}', file=file)
+
+class PersonalRecords(object):
+    """Best efforts by activities over many tracks."""
+    def __init__(self, unit='km'):
+        self.unit = unit
+        self.records = {} # {(activity, distance): (time, name, start)}
+
+    def update(self, analysis, activity, name, start=''):
+        """Update the records by the analysis of a track named name."""
+        for (distance, time) in analysis['best_efforts'].items():
+            key = (activity, distance)
+            if key not in self.records or time < self.records[key][0]:
+                self.records[key] = (time, name, start)
+
+    def write_csv(self, path):
+        """Write the table of records sorted by activity and distance.
+
+        The csv is compressed if the suffix is .gz or .xz, see compress.py.
+        """
+        with compress.open_output(Path(path), mode='wt') as f:
+            writer = csv.writer(f)
+            writer.writerow(('activity', 'effort', 'time', 'pace_per_unit',
+                             'file', 'start'))
+            for ((activity, distance), (time, name, start)) in sorted(
+                    self.records.items()):
+                pace = time / (distance / UNITS[self.unit])
+                writer.writerow((
+                    activity, format_distance(distance, self.unit),
+                    nst.format_timedelta(time), nst.format_timedelta(pace),
+                    name, start))
+
+def add_arguments(parser):
+    """Adds options of analytics to an argparse parser."""
+    group = parser.add_argument_group('analytics')
+    group.add_argument('--records', type=str, metavar='CSV_FILE',
+                       help='write a table of personal records (best efforts '
+                       'by activities) of all input files.')
+    group.add_argument('--splits', action='store_true',
+                       help='print splits of each track to stderr.')
+    group.add_argument('--unit', choices=tuple(UNITS), default='km',
+                       help='unit of splits and efforts.')
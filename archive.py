@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Script to convert tracks in ZIP/TAR backups of phones without extraction.
+
+Members matching W*.dat, R*.dat and Rec*.tmp (e.g. SportsTracker2\\W*.dat;
+both / and \\ are path separators) are read in a single pass over each archive
+into memory, or into a temporary file if larger than MAX_IN_MEMORY, and are
+decoded in parallel by the pipeline of async_convert.py.  Compressed TAR
+(.tar.gz, .tar.xz, etc.) is read as a stream.  The lookup tables of config.dat
+(see nst.read_config()) are used for the members in the same directory; in TAR
+only for those after config.dat, since the stream is not read twice.
+
+Gpx files are written in a directory, or in another archive if the output ends
+with .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz, under the relative paths
+of the members (see output_name()), so that tracks of the same name in
+different directories are kept.  A member of the same path in another archive
+is not written but reported as failed, not to overwrite the first one.
+
+Usage:
+    python archive.py -o output_dir_or_archive backups [-- converter options]
+e.g. python archive.py -o gpx.zip backup.zip -- --lean
+"""
+import io
+import sys
+import time
+import asyncio
+import fnmatch
+import tarfile
+import zipfile
+import argparse
+import tempfile
+from pathlib import Path, PurePosixPath
+from concurrent.futures import ThreadPoolExecutor
+
+import nst
+import compress
+import async_convert
+import convert_nst_files_to_gpx
+
+PATTERNS = async_convert.PATTERNS
+MAX_IN_MEMORY = 32 * 2**20 # Bytes; larger members go to temporary files.
+NO_CONFIG = ({}, {}) # Lookup tables if config.dat is not found.
+TAR_MODES = {'.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz',
+             '.tar.bz2': 'w:bz2', '.tar.xz': 'w:xz'}
+
+def member_path(name):
+    """Path of a member, of which the separator may be '\\' (Windows).
+
+    >>> member_path('E\\\\SportsTracker2\\\\W123.dat').parent
+    PurePosixPath('E/SportsTracker2')
+    """
+    return PurePosixPath(name.replace('\\', '/'))
+
+def output_name(path, compression=None):
+    """Relative path of gpx of a member, mirroring its directories.
+
+    >>> str(output_name(member_path('/E/../SportsTracker2/W1.dat'), 'gz'))
+    'E/SportsTracker2/W1.gpx.gz'
+    """
+    parts = [p for p in path.parts[:-1] if p not in ('/', '..')] # In output.
+    return compress.with_suffix(PurePosixPath(*parts, f'{path.stem}.gpx'),
+                                compression)
+
+def _matches(path, patterns):
+    return any(fnmatch.fnmatchcase(path.name, p) for p in patterns)
+
+def _is_config(path):
+    return path.name.lower() == 'config.dat'
+
+def _read_member(f, size, spool_dir=None):
+    """Bytes of the member, or a path of the temporary copy if it is large."""
+    if spool_dir is None or size <= MAX_IN_MEMORY: return f.read()
+    with tempfile.NamedTemporaryFile(dir=spool_dir, delete=False) as temp:
+        while chunk := f.read(2**20): temp.write(chunk)
+    return Path(temp.name)
+
+def iter_members(archive, patterns=PATTERNS, spool_dir=None):
+    """Yields matching members of a ZIP/TAR archive in a single pass.
+
+    Args:
+        archive: a path object of the archive.
+        patterns (optional): glob patterns of the names of members.
+        spool_dir (optional): a directory for temporary copies of members
+            larger than MAX_IN_MEMORY.  All are read in memory if None.
+
+    Yields:
+        (path, data, config, mtime) of each member, see async_convert.decode().
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_file:
+            infos = [i for i in zip_file.infolist() if not i.is_dir()]
+            configs = {} # The central directory makes it possible beforehand.
+            for info in infos:
+                path = member_path(info.filename)
+                if _is_config(path):
+                    with zip_file.open(info) as f:
+                        configs[path.parent] = nst.read_config(f)
+            for info in infos:
+                path = member_path(info.filename)
+                if not _matches(path, patterns): continue
+                with zip_file.open(info) as f:
+                    data = _read_member(f, info.file_size, spool_dir)
+                mtime = time.mktime(info.date_time + (0, 0, -1)) # Local time.
+                yield path, data, configs.get(path.parent, NO_CONFIG), mtime
+    else:
+        with tarfile.open(archive, mode='r|*') as tar_file: # A stream.
+            configs = {}
+            for info in tar_file:
+                if not info.isfile(): continue
+                path = member_path(info.name)
+                if _is_config(path):
+                    configs[path.parent] = nst.read_config(
+                        tar_file.extractfile(info))
+                elif _matches(path, patterns):
+                    data = _read_member(tar_file.extractfile(info), info.size,
+                                        spool_dir)
+                    yield (path, data, configs.get(path.parent, NO_CONFIG),
+                           info.mtime)
+
+class ArchiveWriter(object):
+    """Writes files into a ZIP or a TAR archive (compression by the suffix)."""
+    def __init__(self, path):
+        name = path.name.lower()
+        self.zip_file = self.tar_file = None
+        if name.endswith('.zip'):
+            self.zip_file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            mode = next(m for (s, m) in TAR_MODES.items() if name.endswith(s))
+            self.tar_file = tarfile.open(path, mode)
+
+    @staticmethod
+    def is_archive(path):
+        return path.name.lower().endswith(('.zip', *TAR_MODES))
+
+    def write(self, name, data):
+        if self.zip_file is not None:
+            self.zip_file.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            (info.size, info.mtime) = (len(data), time.time())
+            self.tar_file.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        (self.zip_file or self.tar_file).close()
+
+async def convert_archives(archives, output, concurrency=None,
+                           queue_size=async_convert.QUEUE_SIZE,
+                           converter_args=()):
+    """Convert members of the archives to gpx, see module-level docstring.
+
+    Args:
+        archives: path objects of ZIP/TAR archives.
+        output: a path object of the output directory or archive.
+        concurrency, queue_size, converter_args (optional): see
+            async_convert.run_pipeline().
+
+    Returns:
+        a list of (member path, error or None) in order of completion.
+    """
+    loop = asyncio.get_running_loop()
+    compression = compress.parse_arguments(converter_args).compress
+    to_archive = ArchiveWriter.is_archive(output)
+    written = set() # Names of gpx, not to overwrite one of another archive.
+    def write(path, gpx):
+        name = output_name(path, compression)
+        if name in written: # Reported as failed by run_pipeline().
+            raise FileExistsError(f'{name} is already written')
+        written.add(name)
+        if to_archive:
+            writer.write(str(name), gpx)
+        else:
+            (output / name).parent.mkdir(parents=True, exist_ok=True)
+            async_convert.write_bytes(output / name, gpx)
+
+    if to_archive:
+        writer = ArchiveWriter(output)
+    else:
+        output.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as spool_dir, ThreadPoolExecutor(
+            max_workers=1) as reader:
+        members = (m for archive in archives
+                   for m in iter_members(archive, spool_dir=spool_dir))
+        async def items(): # The generator is advanced in the reader thread.
+            end = object()
+            while (item := await loop.run_in_executor(
+                    reader, next, members, end)) is not end:
+                yield item
+        try:
+            return await async_convert.run_pipeline(
+                items(), write, concurrency, queue_size, converter_args)
+        finally:
+            if to_archive: writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert Symbian SportsTracker files in ZIP/TAR archives '
+        'to gpx.  Arguments after -- are passed to the converters.')
+    parser.add_argument('archive', type=Path, nargs='+',
+                        help='ZIP/TAR archives, e.g. backups of phones.')
+    parser.add_argument('-o', '--output', type=Path, required=True,
+                        metavar='DIR_OR_ARCHIVE',
+                        help='a directory, or an archive (.zip, .tar, .tar.gz, '
+                        '.tgz, .tar.bz2 or .tar.xz) to write gpx files.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of members decoded at a time.')
+    parser.add_argument('--queue-size', type=int,
+                        default=async_convert.QUEUE_SIZE,
+                        help='max. number of members waiting in each stage.')
+    argv = sys.argv[1:]
+    (argv, converter_args) = ((argv[:argv.index('--')],
+                               argv[argv.index('--') + 1:])
+                              if '--' in argv else (argv, []))
+    args = parser.parse_args(argv)
+    # Of the batch (main() of the converter) including the writers (--csv and
+    # --database), not in the workers decoding to gpx bytes.
+    options = convert_nst_files_to_gpx.main_options(converter_args)
+    if options: parser.error(f'not supported: {", ".join(options)}')
+
+    results = asyncio.run(convert_archives(
+        args.archive, args.output, args.jobs, args.queue_size,
+        converter_args))
+    for (path, error) in results:
+        if error: print(f'Failed: {path} ({error})', file=sys.stderr)
+    print(f'Converted: {sum(1 for r in results if r[1] is None)}/'
+          f'{len(results)}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
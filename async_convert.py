@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""An asyncio pipeline to convert many Symbian SportsTracker files to gpx.
+
+convert_many() overlaps the three stages of conversion:
+1) read: the contents of files are read in threads ahead of decoding.
+2) decode: the contents are parsed and serialized to gpx bytes in a pool of
+   processes (CPU bound; nst.py keeps the state in module-level variables).
+3) write: gpx bytes are written by a thread.
+The stages are connected by bounded queues (queue_size), so that slow decoding
+stops reading ahead (backpressure) and the memory is bounded by about
+queue_size + concurrency files in flight.
+
+Usage:
+    python async_convert.py [options] input_files_or_directories [-- ...]
+where the arguments after -- are passed to the converters, e.g. -- --lean.
+"""
+import io
+import os
+import sys
+import asyncio
+import contextlib
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import nst
+import compress
+import convert_nst_files_to_gpx
+import convert_nst_rec_to_gpx
+
+PATTERNS = ('W*.dat', 'R*.dat', 'Rec*.tmp')
+QUEUE_SIZE = 8 # Max. number of items waiting in each queue.
+
+def decode(in_file, data, converter_args=(), config=None, mtime=None):
+    """Convert the contents of a file to gpx bytes in a worker process.
+
+    Args:
+        in_file: a path object of the file (or of the member of an archive).
+        data: bytes of the contents, or a path object of a temporary copy.
+        converter_args (optional): a list of options of the converters.
+        config (optional): lookup tables, see nst.use_config().
+        mtime (optional): mtime of the file, used as start time of routes.
+
+    Returns:
+        (in_file, gpx bytes or None, error or None).  The bytes are 
+        compressed by --compress in converter_args.
+    """
+    is_rec = in_file.suffix.lower() == '.tmp'
+    converter = convert_nst_rec_to_gpx if is_rec else convert_nst_files_to_gpx
+    args = converter.make_parser().parse_args(
+        [*converter_args, str(in_file)])
+    nst.LEAN = args.lean
+    with (io.BytesIO(data) if isinstance(data, bytes)
+          else data.open(mode='rb')) as f:
+        if isinstance(data, bytes):
+            f.name = str(in_file) # Mtime is the start time of routes.
+        if mtime is not None: f.mtime = mtime
+        try:
+            # Rec*.tmp converter prints a lot for debugging purposes.
+            with contextlib.redirect_stdout(io.StringIO()):
+                gpx = converter.to_gpx(in_file, args, file_obj=f,
+                                       config=config)
+                return in_file, compress.to_bytes(
+                    gpx.write, args.compress, args.compress_level), None
+        except SystemExit: # Errors in nst.py.
+            return in_file, None, 'failed to convert'
+        except convert_nst_files_to_gpx.DECODE_ERRORS as error: # Truncated.
+            return in_file, None, f'failed to convert ({error})'
+
+def write_bytes(path, data):
+    with path.open(mode='wb') as f:
+        f.write(data)
+
+async def run_pipeline(items, write, concurrency=None, queue_size=QUEUE_SIZE,
+                       converter_args=()):
+    """Decode items in a pool of processes and write them as they complete.
+
+    Args:
+        items: an async iterable of (in_file, data, config, mtime), see
+            decode().  It is consumed as long as read_queue has a room.
+        write: a function of (in_file, gpx bytes), called in a thread.
+        concurrency (optional): number of worker processes.  Defaults to
+            os.cpu_count().
+        queue_size (optional): max. number of items waiting to be decoded and
+            gpx waiting to be written.
+        converter_args (optional): a list of options of the converters.
+
+    Returns:
+        a list of (in_file, error or None) in order of completion.
+    """
+    loop = asyncio.get_running_loop()
+    concurrency = concurrency or os.cpu_count() or 1
+    (read_queue, write_queue) = (asyncio.Queue(queue_size),
+                                 asyncio.Queue(queue_size))
+    results = []
+
+    async def read():
+        async for item in items:
+            await read_queue.put(item) # Waits if the queue is full.
+        for _ in range(concurrency): await read_queue.put(None)
+
+    async def decode_worker(processes):
+        while (item := await read_queue.get()) is not None:
+            try:
+                (path, gpx, error) = await loop.run_in_executor(
+                    processes, decode, item[0], item[1], converter_args,
+                    *item[2:])
+            except Exception as exception: # E.g. a worker was killed.
+                (path, gpx, error) = (item[0], None, repr(exception))
+            if error is not None:
+                results.append((path, error))
+            else:
+                await write_queue.put((path, gpx))
+
+    async def write_all(threads):
+        # A single writer; the write function need not be thread-safe.
+        while (item := await write_queue.get()) is not None:
+            try:
+                await loop.run_in_executor(threads, write, *item)
+                results.append((item[0], None))
+            except OSError as error:
+                results.append((item[0], str(error)))
+
+    with ThreadPoolExecutor(max_workers=1) as threads, ProcessPoolExecutor(
+            max_workers=concurrency) as processes:
+        writer = asyncio.create_task(write_all(threads))
+        await asyncio.gather(read(), *(
+            decode_worker(processes) for _ in range(concurrency)))
+        await write_queue.put(None)
+        await writer
+    return results
+
+async def convert_many(paths, output_dir=None, concurrency=None,
+                       queue_size=QUEUE_SIZE, converter_args=(), roots=()):
+    """Convert files to gpx by the pipeline, see module-level docstring.
+
+    Args:
+        paths: path objects of input files.
+        output_dir (optional): a path object of the directory to write gpx.
+            Defaults to next to the input files.
+        roots (optional): path objects of directories searched for paths,
+            of which the relative paths are mirrored under output_dir.
+        concurrency, queue_size, converter_args (optional): see
+            run_pipeline().
+
+    Returns:
+        a list of (in_file, error or None) in order of completion.
+    """
+    loop = asyncio.get_running_loop()
+    compression = compress.parse_arguments(converter_args).compress
+    errors = []
+
+    async def read(threads):
+        for path in paths:
+            try:
+                data = await loop.run_in_executor(threads, path.read_bytes)
+            except OSError as error:
+                errors.append((path, str(error)))
+                continue
+            yield path, data, None, None
+
+    def write(path, gpx):
+        gpx_path = (output_dir / convert_nst_files_to_gpx.relative_output(
+            path, roots) if output_dir else path.with_suffix('.gpx'))
+        gpx_path.parent.mkdir(parents=True, exist_ok=True)
+        write_bytes(compress.with_suffix(gpx_path, compression), gpx)
+
+    if output_dir: output_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor() as threads:
+        results = await run_pipeline(read(threads), write, concurrency,
+                                     queue_size, converter_args)
+    return errors + results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert Symbian SportsTracker files to gpx by an asyncio '
+        'pipeline.  Arguments after -- are passed to the converters.')
+    parser.add_argument('in_file', type=Path, nargs='+',
+                        help='files or directories to search W*.dat, R*.dat '
+                        'and Rec*.tmp.')
+    parser.add_argument('-o', '--output-dir', type=Path, metavar='DIR',
+                        help='write gpx files in the directory, under the '
+                        'relative paths in the directories given.  Defaults '
+                        'to next to the input files.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of files decoded at a time.')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help='max. number of files waiting in each stage.')
+    argv = sys.argv[1:]
+    (argv, converter_args) = ((argv[:argv.index('--')],
+                               argv[argv.index('--') + 1:])
+                              if '--' in argv else (argv, []))
+    args = parser.parse_args(argv)
+    # Of the batch (main() of the converter) including the writers (--csv and
+    # --database), not in the workers decoding to gpx bytes.
+    options = convert_nst_files_to_gpx.main_options(converter_args)
+    if options: parser.error(f'not supported: {", ".join(options)}')
+
+    in_files = convert_nst_files_to_gpx.find_files(args.in_file, PATTERNS)
+    collisions = (convert_nst_files_to_gpx.output_collisions(
+        in_files, args.in_file) if args.output_dir else None)
+    if collisions: parser.error(f'the same output of {", ".join(collisions)}')
+    results = asyncio.run(convert_many(
+        in_files, args.output_dir, args.jobs, args.queue_size,
+        converter_args, args.in_file))
+    for (in_file, error) in results:
+        if error: print(f'Failed: {in_file} ({error})', file=sys.stderr)
+    print(f'Converted: {sum(1 for r in results if r[1] is None)}/'
+          f'{len(results)}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
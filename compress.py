@@ -0,0 +1,127 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for writing compressed output (gpx, csv, etc.).
+
+gzip and xz of the standard library are chosen by the suffix of the output
+path (.gz/.xz), which the converters append by --compress.  Output is written
+through the compressor in chunks, so the uncompressed document does not need
+to exist in memory (see Gpx.write() in mini_gpx.py).  Sizes and throughput are
+reported to stderr if REPORT is set.
+"""
+import io
+import sys
+import gzip
+import lzma
+import time
+import argparse
+
+SUFFIXES = {'.gz': 'gz', '.xz': 'xz'}
+LEVEL = None # Compression level, 1-9 (gz) or 0-9 (xz).  Defaults if None.
+REPORT = False # Report sizes and throughput of each output to stderr.
+
+def compression_of(path):
+    """'gz', 'xz' or None by the suffix of a path object.
+
+    >>> from pathlib import Path
+    >>> compression_of(Path('W123.gpx.gz')), compression_of(Path('W123.gpx'))
+    ('gz', None)
+    """
+    return SUFFIXES.get(path.suffix.lower())
+
+def with_suffix(path, compression=None):
+    """Appends the suffix of compression (if any) to a path object.
+
+    >>> from pathlib import Path
+    >>> str(with_suffix(Path('W123.gpx'), 'xz'))
+    'W123.gpx.xz'
+    """
+    return path.with_name(f'{path.name}.{compression}') if compression else path
+
+def to_bytes(write, compression=None, level=None):
+    """Calls write(f) with a binary file object and returns the bytes.
+
+    The bytes are compressed as they are written, e.g. gpx in a worker process
+    of async_convert.py.
+    """
+    if level is None: level = LEVEL
+    buffer = io.BytesIO()
+    if compression == 'gz':
+        f = gzip.GzipFile(fileobj=buffer, mode='wb', 
+                          compresslevel=9 if level is None else level)
+    elif compression == 'xz':
+        f = lzma.LZMAFile(buffer, mode='wb', preset=level)
+    else:
+        write(buffer)
+        return buffer.getvalue()
+    with f:
+        write(f)
+    return buffer.getvalue()
+
+class CountingWriter(object):
+    """A binary file object that counts the bytes before compression."""
+    def __init__(self, f):
+        (self.f, self.count) = (f, 0)
+
+    def write(self, data):
+        self.count += len(data)
+        return self.f.write(data)
+
+def report(path, raw_size, elapsed, file=None):
+    """Prints sizes before/after compression and throughput (MB/s)."""
+    size = path.stat().st_size
+    print(f'{path.name}: {raw_size / 1e6:.2f} MB -> {size / 1e6:.2f} MB '
+          f'({size / max(raw_size, 1):.1%}), '
+          f'{raw_size / 1e6 / max(elapsed, 1e-9):.1f} MB/s',
+          file=file or sys.stderr)
+
+def open_output(path, mode='wb', level=None):
+    """Opens a path object for writing, compressed by its suffix (.gz/.xz).
+
+    Args:
+        path: a path object.
+        mode (optional): 'wb' or 'wt' (text, utf-8).
+        level (optional): compression level.  Defaults to LEVEL.
+
+    Returns:
+        a file object.
+    """
+    if level is None: level = LEVEL
+    kwargs = {'encoding': 'utf-8', 'newline': ''} if 't' in mode else {}
+    compression = compression_of(path)
+    if compression == 'gz':
+        return gzip.open(path, mode, 9 if level is None else level, **kwargs)
+    elif compression == 'xz':
+        return lzma.open(path, mode, preset=level, **kwargs)
+    return open(path, mode, **kwargs)
+
+def write_to(path, write, level=None):
+    """Calls write(f) with a binary file object of the (compressed) path.
+
+    Sizes and throughput are reported if REPORT and the path is compressed.
+    """
+    start = time.perf_counter()
+    with open_output(path, level=level) as f:
+        counter = CountingWriter(f)
+        write(counter)
+    if REPORT and compression_of(path):
+        report(path, counter.count, time.perf_counter() - start)
+
+def add_arguments(parser):
+    """Adds options of compression to an argparse parser."""
+    group = parser.add_argument_group('compression')
+    group.add_argument('--compress', choices=tuple(SUFFIXES.values()),
+                       help='write compressed gpx (*.gpx.gz or *.gpx.xz).  '
+                       'Sizes and throughput are reported to stderr.')
+    group.add_argument('--compress-level', type=int, metavar='LEVEL',
+                       help='compression level, 1-9 (gz, default 9) or 0-9 '
+                       '(xz, default 6).')
+
+def parse_arguments(argv):
+    """Options of compression in argv, e.g. of the converters, as a namespace.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(parser)
+    return parser.parse_known_args(argv)[0]
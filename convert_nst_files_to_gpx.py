@@ -11,30 +11,157 @@ Gpx writing part depends on lxml and its use is strongly recommended due to
 performance reasons, though a fallback to built-in ElementTree is implemented.
 For temporal track files (Rec*.tmp), use convert_nst_rec_to_gpx.py.
 """
-from os import getenv
+from os import getenv, cpu_count
 import sys
+import time
+import struct
+import argparse
+from contextlib import nullcontext
 from pathlib import Path
 
 import nst
+import simplify
+import resample
+import outliers
+import compress
+import memory
+import writers
+import manifest
+import analytics
+import spatial_index
+import pack
+import parallel_decode
+import aggregates
 (CONFIG, TRACK, ROUTE, TMP) = (nst.CONFIG, nst.TRACK, nst.ROUTE, nst.TMP)
+# Errors of a broken (e.g. truncated) file; SystemExit is of errors in nst.py.
+DECODE_ERRORS = (SystemExit, OSError, ValueError, OverflowError, struct.error)
+
+def make_parser(prog=''):
+    """Makes an argparse parser of the command line arguments.
+
+    Also used to make default args, e.g. make_parser().parse_args([in_file]).
+    """
+    parser = argparse.ArgumentParser(
+        usage=f'# python {prog} [options] input_filename [...]',
+        description='This script reads track/route files (W*.dat/R*.dat) of '
+        'the old-version and track files of the new-version (W*.dat) Symbian '
+        '(Nokia) SportsTracker.\n Track files with heart-rate sensor (the new '
+        'ver.) were not tested.')
+    parser.add_argument('in_file', type=Path, nargs='+', 
+                        metavar='input_filename', help='track/route files or '
+                        'directories to search W*.dat and R*.dat (batch mode).'
+                        '  - to read stdin, e.g. in a pipeline.')
+    parser.add_argument('-o', '--output-dir', type=Path, metavar='DIR', 
+                        help='write gpx files in the directory, under the '
+                        'relative paths in the directories given.  Gpx files '
+                        'are written next to the input files in batch mode if '
+                        'not specified.')
+    parser.add_argument('--lean', action='store_true', help='omit name/desc '
+                        'in each trackpt and use fixed-precision numbers.')
+    parser.add_argument('--fit', action='store_true', help='write FIT files '
+                        '(*.fit) of tracks instead of gpx, see fit.py.')
+    parser.add_argument('--start-time', type=nst.parse_utc, metavar='UTC', 
+                        help='start time of routes in ISO-8601, e.g. '
+                        '2009-08-27T09:00:00.  Defaults to mtime of the file.')
+    outliers.add_arguments(parser)
+    simplify.add_arguments(parser)
+    resample.add_arguments(parser)
+    compress.add_arguments(parser)
+    memory.add_arguments(parser)
+    writers.add_arguments(parser)
+    parallel_decode.add_arguments(parser)
+    analytics.add_arguments(parser)
+    parser.add_argument('--index', type=Path, metavar='SQLITE_FILE', 
+                        help='add the tracks to a spatial index, see '
+                        'spatial_index.py.')
+    parser.add_argument('--pack', type=Path, metavar='PACK_FILE', 
+                        help='write the decoded tracks to a pack file for '
+                        'instant reload, see pack.py.')
+    parser.add_argument('--aggregates', type=Path, metavar='SQLITE_FILE', 
+                        help='add the tracks to the totals by activity and '
+                        'period, see aggregates.py.')
+    parser.add_argument('--manifest', type=Path, metavar='JSONL_FILE', 
+                        help='record converted files in the manifest and skip '
+                        'them when the batch is restarted, see manifest.py.')
+    parser.add_argument('--dedup', action='store_true', help='skip duplicate '
+                        'tracks (e.g. truncated copies in other backups) but '
+                        'the most complete one, see dedup.py.')
+    return parser
+
+# Options handled in main(), not by convert() called e.g. in worker processes.
+MAIN_OPTIONS = ('--fit', '--csv', '--database', '--decode-jobs', '--records', 
+                '--index', '--pack', '--aggregates', '--manifest', '--dedup', 
+                '--memory-dump')
+def main_options(converter_args, options=MAIN_OPTIONS):
+    """Options in the arguments which are only handled in main().
+
+    >>> main_options(['--lean', '--pack', 'tracks.pack', '--decode-jobs=1'])
+    ['--pack']
+    """
+    parser = make_parser()
+    (args, defaults) = (parser.parse_args([*converter_args, '-']), 
+                        parser.parse_args(['-']))
+    return [option for option in options 
+            if getattr(args, option[2:].replace('-', '_')) 
+            != getattr(defaults, option[2:].replace('-', '_'))]
 
 def args_usage():
     """A blief explanation of usage and handling of command line arguments.
 
     Returns:
-        in_file: a path object of input file.
+        args: a namespace of arguments.  args.in_file is a list of path 
+            objects of input files/directories.
     """
     argvs = sys.argv
     argc = len(argvs)
+    parser = make_parser(argvs[0])
     if argc < 2:
-        print(f'Usage: # python {argvs[0]} input_filename\n'
-              'This script reads track/route files (W*.dat/R*.dat) of the old-'
-              'version and track files of the new-version (W*.dat) Symbian '
-              '(Nokia) SportsTracker.\n Track files with heart-rate sensor ('
-              'the new ver.) were not tested.')
+        parser.print_help()
         sys.exit(0)
-    in_file = Path(argvs[1])
-    return in_file
+    args = parser.parse_args()
+    if args.fit: # Outputs of to_gpx() and convert(), not fed by fit.py.
+        options = [option for (option, value) in (
+            ('--csv', args.csv), ('--database', args.database), 
+            ('--records', args.records), ('--splits', args.splits), 
+            ('--index', args.index), ('--pack', args.pack), 
+            ('--compress', args.compress), ('--max-memory', args.max_memory))
+                   if value]
+        if options: 
+            parser.error(f'not supported with --fit: {", ".join(options)}')
+    return args
+
+def process_and_store(trackpts, args, pause_list=None, store=None):
+    """Filter/resample/simplify the trackpoints and store them.
+
+    Points-in vs points-out is reported to stderr.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        args: a namespace of arguments.
+        pause_list (optional): a list from nst.read_pause_data(), see 
+            resample.find_breaks().
+        store (optional): a function to handle each trackpt_store.  Defaults 
+            to nst.store_trackpt.
+    """
+    if store is None: store = nst.store_trackpt
+    if args.filter:
+        (trackpts, num_replaced) = outliers.filter_outliers(
+            trackpts, nst.activity_type, args.filter_window, args.filter_sigma)
+        print(f'Filtered: {num_replaced} of {len(trackpts)} trackpts '
+              'replaced.', file=sys.stderr)
+    if args.resample:
+        resampled = resample.resample(trackpts, args.resample, pause_list)
+        print(f'Resampled: {len(trackpts)} -> {len(resampled)} trackpts.', 
+              file=sys.stderr)
+        trackpts = resampled
+    simplified = simplify.simplify(
+        trackpts, tolerance=args.rdp, min_distance=args.min_distance, 
+        min_time=args.min_time)
+    if args.rdp or args.min_distance or args.min_time:
+        print(f'Simplified: {len(trackpts)} -> {len(simplified)} trackpts.', 
+              file=sys.stderr)
+    for tp in simplified:
+        store(tp)
 
 def check_file_type_version(f):
     """Checks if it is the correct file by reading app_id, file_type & version.
@@ -127,8 +254,7 @@ def parse_track_informations(f, ver=1):
     # Type of activity.  Walk, run, bicycle, etc. See ACTIVITIES in nst.py.
     f.seek(0x00004, 1) # Skip 4 bytes.
     (activity, ) = nst.read_unpack('<H', f) # 2 bytes, little endian U16.
-    nst.activity_type = (str(activity) if activity >= len(nst.ACTIVITIES) 
-                         else nst.ACTIVITIES[activity])
+    nst.activity_type = nst.activity_name(activity) # Config.dat if custom.
     #print(f'Activity: {nst.activity_type}')
 
     # Read SCSU encoded name of the track, which is usually the datetime.
@@ -193,12 +319,18 @@ def parse_route_informations(f, ver=1):
     del ver, route_id # Not in use.
 
 PRINT_PAUSE_LIST = False
-def read_pause_and_track(f, start_address):
+def read_pause_and_track(f, start_address, store=None, pauses=None, 
+                         **kwargs):
     """Reads the main part that consisits of a pause- and a track-data blocks.
 
     Args:
         f: the file object.
         start_address: the address of the main part.
+        store (optional): a function to handle each trackpt_store.  Defaults 
+            to nst.store_trackpt.
+        pauses (optional): a list to be extended with the pause_list, which 
+            is consumed in nst.read_trackpoints().
+        kwargs: passed to nst.read_trackpoints(), e.g. checkpoints.
 
     Returns:
         trackpt_store: the last trackpoint after processing.
@@ -208,45 +340,290 @@ def read_pause_and_track(f, start_address):
     (pause_list, pause_count) = (([], None) if nst.FILE_TYPE in {ROUTE, TMP} 
                                   else nst.read_pause_data(f))
     if PRINT_PAUSE_LIST and pause_list: nst.print_pause_list(pause_list)
+    if pauses is not None: pauses.extend(pause_list)
     #sys.exit(0)
 
     # Read trackpoint data.  The last trackpt_store is necessary in summarizing.
-    (track_count, trackpt_store) = nst.read_trackpoints(f, pause_list)
+    # Large ones are decoded in parallel by --decode-jobs.
+    (track_count, trackpt_store) = parallel_decode.read_trackpoints(
+        f, pause_list, store, **kwargs)
     del pause_count, track_count # Not in use.
     return trackpt_store
 
-WRITE_FILE = False
-def main():
-    in_file = args_usage() # Arguments and help.
+def find_files(paths, patterns=('W*.dat', 'R*.dat')):
+    """Expands directories in paths to track/route files in them (batch mode).
+
+    Returns:
+        a list of path objects.
+    """
+    in_files = []
+    for path in paths:
+        if path.is_dir():
+            in_files.extend(sorted(
+                p for pattern in patterns for p in path.rglob(pattern)))
+        else:
+            in_files.append(path)
+    return in_files
+
+def relative_output(in_file, roots):
+    """Relative path of gpx of a file, mirroring the directories under roots.
+
+    Args:
+        in_file: a path object from find_files().
+        roots: path objects given to find_files().
+
+    >>> str(relative_output(Path('backup/E/W1.dat'), [Path('backup')]))
+    'E/W1.gpx'
+    >>> str(relative_output(Path('other/W1.dat'), [Path('backup')]))
+    'W1.gpx'
+    """
+    for root in roots:
+        if root in in_file.parents:
+            return in_file.relative_to(root).with_suffix('.gpx')
+    return Path(f'{in_file.stem}.gpx')
+
+def output_collisions(in_files, roots):
+    """Files of the same relative_output(), as strings joined by 'and'."""
+    outputs = {}
+    for in_file in in_files:
+        outputs.setdefault(relative_output(in_file, roots), []).append(
+            str(in_file))
+    return [' and '.join(v) for v in outputs.values() if len(v) > 1]
+
+def read_informations_and_track(f, version, store=None, pauses=None, 
+                                **kwargs):
+    """Reads a track/route file after check_file_type_version().
+
+    Args:
+        f: the file object.
+        version: int 0, 1, 2 from check_file_type_version().
+        store (optional): a function to handle each trackpt_store.  Defaults 
+            to nst.store_trackpt.
+        pauses (optional): a list to be extended with the pause_list.
+        kwargs: passed to nst.read_trackpoints(), e.g. checkpoints.
+
+    Returns:
+        trackpt_store: the last trackpoint after processing.
+    """
+    #f.seek(0x0000C, 0) # Go to 0x0000C, this address is fixed.
+    # Usually, start address (4 bytes, little endian U32) of the main part 
+    # which consists of a pause- and a trackpoint-data blocks are:
+    #     in the new track 0x0800 = 0x07ff + 0x1, 
+    #        the old track 0x0400 = 0x03ff + 0x1 and 
+    #        the old route 0x0100 = 0x00ff + 0x1 but can be changed.
+    (start_address, ) = nst.read_unpack('<I', f)
+    start_address -= 1
+    #print(f'Main part address: {hex(start_address)}')
+
+    # Read information part of track/route files.
+    if nst.FILE_TYPE == TRACK:
+        parse_track_informations(f, version) # START_*TIME, TZ_HOURS.
+    else: # if nst.FILE_TYPE == ROUTE:
+        parse_route_informations(f, version)
+
+    # Read the main part consisting a pause- and a trackpoint-data blocks.
+    return read_pause_and_track(f, start_address, store, pauses, **kwargs)
+
+def read_file(in_file, store=None, pauses=None, **kwargs):
+    """Reads a track/route file without gpx, e.g. to collect trackpoints.
+
+    Module-level variables in nst.py (FILE_TYPE, START_TIME, etc.) are set.
 
-    with in_file.open(mode='rb') as f:
+    Args:
+        in_file: a path object of input file.
+        store (optional): a function to handle each trackpt_store.  Defaults 
+            to nst.store_trackpt.
+        pauses (optional): a list to be extended with the pause_list.
+        kwargs: passed to nst.read_trackpoints(), e.g. checkpoints.
+
+    Returns:
+        trackpt_store: the last trackpoint after processing.
+    """
+    nst.initialize_variables() # Not to take over those of the previous file.
+    nst.use_config(in_file.parent) # Lookup tables in config.dat, cached.
+    with nst.open_input(in_file) as f: # Stdin if '-'.
         version = check_file_type_version(f) # FILE_TYPE(int), NEW_FORMAT(bool).
-        (gpx, nst.gpx_target) = nst.initialize_gpx()
+        return read_informations_and_track(
+            f, version, store, pauses, **kwargs)
+
+def to_gpx(in_file, args, records=None, index=None, file_obj=None, 
+           config=None, packer=None, tracker=None):
+    """Reads a track/route file and makes gpx, see convert().
 
-        #f.seek(0x0000C, 0) # Go to 0x0000C, this address is fixed.
-        # Usually, start address (4 bytes, little endian U32) of the main part 
-        # which consists of a pause- and a trackpoint-data blocks are:
-        #     in the new track 0x0800 = 0x07ff + 0x1, 
-        #        the old track 0x0400 = 0x03ff + 0x1 and 
-        #        the old route 0x0100 = 0x00ff + 0x1 but can be changed.
-        (start_address, ) = nst.read_unpack('<I', f)
-        start_address -= 1
-        #print(f'Main part address: {hex(start_address)}')
-
-        # Read information part of track/route files.
-        if nst.FILE_TYPE == TRACK:
-            parse_track_informations(f, version) # START_*TIME, TZ_HOURS.
-        else: # if nst.FILE_TYPE == ROUTE:
-            parse_route_informations(f, version)
-
-        # Read the main part consisting a pause- and a trackpoint-data blocks.
-        trackpt_store = read_pause_and_track(f, start_address)
+    Args:
+        in_file: a path object of input file.
+        args: a namespace of arguments.
+        records (optional): analytics.PersonalRecords to be updated.
+        index (optional): spatial_index.SpatialIndex to be updated.
+        file_obj (optional): a binary file object to read instead of opening 
+            in_file, e.g. io.BytesIO of the contents read beforehand.
+        config (optional): (users, activities) lookup tables to use instead 
+            of config.dat in the directory of in_file, see nst.use_config().
+        packer (optional): pack.PackWriter to be appended.
+        tracker (optional): memory.Tracker to measure the decoding apart from 
+            making the gpx.
 
+    Returns:
+        gpx: see Gpx() class in mini_gpx.py.
+    """
+    nst.initialize_variables() # Not to take over those of the previous file.
+    nst.use_config(in_file.parent, config) # config.dat, cached per dir.
+    nst.ROUTE_START_TIME = args.start_time # Mtime of the file if None.
+    # Trackpoints are collected in a list if resampling/simplification is 
+    # required, or to be stored after the decoding is measured.  Analytics 
+    # uses the trackpoints before processing.
+    processing = (args.filter or args.resample or args.rdp 
+                  or args.min_distance or args.min_time)
+    deferred = processing or tracker is not None
+    analyzing = (records is not None or args.splits or index is not None 
+                 or packer is not None)
+    (trackpts, pause_list) = ([], [])
+    def collect_and_store(tp):
+        trackpts.append(tp)
+        nst.store_trackpt(tp)
+    store = (trackpts.append if deferred 
+             else collect_and_store if analyzing else None)
+
+    with (nst.open_input(in_file) if file_obj is None # Stdin if '-'.
+          else nullcontext(file_obj)) as f:
+        version = check_file_type_version(f) # FILE_TYPE(int), NEW_FORMAT(bool).
+        (gpx, nst.gpx_target) = nst.initialize_gpx()
+        trackpt_store = read_informations_and_track(
+            f, version, store, pause_list)
+    if tracker is not None: tracker.stage('read_trackpoints')
+
+    if analyzing and nst.FILE_TYPE == TRACK: # No times in routes.
+        analysis = analytics.analyze(trackpts, args.unit)
+        if args.splits:
+            print(f'Splits: {in_file}', file=sys.stderr)
+            analytics.print_splits(analysis, args.unit, file=sys.stderr)
+        if records is not None:
+            records.update(analysis, nst.activity_type, str(in_file), 
+                           nst.format_datetime(nst.START_LOCALTIME))
+
+    if index is not None:
+        index.add_track(in_file, trackpts, nst.track_name 
+                        if nst.FILE_TYPE == TRACK else nst.route_name)
+    if packer is not None: packer.add_decoded(in_file, trackpts)
+
+    if processing:
+        process_and_store(trackpts, args, pause_list)
+    elif deferred:
+        for tp in trackpts: nst.store_trackpt(tp)
     nst.add_gpx_summary(gpx, trackpt_store)
+    return gpx
+
+def convert(in_file, args, gpx_path=None, records=None, index=None, 
+            packer=None):
+    """Reads a track/route file and writes gpx, see main().
+
+    Args:
+        in_file: a path object of input file.
+        args: a namespace of arguments.
+        gpx_path (optional): a path object to write gpx (or print if None).
+        records (optional): analytics.PersonalRecords to be updated.
+        index (optional): spatial_index.SpatialIndex to be updated.
+        packer (optional): pack.PackWriter to be appended.
 
-    write_file = getenv('GPX_WRITE_FILE') or WRITE_FILE
-    gpx_path = in_file.with_suffix('.gpx') if write_file else None
-    nst.finalize_gpx(gpx, gpx_path) # Gpx xml to a file or print (if None).
+    Returns:
+        number of trackpoints (routepoints) written.
+    """
+    tracker = memory.start(in_file, args.max_memory) # --max-memory.
+    with writers.feeding(in_file, gpx_path): # --csv, --database.
+        gpx = to_gpx(in_file, args, records, index, packer=packer, 
+                     tracker=tracker)
+        num_points = len(gpx)
+        if tracker is not None: tracker.stage('append_trkpt')
+        nst.finalize_gpx(gpx, gpx_path) # Gpx xml to a file or print.
+    if tracker is not None:
+        tracker.stage('to_xml')
+        tracker.finish()
+    return num_points
+
+WRITE_FILE = False
+def main():
+    args = args_usage() # Arguments and help.
+    nst.LEAN = args.lean # Lean gpx w/o name/desc in trackpts.
+    (compress.LEVEL, compress.REPORT) = (args.compress_level, 
+                                         bool(args.compress))
+    parallel_decode.JOBS = args.decode_jobs or cpu_count() or 1
+    memory.DUMP = (args.memory_dump.open(mode='a', encoding='utf-8') 
+                   if args.max_memory and args.memory_dump else None)
+    # Batch mode if more than one file (or directories) are given.
+    in_files = find_files(args.in_file)
+    batch = len(in_files) > 1 or any(p.is_dir() for p in args.in_file)
+    if args.dedup:
+        import dedup # Header parsers of this module are used in dedup.
+        (in_files, duplicates) = dedup.find_duplicates(in_files)
+        for (duplicate, kept) in duplicates.items():
+            print(f'Skipped: {duplicate} (duplicate of {kept})', 
+                  file=sys.stderr)
+    if args.output_dir: # Not to overwrite gpx of the same relative path.
+        collisions = output_collisions(in_files, args.in_file)
+        if collisions:
+            print('The same output of ' + ', '.join(collisions), 
+                  file=sys.stderr)
+            sys.exit(1)
+    records = analytics.PersonalRecords(args.unit) if args.records else None
+    index = spatial_index.SpatialIndex(args.index) if args.index else None
+    packer = pack.PackWriter(args.pack) if args.pack else None
+    nst.WRITERS = writers.from_args(args) # Fed in the same pass as gpx.
+    totals = (aggregates.Aggregates(args.aggregates) if args.aggregates 
+              else None)
+    manifest_file = manifest.Manifest(args.manifest) if args.manifest else None
+    if manifest_file is not None: # Resume the batch.
+        num_files = len(in_files)
+        in_files = [p for p in in_files if not manifest_file.is_done(p)]
+        print(f'Done in the manifest: {num_files - len(in_files)}', 
+              file=sys.stderr)
+    progress = manifest.Progress(in_files) if batch else None
+
+    write_file = (getenv('GPX_WRITE_FILE') or WRITE_FILE or batch 
+                  or args.output_dir or args.fit)
+    if args.fit: import fit # Header parsers of this module are used in fit.
+    if args.output_dir: args.output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        for in_file in in_files:
+            gpx_path = (None if not write_file 
+                        else args.output_dir 
+                        / relative_output(in_file, args.in_file) 
+                        if args.output_dir else in_file.with_suffix('.gpx'))
+            if str(in_file) == '-' and not args.output_dir: gpx_path = None
+            if gpx_path is not None and args.fit:
+                gpx_path = gpx_path.with_suffix('.fit')
+            elif gpx_path is not None: # *.gpx.gz or *.gpx.xz by --compress.
+                gpx_path = compress.with_suffix(gpx_path, args.compress)
+            (start, status, num_points) = (time.perf_counter(), None, None)
+            try:
+                if args.output_dir: gpx_path.parent.mkdir(exist_ok=True, 
+                                                          parents=True)
+                num_points = (fit.convert(in_file, args, gpx_path) if args.fit 
+                              else convert(in_file, args, gpx_path, records, 
+                                           index, packer))
+                status = 'ok'
+            except DECODE_ERRORS as error: # Skip the file in batch mode.
+                # Errors of input/output (e.g. disk full) are retried.
+                (status, gpx_path) = (
+                    'error' if isinstance(error, OSError) else 'failed', None)
+                if not batch: raise
+                print(f'Failed to convert: {in_file} ({error!r})', 
+                      file=sys.stderr)
+            finally: # Failed ones too, not to be retried on resume.
+                if manifest_file is not None and status is not None:
+                    manifest_file.append(in_file, status, gpx_path, 
+                                         num_points, 
+                                         time.perf_counter() - start)
+            if totals is not None and status == 'ok' and str(in_file) != '-':
+                totals.add(in_file, aggregates.header_values() 
+                           if nst.FILE_TYPE == TRACK else None) # By convert.
+            if progress is not None: progress.update(in_file, num_points)
+    finally: # Also of errors, not to lose the files done.
+        if records is not None: records.write_csv(args.records)
+        if index is not None: index.close()
+        if packer is not None: packer.close()
+        for writer in nst.WRITERS: writer.close()
+        if totals is not None: totals.close()
+        if manifest_file is not None: manifest_file.close()
 
 
 if __name__ == '__main__':
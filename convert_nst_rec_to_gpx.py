@@ -14,26 +14,79 @@ For usual track/route files (W*.dat/R*.dat), use convert_nst_files_to_gpx.py.
 from os import getenv
 import sys
 import struct
+import argparse
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
 
 import nst
+import simplify
+import resample
+import outliers
+import compress
+import memory
+import writers
 (CONFIG, TRACK, ROUTE, TMP) = (nst.CONFIG, nst.TRACK, nst.ROUTE, nst.TMP)
 
+def make_parser(prog=''):
+    """Makes an argparse parser of the command line arguments.
+
+    Also used to make default args, e.g. make_parser().parse_args([in_file]).
+    """
+    parser = argparse.ArgumentParser(
+        usage=f'# python {prog} [options] input_filename',
+        description='This script reads temporal track log files (Rec*.tmp) of '
+        'symbian SportsTracker.  Log files with heart-rate sensor were not '
+        'tested.')
+    parser.add_argument('in_file', type=Path, metavar='input_filename', 
+                        help='a Rec*.tmp file, or - to read stdin.')
+    parser.add_argument('--lean', action='store_true', help='omit name/desc '
+                        'in each trackpt and use fixed-precision numbers.')
+    outliers.add_arguments(parser)
+    simplify.add_arguments(parser)
+    resample.add_arguments(parser)
+    compress.add_arguments(parser)
+    memory.add_arguments(parser)
+    writers.add_arguments(parser)
+    return parser
+
 def args_usage():
     """A blief explanation of usage and handling of command line arguments.
 
     Returns:
-        in_file: a path object of input file.
+        args: a namespace of arguments.  args.in_file is a path object of 
+            input file.
     """
     argvs = sys.argv
     argc = len(argvs)
+    parser = make_parser(argvs[0])
     if argc < 2:
-        print(f'Usage: # python {argvs[0]} input_filename\n'
-            'This script reads temporal track log files (Rec*.tmp) of symbian'
-            'SportsTracker.  Log files with heart-rate sensor were not tested.')
+        parser.print_help()
         sys.exit(0)
-    in_file = Path(argvs[1])
-    return in_file
+    return parser.parse_args()
+
+def process_and_store(trackpts, args):
+    """Filter/resample/simplify the trackpoints and store them.
+
+    Points-in vs points-out is reported to stderr.
+    """
+    if args.filter:
+        (trackpts, num_replaced) = outliers.filter_outliers(
+            trackpts, nst.activity_type, args.filter_window, args.filter_sigma)
+        print(f'Filtered: {num_replaced} of {len(trackpts)} trackpts '
+              'replaced.', file=sys.stderr)
+    if args.resample:
+        resampled = resample.resample(trackpts, args.resample)
+        print(f'Resampled: {len(trackpts)} -> {len(resampled)} trackpts.', 
+              file=sys.stderr)
+        trackpts = resampled
+    simplified = simplify.simplify(
+        trackpts, tolerance=args.rdp, min_distance=args.min_distance, 
+        min_time=args.min_time)
+    if args.rdp or args.min_distance or args.min_time:
+        print(f'Simplified: {len(trackpts)} -> {len(simplified)} trackpts.', 
+              file=sys.stderr)
+    for tp in simplified:
+        nst.store_trackpt(tp)
 
 def check_file_type_version(f):
     """Checks if it is the correct file by reading app_id, file_type & version.
@@ -132,8 +185,7 @@ def parse_track_informations(f, ver=1):
     # Type of activity.  Walk, run, bicycle, etc. See ACTIVITIES in nst.py.
     f.seek(0x00004, 1) # Skip 4 bytes.
     (activity, ) = nst.read_unpack('<H', f) # 2 bytes, little endian U16.
-    nst.activity_type = (str(activity) if activity >= len(nst.ACTIVITIES) 
-                         else nst.ACTIVITIES[activity])
+    nst.activity_type = nst.activity_name(activity) # Config.dat if custom.
     print(f'Activity: {nst.activity_type}')
 
     # Read SCSU encoded name of the track, which is usually the datetime.
@@ -171,12 +223,16 @@ def parse_track_informations(f, ver=1):
         if nst.comment: print(f'Comment: {nst.comment}')
 
 PRINT_PAUSE_LIST = False
-def read_pause_and_track(f, start_address):
+def read_pause_and_track(f, start_address, store=None, hold_spikes=True):
     """Reads the main part that consisits of a mixed pause-/track-data block.
 
     Args:
         f: the file object.
         start_address: the address of the main part.
+        store (optional): a function to handle each trackpt_store.  Defaults 
+            to nst.store_trackpt.
+        hold_spikes (optional): replace spikes in y, x and z by the previous 
+            values.  False to leave them to outliers.filter_outliers().
 
     Returns:
         trackpt_store: the last trackpoint after processing.
@@ -194,6 +250,8 @@ def read_pause_and_track(f, start_address):
         print(*trackpt)
         print(t_time, y_degree, x_degree, z_ax, v, dist, unix_time)
 
+    if store is None: store = nst.store_trackpt
+
     f.seek(start_address, 0) # Go to the start address of the main part.
     # Read pause data.  There is no pause data in route file.
     (pause_list, pause_count) = (([], None) if nst.FILE_TYPE in {ROUTE, TMP} 
@@ -304,8 +362,8 @@ def read_pause_and_track(f, start_address):
             t_time = trackpt_store.t_time + delta_unix_time
             print(f'Bad totaltime at: {hex(pointer)}')
 
-        if track_count > 0: # Use previous values for spikes in y, x, z 
-            # and total_distance.  Interpolation would be a better choice.
+        if track_count > 0 and hold_spikes: # Use previous values for spikes 
+            # in y, x, z.  Interpolation by --filter is a better choice.
             if abs(trackpt_store.y_degree - y_degree) >= 0.001: # degree.
                 y_degree = trackpt_store.y_degree
                 print(f'Bad y at: {hex(pointer)}')
@@ -323,17 +381,40 @@ def read_pause_and_track(f, start_address):
             x_degree=x_degree, z_ax=z_ax, v=v, d_dist=d_dist, 
             dist=dist, track_count=track_count, file_type=nst.FILE_TYPE)
 
-        nst.store_trackpt(trackpt_store)
+        store(trackpt_store)
 
         track_count += 1
 
     return trackpt_store
 
-WRITE_FILE = True
-def main():
-    in_file = args_usage() # Arguments and help.
+def to_gpx(in_file, args, file_obj=None, config=None, tracker=None):
+    """Reads a temporal track log file and makes gpx, see convert().
+
+    Args:
+        in_file: a path object of input file.
+        args: a namespace of arguments.
+        file_obj (optional): a binary file object to read instead of opening 
+            in_file, e.g. io.BytesIO of the contents read beforehand.
+        config (optional): (users, activities) lookup tables to use instead 
+            of config.dat in the directory of in_file, see nst.use_config().
+        tracker (optional): memory.Tracker to measure the decoding apart from 
+            making the gpx.
 
-    with in_file.open(mode='rb') as f:
+    Returns:
+        gpx: see Gpx() class in mini_gpx.py.
+    """
+    nst.initialize_variables() # Not to take over those of the previous file.
+    # Trackpoints are collected in a list if resampling/simplification is 
+    # required, or to be stored after the decoding is measured.
+    processing = (args.filter or args.resample or args.rdp 
+                  or args.min_distance or args.min_time)
+    deferred = processing or tracker is not None
+    trackpts = []
+
+    nst.use_config(in_file.parent, config) # Lookup tables in config.dat.
+    # Read stdin/pipes in memory, since the labels are searched by seeking.
+    with (nst.open_input(in_file, None) if file_obj is None # Stdin if '-'.
+          else nullcontext(file_obj)) as f:
         version = check_file_type_version(f) # FILE_TYPE(int), NEW_FORMAT(bool).
         (gpx, nst.gpx_target) = nst.initialize_gpx()
 
@@ -345,14 +426,57 @@ def main():
         parse_track_informations(f, version) # START_*TIME, TZ_HOURS.
 
         # Read the main part consisting a pause- and a trackpoint-data blocks.
-        trackpt_store = read_pause_and_track(f, start_address)
-
+        trackpt_store = read_pause_and_track(
+            f, start_address, trackpts.append if deferred else None, 
+            hold_spikes=not args.filter)
+    if tracker is not None: tracker.stage('read_trackpoints')
+
+    if processing:
+        process_and_store(trackpts, args)
+    elif deferred:
+        for tp in trackpts: nst.store_trackpt(tp)
     nst.add_gpx_summary(gpx, trackpt_store)
+    return gpx
 
-    write_file = getenv('GPX_WRITE_FILE') or WRITE_FILE
-    gpx_path = in_file.with_suffix('.gpx') if write_file else None
-    nst.finalize_gpx(gpx, gpx_path) # Gpx xml to a file or print (if None).
+def convert(in_file, args, gpx_path=None):
+    """Reads a temporal track log file and writes gpx, see main().
+
+    Args:
+        in_file: a path object of input file.
+        args: a namespace of arguments.
+        gpx_path (optional): a path object to write gpx (or print if None).
+    """
+    tracker = memory.start(in_file, args.max_memory) # --max-memory.
+    with writers.feeding(in_file, gpx_path): # --csv, --database.
+        # Messages of decoding to stderr if gpx is printed, e.g. of stdin.
+        with (redirect_stdout(sys.stderr) if gpx_path is None 
+              else nullcontext()):
+            gpx = to_gpx(in_file, args, tracker=tracker)
+        if tracker is not None: tracker.stage('append_trkpt')
+        nst.finalize_gpx(gpx, gpx_path) # Gpx xml to a file or print.
+    if tracker is not None:
+        tracker.stage('to_xml')
+        tracker.finish()
+
+WRITE_FILE = True
+def main():
+    args = args_usage() # Arguments and help.
+    nst.LEAN = args.lean # Lean gpx w/o name/desc in trackpts.
+    (compress.LEVEL, compress.REPORT) = (args.compress_level, 
+                                         bool(args.compress))
+    memory.DUMP = (args.memory_dump.open(mode='a', encoding='utf-8') 
+                   if args.max_memory and args.memory_dump else None)
+    in_file = args.in_file
 
+    write_file = getenv('GPX_WRITE_FILE') or WRITE_FILE
+    gpx_path = (compress.with_suffix(in_file.with_suffix('.gpx'), 
+                                     args.compress) # --compress.
+                if write_file and str(in_file) != '-' else None)
+    nst.WRITERS = writers.from_args(args) # Fed in the same pass as gpx.
+    try:
+        convert(in_file, args, gpx_path)
+    finally: # Also of errors, to flush the rows of --database.
+        for writer in nst.WRITERS: writer.close()
 
 if __name__ == '__main__':
     main()
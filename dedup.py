@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module to find duplicate tracks/routes in overlapping phone backups.
+
+Each file is fingerprinted without decoding the trackpoints:
+1) key: file type, track (route) id, start time in UTC and user id from the
+   header (see parse_track_informations()).
+2) hashes of every CHUNK_SIZE bytes of the main part (the pause- and the
+   trackpoint-data blocks), made in a single sequential read.
+Files of the same key are duplicates if the main part of one is a prefix of
+that of the other, e.g. a copy truncated in a backup; the hashes of the full
+chunks are compared and only the last partial chunk is read again.  The most
+complete (longest) one is kept.  Files of the same key with different contents
+are not regarded as duplicates.
+
+Usage:
+    python dedup.py input_files_or_directories
+prints "keep" or "duplicate" (of the kept file) of each file.
+"""
+import sys
+import struct
+import hashlib
+import argparse
+from collections import namedtuple
+from pathlib import Path
+
+import nst
+import convert_nst_files_to_gpx as converter
+
+CHUNK_SIZE = 0x10000 # Bytes.
+Fingerprint = namedtuple('Fingerprint', 'path, key, offset, size, chunks')
+
+def _hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def fingerprint(in_file):
+    """Fingerprint of a track/route file, see module-level docstring.
+
+    Returns:
+        Fingerprint: key, offset (start address) and size of the main part
+            and hashes of its chunks.  None if the file is not readable.
+    """
+    nst.initialize_variables()
+    try:
+        with nst.open_input(in_file) as f:
+            version = converter.check_file_type_version(f)
+            (start_address, ) = nst.read_unpack('<I', f)
+            f.seek(0x00014, 0) # Track/route ID at the fixed address.
+            (track_id, ) = nst.read_unpack('<I', f)
+            if nst.FILE_TYPE == nst.TRACK:
+                converter.parse_track_informations(f, version)
+                key = (nst.TRACK, track_id, nst.START_TIME, nst.USER_ID)
+            else: # No start time and user id in routes.
+                key = (nst.ROUTE, track_id, None, None)
+
+            (offset, size, chunks) = (start_address - 1, 0, [])
+            f.seek(offset, 0)
+            while chunk := f.read(CHUNK_SIZE):
+                chunks.append(_hash(chunk))
+                size += len(chunk)
+    except (SystemExit, OSError, struct.error):
+        return None
+    return Fingerprint(in_file, key, offset, size, tuple(chunks))
+
+def is_prefix(short, long):
+    """True if the main part of short is a prefix of (or equal to) long's."""
+    if short.size > long.size: return False
+    (full, rest) = divmod(short.size, CHUNK_SIZE)
+    if short.chunks[:full] != long.chunks[:full]: return False
+    if rest == 0 or short.size == long.size:
+        return short.chunks[full:] == long.chunks[full:len(short.chunks)]
+    with long.path.open(mode='rb') as f: # The last chunk of short only.
+        f.seek(long.offset + full * CHUNK_SIZE, 0)
+        return _hash(f.read(rest)) == short.chunks[-1]
+
+def find_duplicates(in_files):
+    """Groups duplicates and keeps the most complete one in each group.
+
+    Returns:
+        kept: a list of path objects to be converted, in the input order.
+        duplicates: a dict of {path of duplicate: path of the kept file}.
+    """
+    (groups, kept, duplicates) = ({}, [], {})
+    for in_file in in_files:
+        fp = fingerprint(in_file)
+        if fp is None: # Let the converter report the error.
+            kept.append(in_file)
+        else:
+            groups.setdefault(fp.key, []).append(fp)
+
+    for fps in groups.values():
+        representatives = []
+        # The longest first; ties are kept in the input order.
+        for fp in sorted(fps, key=lambda fp: -fp.size):
+            of = next((r for r in representatives if is_prefix(fp, r)), None)
+            if of is None:
+                representatives.append(fp)
+            else:
+                duplicates[fp.path] = of.path
+        kept.extend(r.path for r in representatives)
+    order = {in_file: i for (i, in_file) in enumerate(in_files)}
+    return sorted(kept, key=order.get), duplicates
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Find duplicate Symbian SportsTracker tracks/routes.')
+    parser.add_argument('in_file', type=Path, nargs='+',
+                        help='files or directories of W*.dat and R*.dat.')
+    args = parser.parse_args()
+
+    in_files = converter.find_files(args.in_file)
+    (kept, duplicates) = find_duplicates(in_files)
+    for in_file in in_files:
+        if in_file in duplicates:
+            print(f'duplicate\t{in_file}\t{duplicates[in_file]}')
+        else:
+            print(f'keep\t{in_file}')
+    print(f'Kept: {len(kept)}, duplicates: {len(duplicates)}',
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A minimal pure-python encoder of FIT (Flexible and Interoperable Data
+Transfer) activity files of Symbian (Nokia) SportsTracker tracks.
+
+FitWriter is fed by nst.read_trackpoints() as its store function and writes
+the messages to the file as they come:
+1) file_id.
+2) record of each trackpoint: timestamp, position in semicircles, altitude,
+   speed and distance.
+3) event (timer stop/start) of each pause, see nst.read_pause_data().
+4) lap, session and activity from the header (total time, distance, etc.).
+The data size in the file header is known only at the end, so the header is
+written again there.  CRC of the data is computed incrementally while writing
+and combined with that of the header (see crc_combine()), without reading the
+file again.  A FIT file is about 10-20 times smaller than the gpx.
+"""
+import sys
+import struct
+
+import nst
+import convert_nst_files_to_gpx as converter
+
+FIT_EPOCH = 631065600 # 1989-12-31T00:00:00Z in unixtime.
+PROTOCOL_VERSION = 0x10 # 1.0
+PROFILE_VERSION = 2100 # 21.00
+MANUFACTURER = 255 # Development.
+SEMICIRCLES = 2**31 / 180 # Per degree.
+# FIT sport and sub_sport of ACTIVITIES in nst.py; generic (0, 0) otherwise.
+SPORTS = {'Walking': (11, 0), 'Running': (1, 0), 'Cycling': (2, 0),
+          'Skiing': (12, 0), 'Mountain biking': (2, 8), 'Hiking': (17, 0),
+          'Roller skating': (30, 0), 'Downhill skiing': (13, 0),
+          'Paddling': (19, 0), 'Rowing': (15, 0), 'Golf': (25, 0),
+          'Indoor': (10, 0)}
+
+# Base types of fields (base type number, struct format).
+(ENUM, SINT32, UINT16, UINT32, UINT32Z) = (
+    (0x00, 'B'), (0x85, 'i'), (0x84, 'H'), (0x86, 'I'), (0x8C, 'I'))
+# Messages: (global message number, ((field number, base type), ...)).
+FILE_ID = (0, ((0, ENUM), (1, UINT16), (2, UINT16), (3, UINT32Z),
+               (4, UINT32)))
+RECORD = (20, ((253, UINT32), (0, SINT32), (1, SINT32), (2, UINT16),
+               (5, UINT32), (6, UINT16)))
+EVENT = (21, ((253, UINT32), (0, ENUM), (1, ENUM)))
+LAP = (19, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (3, SINT32),
+            (4, SINT32), (5, SINT32), (6, SINT32), (7, UINT32), (8, UINT32),
+            (9, UINT32), (13, UINT16), (14, UINT16), (25, ENUM), (39, ENUM)))
+SESSION = (18, ((253, UINT32), (0, ENUM), (1, ENUM), (2, UINT32), (3, SINT32),
+                (4, SINT32), (5, ENUM), (6, ENUM), (7, UINT32), (8, UINT32),
+                (9, UINT32), (14, UINT16), (15, UINT16), (25, UINT16),
+                (26, UINT16)))
+ACTIVITY = (34, ((253, UINT32), (0, UINT32), (1, UINT16), (2, ENUM),
+                 (3, ENUM), (4, ENUM), (5, UINT32)))
+(TIMER, LAP_EVENT, SESSION_EVENT, ACTIVITY_EVENT) = (0, 9, 8, 26)
+(START, STOP, STOP_ALL) = (0, 1, 4) # Event types.
+
+def _make_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+CRC_TABLE = _make_crc_table()
+
+def crc16(data, crc=0):
+    """CRC-16 of FIT (CRC-16/ARC), updated incrementally.
+
+    >>> hex(crc16(b'123456789'))
+    '0xbb3d'
+    """
+    table = CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def _gf2_times(matrix, vector):
+    result = 0
+    for row in matrix:
+        if not vector: break
+        if vector & 1: result ^= row
+        vector >>= 1
+    return result
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, row) for row in matrix]
+
+def crc_combine(crc1, crc2, len2):
+    """CRC of data1 + data2 from crc1, crc2 and len2 (bytes) as in zlib.
+
+    >>> crc_combine(crc16(b'1234'), crc16(b'56789'), 5) == crc16(b'123456789')
+    True
+    """
+    # An operator of a zero bit, then squared to those of 2^n zero bits.
+    odd = [0xA001] + [1 << n for n in range(15)]
+    even = _gf2_square(odd) # 2 zero bits.
+    odd = _gf2_square(even) # 4 zero bits.
+    while len2:
+        even = _gf2_square(odd) # 8 zero bits (a byte) at first.
+        if len2 & 1: crc1 = _gf2_times(even, crc1)
+        len2 >>= 1
+        if not len2: break
+        odd = _gf2_square(even)
+        if len2 & 1: crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+    return crc1 ^ crc2
+
+def fit_time(unix_time):
+    return max(int(unix_time) - FIT_EPOCH, 0)
+
+def semicircles(degree):
+    return min(int(round(degree * SEMICIRCLES)), 2**31 - 1)
+
+class FitWriter(object):
+    """Writes a FIT activity file of a track, see module-level docstring.
+
+    Usage:
+        with FitWriter(path) as writer:
+            nst.read_trackpoints(f, pause_list, writer.record)
+    """
+    HEADER_FMT = '<2BHI4s'
+
+    def __init__(self, path, pause_list=None):
+        """
+        Args:
+            path: a path object of the FIT file.
+            pause_list (optional): a list from nst.read_pause_data(), which
+                can be extended later (before the first record).
+        """
+        (self.path, self.f) = (path, path.open(mode='wb'))
+        self.f.write(bytes(struct.calcsize(self.HEADER_FMT) + 2)) # Later.
+        (self.crc, self.size) = (0, 0)
+        self.pauses = [] if pause_list is None else pause_list
+        self.formats = {} # {global message number: (local type, struct)}
+        (self.first, self.last, self.max_speed, self.num_records) = (
+            None, None, 0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None: self.finish()
+        self.f.close()
+        if exc_type is not None: self.path.unlink() # Not to leave a broken.
+
+    def _write(self, data):
+        self.crc = crc16(data, self.crc)
+        self.size += len(data)
+        self.f.write(data)
+
+    def _message(self, message, *values):
+        """Writes a data message (and its definition at the first time)."""
+        (global_number, fields) = message
+        if global_number not in self.formats:
+            local_type = len(self.formats) # Up to 16 local types.
+            self.formats[global_number] = (local_type, struct.Struct(
+                '<B' + ''.join(fmt for (_, (_, fmt)) in fields)))
+            # Record header, reserved, architecture (0: little endian), etc.
+            definition = struct.pack('<3BHB', 0x40 | local_type, 0, 0,
+                                     global_number, len(fields))
+            for (number, (base_type, fmt)) in fields:
+                definition += struct.pack('<3B', number,
+                                          struct.calcsize(fmt), base_type)
+            self._write(definition)
+        (local_type, packer) = self.formats[global_number]
+        self._write(packer.pack(local_type, *values))
+
+    def record(self, tp):
+        """Writes a record of trackpt_store (and events of a pause before)."""
+        if self.first is None:
+            if nst.FILE_TYPE != nst.TRACK: # No times in routes.
+                print('Only tracks are supported in FIT.', file=sys.stderr)
+                sys.exit(1)
+            self.first = tp
+            self._message(FILE_ID, 4, MANUFACTURER, 0, 0, # 4: activity.
+                          fit_time(nst.START_TIME or tp.unix_time))
+            self._message(EVENT, fit_time(tp.unix_time), TIMER, START)
+        # The first trackpt after a pause, of which t_time is at the resume.
+        while self.pauses and tp.t_time + 0.5 >= self.pauses[0][0]:
+            (t4_time, pause_time, _) = self.pauses.pop(0)
+            if pause_time <= 0: continue # Corrections of time.
+            resume = tp.unix_time - (tp.t_time - t4_time)
+            self._message(EVENT, fit_time(resume - pause_time), TIMER,
+                          STOP_ALL)
+            self._message(EVENT, fit_time(resume), TIMER, START)
+        speed = tp.v / 100 # m/s.
+        self.max_speed = max(self.max_speed, speed)
+        self._message(
+            RECORD, fit_time(tp.unix_time), semicircles(tp.y_degree),
+            semicircles(tp.x_degree),
+            min(max(int(round((tp.z_ax + 500) * 5)), 0), 0xFFFE),
+            max(int(tp.dist), 0), min(max(int(round(speed * 1000)), 0), 0xFFFE))
+        (self.last, self.num_records) = (tp, self.num_records + 1)
+
+    def finish(self):
+        """Writes lap, session and activity, then the header and the CRC."""
+        if self.first is not None:
+            (first, last) = (self.first, self.last)
+            timestamp = fit_time(last.unix_time)
+            self._message(EVENT, timestamp, TIMER, STOP_ALL)
+            elapsed = int((last.unix_time - first.unix_time) * 1000) # ms.
+            timer = int((nst.total_time or last.t_time) * 1000)
+            distance = int(nst.total_distance * 1e5 if nst.total_distance
+                           else last.dist) # cm.
+            avg_speed = min(int(distance * 1e4 / timer) if timer else 0,
+                            0xFFFE) # mm/s.
+            max_speed = min(int(self.max_speed * 1000), 0xFFFE)
+            (sport, sub_sport) = SPORTS.get(nst.activity_type, (0, 0))
+            positions = (semicircles(first.y_degree),
+                         semicircles(first.x_degree))
+            self._message(LAP, timestamp, LAP_EVENT, STOP,
+                          fit_time(first.unix_time), *positions,
+                          semicircles(last.y_degree),
+                          semicircles(last.x_degree), elapsed, timer,
+                          distance, avg_speed, max_speed, sport, sub_sport)
+            self._message(SESSION, timestamp, SESSION_EVENT, STOP,
+                          fit_time(first.unix_time), *positions, sport,
+                          sub_sport, elapsed, timer, distance, avg_speed,
+                          max_speed, 0, 1)
+            local_offset = int(nst.TZ_HOURS * 3600) if nst.TZ_HOURS else 0
+            self._message(ACTIVITY, timestamp, timer, 1, 0, ACTIVITY_EVENT,
+                          STOP, timestamp + local_offset)
+
+        header = struct.pack(self.HEADER_FMT, struct.calcsize(
+            self.HEADER_FMT) + 2, PROTOCOL_VERSION, PROFILE_VERSION,
+                             self.size, b'.FIT')
+        header += struct.pack('<H', crc16(header))
+        crc = crc_combine(crc16(header), self.crc, self.size)
+        self.f.seek(0, 0)
+        self.f.write(header)
+        self.f.seek(0, 2)
+        self.f.write(struct.pack('<H', crc))
+
+def convert(in_file, args, fit_path):
+    """Reads a track file and writes FIT, see convert() of the converter.
+
+    Returns:
+        number of records written.
+    """
+    processing = (args.filter or args.resample or args.rdp
+                  or args.min_distance or args.min_time)
+    (trackpts, pause_list) = ([], [])
+    with FitWriter(fit_path, pause_list) as writer:
+        converter.read_file(in_file, trackpts.append if processing
+                            else writer.record, pause_list)
+        if processing:
+            # Filter/resampling/simplification does not consume the pauses.
+            converter.process_and_store(trackpts, args, list(pause_list),
+                                        writer.record)
+        return writer.num_records
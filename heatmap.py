@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Script to make a raster heatmap of many Symbian SportsTracker tracks.
+
+Trackpoints are decoded from W*.dat files in parallel (no gpx), projected to
+Web Mercator and accumulated into count grids of NumPy.  The memory is bounded
+by the size of the grids (256x256 per tile or the image size) rather than the
+number of trackpoints.  Output is a set of PNG tiles (DIR/zoom/x/y.png) or a
+single PNG image of a bounding box.  PNGs are written by zlib, no PIL needed.
+
+Usage:
+    python heatmap.py --tiles DIR --zoom 10-14 input_files_or_directories
+    python heatmap.py --image FILE --zoom 13 --bbox S W N E input_files_...
+"""
+import sys
+import math
+import zlib
+import struct
+import argparse
+from array import array
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import numpy as np
+except ImportError:
+    print('Failed to import NumPy, which is required in heatmap.py.')
+    sys.exit(1)
+
+import convert_nst_files_to_gpx as converter
+
+TILE_SIZE = 256 # Pixels.
+MAX_LAT = 85.05112878 # Limit of Web Mercator.
+MAX_IMAGE_SIZE = 16384 # Pixels in width/height of a single image.
+
+def read_points(in_file):
+    """Decode a track file to arrays of lat./lon. (in a worker process).
+
+    Returns:
+        (in_file, bytes of lat. array('d'), bytes of lon. array('d')).
+    """
+    (ys, xs) = (array('d'), array('d'))
+    def store(tp):
+        ys.append(tp.y_degree)
+        xs.append(tp.x_degree)
+    try:
+        converter.read_file(in_file, store)
+    except converter.DECODE_ERRORS as error: # E.g. a truncated file.
+        print(f'Failed to read: {in_file} ({error!r})', file=sys.stderr)
+    return in_file, ys.tobytes(), xs.tobytes()
+
+def iterate_points(in_files, jobs=None):
+    """Yields (lat., lon.) numpy arrays of each file decoded in parallel."""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for (in_file, ys, xs) in executor.map(read_points, in_files,
+                                              chunksize=4):
+            if ys: yield np.frombuffer(ys), np.frombuffer(xs)
+
+def project(lat, lon, zoom):
+    """Web Mercator projection to global pixel coordinates at the zoom level.
+
+    >>> project(np.array([0.0]), np.array([0.0]), 1)
+    (array([256]), array([256]))
+    """
+    scale = TILE_SIZE * 2**zoom
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    p_x = (lon + 180) / 360 * scale
+    p_y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * scale
+    return (np.clip(p_x, 0, scale - 1).astype(np.int64),
+            np.clip(p_y, 0, scale - 1).astype(np.int64))
+
+class TileGrids(object):
+    """Count grids of tiles (TILE_SIZE x TILE_SIZE) over zoom levels."""
+    def __init__(self, zooms):
+        self.zooms = zooms
+        self.grids = {} # {(zoom, tile_x, tile_y): 2D array of counts}
+
+    def add(self, lat, lon):
+        for zoom in self.zooms:
+            (p_x, p_y) = project(lat, lon, zoom)
+            (tile_x, tile_y) = (p_x // TILE_SIZE, p_y // TILE_SIZE)
+            local = (p_y % TILE_SIZE) * TILE_SIZE + p_x % TILE_SIZE
+            keys = tile_x * 2**zoom + tile_y
+            for key in np.unique(keys):
+                tile = (zoom, int(key) // 2**zoom, int(key) % 2**zoom)
+                counts = np.bincount(local[keys == key],
+                                     minlength=TILE_SIZE * TILE_SIZE)
+                grid = self.grids.setdefault(
+                    tile, np.zeros((TILE_SIZE, TILE_SIZE), np.uint32))
+                grid += counts.reshape(TILE_SIZE, TILE_SIZE).astype(np.uint32)
+
+    def write(self, out_dir):
+        """Write DIR/zoom/x/y.png normalized by the max. count of each zoom."""
+        for zoom in self.zooms:
+            tiles = [t for t in self.grids if t[0] == zoom]
+            if not tiles: continue
+            max_count = max(int(self.grids[t].max()) for t in tiles)
+            for tile in tiles:
+                path = Path(out_dir, *(str(i) for i in tile)).with_suffix(
+                    '.png')
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write_png(path, colorize(self.grids[tile], max_count))
+
+class ImageGrid(object):
+    """A count grid of a single image of the bounding box at the zoom."""
+    def __init__(self, zoom, south, west, north, east):
+        self.zoom = zoom
+        ((x0, x1), (y1, y0)) = project(
+            np.array([south, north]), np.array([west, east]), zoom)
+        (self.x0, self.y0) = (int(x0), int(y0))
+        (width, height) = (int(x1) - self.x0 + 1, int(y1) - self.y0 + 1)
+        if max(width, height) > MAX_IMAGE_SIZE:
+            print(f'Too large image: {width}x{height}, use a lower zoom.')
+            sys.exit(1)
+        self.grid = np.zeros((height, width), np.uint32)
+
+    def add(self, lat, lon):
+        (p_x, p_y) = project(lat, lon, self.zoom)
+        (p_x, p_y) = (p_x - self.x0, p_y - self.y0)
+        (height, width) = self.grid.shape
+        inside = (0 <= p_x) & (p_x < width) & (0 <= p_y) & (p_y < height)
+        counts = np.bincount(p_y[inside] * width + p_x[inside],
+                             minlength=width * height)
+        self.grid += counts.reshape(height, width).astype(np.uint32)
+
+    def write(self, path):
+        write_png(path, colorize(self.grid, int(self.grid.max())))
+
+def colorize(grid, max_count):
+    """Log-scaled counts to RGBA (uint8) of a black-red-yellow-white ramp."""
+    level = np.log1p(grid) / math.log1p(max(max_count, 1)) # 0 to 1.
+    rgba = np.empty(grid.shape + (4, ), np.uint8)
+    rgba[..., 0] = np.clip(level * 3, 0, 1) * 255
+    rgba[..., 1] = np.clip(level * 3 - 1, 0, 1) * 255
+    rgba[..., 2] = np.clip(level * 3 - 2, 0, 1) * 255
+    rgba[..., 3] = np.where(grid > 0, 128 + level * 127, 0)
+    return rgba
+
+def write_png(path, rgba):
+    """Write a RGBA (uint8, height x width x 4) array as a PNG file."""
+    (height, width) = rgba.shape[:2]
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data)))
+    # A filter-type byte (0: none) precedes each row.
+    rows = np.concatenate(
+        (np.zeros((height, 1), np.uint8), rgba.reshape(height, width * 4)),
+        axis=1)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>2I5B', width, height, 8, 6, 0, 0,
+                                           0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+def parse_zooms(zooms):
+    """'10-14' or '12' to a range of zoom levels.
+
+    >>> list(parse_zooms('10-12'))
+    [10, 11, 12]
+    """
+    (first, _, last) = zooms.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Make a heatmap of Symbian SportsTracker tracks.')
+    parser.add_argument('in_file', type=Path, nargs='+',
+                        help='track files or directories to search W*.dat.')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--tiles', type=Path, metavar='DIR',
+                        help='write PNG tiles in DIR/zoom/x/y.png.')
+    output.add_argument('--image', type=Path, metavar='FILE',
+                        help='write a single PNG image of --bbox.')
+    parser.add_argument('--zoom', type=parse_zooms, default=parse_zooms('12'),
+                        help='zoom level(s), e.g. 12 or 10-14.')
+    parser.add_argument('--bbox', type=float, nargs=4,
+                        metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of decoding processes.')
+    args = parser.parse_args()
+    if args.image and not args.bbox:
+        parser.error('--image requires --bbox.')
+
+    grids = (TileGrids(args.zoom) if args.tiles
+             else ImageGrid(args.zoom[-1], *args.bbox))
+    in_files = converter.find_files(args.in_file, ('W*.dat', ))
+    (num_files, num_points) = (0, 0)
+    for (lat, lon) in iterate_points(in_files, args.jobs):
+        grids.add(lat, lon)
+        (num_files, num_points) = (num_files + 1, num_points + len(lat))
+    grids.write(args.tiles or args.image)
+    print(f'Tracks: {num_files}, trackpoints: {num_points}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for resumable batch conversion.
+
+Manifest is an append-only file of JSON lines, one per converted file: input
+path, size, mtime, status ('ok', 'failed' or 'error'), output, number of
+points and seconds taken.  Each line is flushed as soon as the file is done, so
+a batch killed at any point can be restarted with the same manifest; the files
+done (unchanged since then, and the output still exists) are skipped.  Files
+failed to decode (DECODE_ERRORS of the converter but OSError, also of a single
+file) are recorded as 'failed' and not retried unless they are changed, while
+those of OSError (e.g. the output is not writable, or the disk is full) are
+recorded as 'error' and retried.
+
+Progress reports the number of files, throughput and ETA (estimated from the
+bytes of input) to stderr, at most once per INTERVAL seconds.
+"""
+import sys
+import json
+import time
+from pathlib import Path
+
+import nst
+
+INTERVAL = 1.0 # Seconds between progress reports.
+
+class Manifest(object):
+    """An append-only record of files converted in batches."""
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = {} # {input path: the last record}
+        if self.path.exists():
+            with self.path.open(encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError: # A line broken by a crash.
+                        continue
+                    self.records[record['input']] = record
+        self.f = self.path.open(mode='a', encoding='utf-8')
+
+    def close(self):
+        self.f.close()
+
+    def is_done(self, in_file):
+        """True if the file is converted (or failed to decode) and not changed.
+        """
+        record = self.records.get(str(in_file))
+        if record is None: return False
+        stat = in_file.stat()
+        if (record['size'], record['mtime_ns']) != (stat.st_size,
+                                                    stat.st_mtime_ns):
+            return False
+        return (record['status'] == 'failed' or record['status'] == 'ok' and (
+            record['output'] is None or Path(record['output']).exists()))
+
+    def append(self, in_file, status, output=None, points=None, seconds=0):
+        """Appends a record and flushes it to the file."""
+        stat = in_file.stat()
+        record = {'input': str(in_file), 'size': stat.st_size,
+                  'mtime_ns': stat.st_mtime_ns, 'status': status,
+                  'output': None if output is None else str(output),
+                  'points': points, 'seconds': round(seconds, 3)}
+        self.records[record['input']] = record
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+
+class Progress(object):
+    """Reports files done, throughput and ETA of a batch to stderr."""
+    def __init__(self, in_files, file=None):
+        self.total = len(in_files)
+        self.total_bytes = sum(p.stat().st_size for p in in_files)
+        (self.done, self.done_bytes, self.points) = (0, 0, 0)
+        self.file = file or sys.stderr
+        self.start = self.last = time.monotonic()
+
+    def update(self, in_file, points=0):
+        """Counts a file done and reports if INTERVAL has passed."""
+        (self.done, self.points) = (self.done + 1, self.points + (points or 0))
+        self.done_bytes += in_file.stat().st_size
+        now = time.monotonic()
+        if now - self.last >= INTERVAL or self.done == self.total:
+            self.last = now
+            self.report(now - self.start)
+
+    def report(self, elapsed):
+        elapsed = max(elapsed, 1e-9)
+        rate = self.done_bytes / elapsed # Bytes/s.
+        eta = (self.total_bytes - self.done_bytes) / rate if rate else 0
+        line = (f'{self.done}/{self.total} files, '
+                f'{self.done / elapsed:.1f} files/s, {rate / 1e6:.2f} MB/s, '
+                f'{self.points / elapsed:.0f} points/s, '
+                f'ETA {nst.format_timedelta(eta)[:-4]}')
+        end = '\n' if self.done == self.total or not self.file.isatty() else ''
+        print(f'\r{line}', end=end, file=self.file, flush=True)
@@ -0,0 +1,156 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for the memory budget of the converters (--max-memory).
+
+Most of the memory in converting a file is the tree of gpx, about GPX_POINT
+bytes per trkpt (lxml, including the serialization).  The trackpoints are
+decoded one by one and never kept unless resampling/simplification or
+analytics requires them, or the stages are measured.  The number of trackpoints is estimated from the
+size of the input file (BYTES_PER_POINT, the smallest records), and a file
+estimated over the budget is converted by StreamingGpx (see mini_gpx.py),
+of which the trkpts are serialized in chunks to a temporary file.
+
+Tracker measures each file by tracemalloc (objects of python, which excludes
+the tree of lxml) and resource (maxrss of the process), and optionally dumps
+the top allocation sites of the stages: read_trackpoints (decoding into a
+list), append_trkpt (processing and building the tree by Gpx.append_trkpt())
+and to_xml (serialization by Gpx.write()).  Tracing slows the conversion; it
+is active only with --max-memory.
+"""
+import sys
+import tracemalloc
+from pathlib import Path
+try:
+    import resource
+except ImportError: # Windows.
+    resource = None
+
+import nst
+
+GPX_POINT = 3000 # Bytes of memory per trkpt in the tree of gpx.
+BYTES_PER_POINT = {'.tmp': 40} # Of input files; the smallest records.
+DEFAULT_BYTES_PER_POINT = 8 # W*.dat and R*.dat.
+TOP_SITES = 10 # Allocation sites per stage in the dump.
+DUMP = None # A text file object of the dump, see Tracker.
+
+def estimate(in_file):
+    """Estimated bytes of memory to convert a file (None if unknown)."""
+    try:
+        size = in_file.stat().st_size
+    except OSError: # Stdin, etc.
+        return None
+    if not in_file.is_file(): return None # Pipes.
+    bytes_per_point = BYTES_PER_POINT.get(in_file.suffix.lower(),
+                                          DEFAULT_BYTES_PER_POINT)
+    return size // bytes_per_point * GPX_POINT
+
+def over_budget(in_file, max_memory):
+    """True if a file should be converted by StreamingGpx.
+
+    Unknown sizes (stdin, pipes) are regarded as over the budget.
+    """
+    estimated = estimate(in_file)
+    return estimated is None or estimated > max_memory
+
+def max_rss():
+    """Peak resident set size of the process in bytes (0 if unknown)."""
+    if resource is None: return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024 # KiB on Linux.
+
+class Tracker(object):
+    """Measures the memory to convert a file, stage by stage.
+
+    Usage:
+        tracker = start(in_file, args.max_memory) # STREAM_GPX is set.
+        gpx = to_gpx(..., tracker=tracker) # Stage of read_trackpoints.
+        tracker.stage('append_trkpt')
+        nst.finalize_gpx(gpx, gpx_path)
+        tracker.stage('to_xml')
+        tracker.finish()
+    """
+    def __init__(self, in_file, max_memory, dump=None):
+        """
+        Args:
+            in_file: a path object of input file.
+            max_memory: the budget in bytes.
+            dump (optional): a text file object to write the diagnostics.
+                Defaults to DUMP.
+        """
+        (self.in_file, self.max_memory) = (in_file, max_memory)
+        self.dump = DUMP if dump is None else dump
+        self.streaming = nst.STREAM_GPX
+        if not tracemalloc.is_tracing(): tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.snapshot = tracemalloc.take_snapshot() if self.dump else None
+        self.rss = max_rss() # Of the process; an increase is of this file.
+        self.stages = [] # [(name, peak, top sites)]
+
+    def stage(self, name):
+        """Records the peak and the allocation sites since the last stage."""
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        sites = []
+        if self.dump is not None:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__), ))
+            sites = snapshot.compare_to(self.snapshot, 'lineno')[:TOP_SITES]
+            self.snapshot = snapshot
+        self.stages.append((name, peak, sites))
+
+    def finish(self):
+        """Warns to stderr if over the budget and writes the dump.
+
+        Returns:
+            peak of traced memory (bytes) in all the stages.
+        """
+        peak = max((peak for (_, peak, _) in self.stages), default=0)
+        rss = max_rss()
+        if peak > self.max_memory or (rss > self.rss
+                                      and rss > self.max_memory):
+            print(f'Over the memory budget: {self.in_file} (traced '
+                  f'{peak / 1e6:.1f} MB, maxrss {rss / 1e6:.1f} MB)',
+                  file=sys.stderr)
+        if self.dump is not None:
+            mode = 'streaming' if self.streaming else 'in memory'
+            print(f'# {self.in_file}: {mode}, estimated '
+                  f'{(estimate(self.in_file) or 0) / 1e6:.1f} MB, traced '
+                  f'{peak / 1e6:.1f} MB, maxrss {rss / 1e6:.1f} MB',
+                  file=self.dump)
+            for (name, stage_peak, sites) in self.stages:
+                print(f'## {name}: peak {stage_peak / 1e6:.2f} MB',
+                      file=self.dump)
+                for site in sites: print(site, file=self.dump)
+            self.dump.flush()
+        return peak
+
+def add_arguments(parser):
+    """Adds options of the memory budget to an argparse parser."""
+    group = parser.add_argument_group('memory')
+    group.add_argument('--max-memory', type=float, metavar='MB',
+                       help='memory budget per file.  Files estimated over '
+                       'it are written in chunks; the usage is measured by '
+                       'tracemalloc/resource and reported if exceeded.')
+    group.add_argument('--memory-dump', type=Path, metavar='FILE',
+                       help='append top allocation sites per stage of each '
+                       'file to the text file (with --max-memory).')
+
+def start(in_file, max_memory):
+    """Chooses Gpx/StreamingGpx of a file and starts a Tracker.
+
+    Args:
+        in_file: a path object of input file.
+        max_memory: the budget in MB (--max-memory), or None.
+
+    Returns:
+        Tracker, or None if max_memory is None.
+    """
+    if not max_memory:
+        nst.STREAM_GPX = False
+        return None
+    max_memory = int(max_memory * 1e6)
+    nst.STREAM_GPX = over_budget(in_file, max_memory)
+    return Tracker(in_file, max_memory)
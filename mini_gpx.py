@@ -8,12 +8,14 @@
    Use of lxml is recommended, though a fallback to ElementTree is implemented.
 """
 import sys
+import shutil
+import tempfile
+from io import BytesIO
 try:
     import lxml.etree as mod_etree
     USE_LXML = True
 except ImportError: # Fallback to built-in ElementTree.
     USE_LXML = False
-    from io import BytesIO
     try:
         import xml.etree.cElementTree as mod_etree
     except ImportError:
@@ -46,6 +48,7 @@ else:
 
 def make_str(s): # A modified function of https://github.com/tkrajina/gpxpy.
     """Converts a str, unicode or float object into a str type."""
+    if isinstance(s, str): return s # Preformatted, e.g. fixed precision.
     if isinstance(s, float):
         result = str(s)
         if 'e' not in result:
@@ -56,6 +59,8 @@ def make_str(s): # A modified function of https://github.com/tkrajina/gpxpy.
     return str(s)
 
 def format_time(datetime):
+    """Formats a datetime, or passes through preformatted strings."""
+    if isinstance(datetime, str): return datetime
     return datetime.isoformat().replace('+00:00', 'Z')
 
 def _pretty_print(current, parent=None, index=-1, depth=0):
@@ -80,6 +85,7 @@ class Gpx(object):
     """
     def __init__(self, is_track=True):
         (self.metadata, self.summary) = (None, ) * 2
+        self.assembled = False # See _assemble().
         self.is_track = is_track
         self.make_root()
         if is_track:
@@ -87,6 +93,10 @@ class Gpx(object):
         else:
             self.make_rte()
 
+    def __len__(self):
+        """Number of trkpt/rtept appended, before serialization."""
+        return len(self.trkseg if self.is_track else self.rte)
+
     def make_root(self):
         """Supported version of GPX is 1.1."""
         if USE_LXML:
@@ -113,12 +123,10 @@ class Gpx(object):
         else:
             self.rte = mod_etree.Element('{' f'{NS_GPX}' '}' 'rte')
 
-    def to_xml(self):
-        """Serializes the root after appending trkseg, rte, metadata, etc.
-
-        Returns:
-            utf-8 bytes (gpx xml).
-        """
+    def _assemble(self):
+        """Appends trkseg, rte, metadata, etc. to the root (only once)."""
+        if self.assembled: return
+        self.assembled = True
         if self.metadata is not None:
             self.root.append(self.metadata)
 
@@ -137,16 +145,30 @@ class Gpx(object):
             for rtept in self.rte:
                 rte.append(rtept)
 
+    def write(self, f):
+        """Serializes the root to a binary file object, e.g. of gzip.
+
+        The xml is written in chunks; the whole bytes are not made in memory.
+        """
+        self._assemble()
         if USE_LXML:
-            return mod_etree.tostring(
-                self.root, encoding='UTF-8', pretty_print=True, 
+            mod_etree.ElementTree(self.root).write(
+                f, encoding='UTF-8', pretty_print=True, 
                 doctype='<?xml version="1.0" encoding="UTF-8"?>')
         else:
             _pretty_print(self.root)
-            f = BytesIO()
             tree = mod_etree.ElementTree(self.root)
             tree.write(f, encoding='UTF-8', xml_declaration=True) 
-            return f.getvalue()
+
+    def to_xml(self):
+        """Serializes the root after appending trkseg, rte, metadata, etc.
+
+        Returns:
+            utf-8 bytes (gpx xml).
+        """
+        f = BytesIO()
+        self.write(f)
+        return f.getvalue()
 
     def add_metadata(self, name='', description='', author='', time=None):
         """Adds a few field in metadata as a short reference of the track/route.
@@ -216,3 +238,71 @@ class Gpx(object):
                 mod_etree.SubElement(gpxtpx, '{' f'{NS_GPXTPX}' '}' 'hr'
                                      ).text = make_str(hr)
 
+
+class StreamingGpx(Gpx):
+    """Gpx of which trkpt/rtept are serialized in chunks as they come.
+
+       Every CHUNK_SIZE points are serialized (in the same format as Gpx) to a 
+       temporary file and dropped from the tree, so the memory is bounded by 
+       the chunk instead of the number of points.  write() puts the points 
+       between the metadata/summary and the closing tags.  The output is 
+       identical to that of Gpx.
+    """
+    CHUNK_SIZE = 1000
+    MARKER = '__points__' # A placeholder of the points in write().
+
+    def __init__(self, is_track=True):
+        super().__init__(is_track)
+        self.spool = tempfile.TemporaryFile()
+        (self.buffer, self.count) = (Gpx(is_track), 0)
+
+    def __len__(self):
+        return self.count
+
+    def _flush(self):
+        """Serializes the points in the buffer to the spool."""
+        if not len(self.buffer): return
+        data = self.buffer.to_xml()
+        tag = b'<trkseg' if self.is_track else b'<rte'
+        closing = b'</trkseg>' if self.is_track else b'</rte>'
+        start = data.index(b'\n', data.index(tag)) + 1
+        stop = data.rindex(b'\n', 0, data.rindex(closing)) + 1
+        self.spool.write(data[start:stop])
+        self.buffer = Gpx(self.is_track)
+
+    def append_trkpt(self, **kwargs):
+        self.buffer.append_trkpt(**kwargs)
+        self._append()
+
+    def append_rtept(self, **kwargs):
+        self.buffer.append_rtept(**kwargs)
+        self._append()
+
+    def _append(self):
+        self.count += 1
+        if len(self.buffer) >= self.CHUNK_SIZE: self._flush()
+
+    def write(self, f):
+        """Writes the xml to a binary file object, the points from the spool.
+        """
+        if not self.count: # No points, the same as Gpx.
+            super().write(f)
+            return
+        self._flush()
+        if not self.assembled: # A marker in the place of the points.
+            # Speed for the namespace of gpxtpx, declared only if used in 
+            # ElementTree.
+            (super().append_trkpt if self.is_track else super().append_rtept)(
+                lat=self.MARKER, lon='0', speed='0')
+        data = BytesIO()
+        super().write(data)
+        data = data.getvalue()
+        marker = data.index(self.MARKER.encode())
+        closing = b'</trkpt>' if self.is_track else b'</rtept>'
+        f.write(data[:data.rindex(b'\n', 0, marker) + 1])
+        self.spool.seek(0, 0)
+        shutil.copyfileobj(self.spool, f)
+        f.write(data[data.index(b'\n', data.index(closing, marker)) + 1:])
+
+    def close(self):
+        self.spool.close()
@@ -25,19 +25,31 @@ A track (or route) is parsed as follows:
    trackpoint after processing is temporally stored in trackpt_store which is
    handed to store_trackpt() for recording.
 """
+import io
 import sys
+import math
+import time
 import struct
 import datetime as dt
+import functools
 from collections import namedtuple
 from pathlib import Path
 
 import scsu
-from mini_gpx import Gpx
+import compress
+from mini_gpx import Gpx, StreamingGpx
 
 # Initialize variables.
-(total_time, total_distance) = (0, ) * 2
-(comment, route_name, track_name, TZ_HOURS, START_LOCALTIME, activity_type, 
-    USER_ID, START_TIME, NEW_FORMAT, FILE_TYPE, gpx_target) = (None, ) * 11
+def initialize_variables():
+    """(Re)initialize module-level variables, e.g. before reading next file."""
+    global total_time, total_distance, comment, route_name, track_name
+    global TZ_HOURS, START_LOCALTIME, activity_type, USER_ID, START_TIME
+    global NEW_FORMAT, FILE_TYPE, gpx_target
+    (total_time, total_distance) = (0, ) * 2
+    (comment, route_name, track_name, TZ_HOURS, START_LOCALTIME, activity_type, 
+        USER_ID, START_TIME, NEW_FORMAT, FILE_TYPE, gpx_target) = (None, ) * 11
+
+initialize_variables()
 
 # Constants.
 ACTIVITIES = ('Walking', 'Running', 'Cycling', 'Skiing', 'Other 1', 'Other 2', 
@@ -47,6 +59,9 @@ ACTIVITIES = ('Walking', 'Running', 'Cycling', 'Skiing', 'Other 1', 'Other 2',
 (CONFIG, TRACK, ROUTE, TMP) = (0x1, 0x2, 0x3, 0x4) # FILE_TYPE.
 APP_ID = 0x0e4935e8
 
+# Lookup tables of {id: name} read from config.dat, see use_config().
+(user_names, activity_names) = ({}, {})
+
 def symbian_to_unix_time(symbiantime):
     """Convert a timestamp from symbiantime to unixtime.
 
@@ -75,6 +90,39 @@ def dt_from_timestamp(timestamp, tz_info=None):
     return (d_t.replace(tzinfo=None) if tz_info is None 
             else d_t.astimezone(tz_info))
 
+@functools.lru_cache(maxsize=256)
+def _utc_date(days):
+    """'YYYY-MM-DD' of days since the epoch, cached per day."""
+    d_t = dt_from_timestamp(days * 86400)
+    return None if d_t is None else d_t.strftime('%Y-%m-%d')
+
+def format_utc(timestamp):
+    """ISO-8601 strings in UTC (Z) from unixtime (sec), as in gpx time.
+
+    The same as datetime.isoformat() of dt_from_timestamp(); only the date is 
+    made by datetime (cached per day) and the time of day by divmod.  
+    Microsecs are rounded half to even as in datetime.fromtimestamp().
+
+    >>> format_utc(1251359794.37425)
+    '2009-08-27T07:56:34.374250Z'
+    >>> format_utc(0)
+    '1970-01-01T00:00:00Z'
+    """
+    (frac, seconds) = math.modf(timestamp)
+    microseconds = round(frac * 1e6)
+    if microseconds >= 1000000:
+        (seconds, microseconds) = (seconds + 1, microseconds - 1000000)
+    elif microseconds < 0:
+        (seconds, microseconds) = (seconds - 1, microseconds + 1000000)
+    (days, seconds) = divmod(int(seconds), 86400)
+    date = _utc_date(days)
+    if date is None: return None
+    (hours, seconds) = divmod(seconds, 3600)
+    (minutes, seconds) = divmod(seconds, 60)
+    prefix = f'{date}T{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return (f'{prefix}.{microseconds:06d}Z' if microseconds 
+            else f'{prefix}Z')
+
 def format_datetime(timestamp):
     """Returns ISO-8601 strings of millisec. precision from unixtime (sec)."""
     d_t = dt_from_timestamp(round(timestamp, 3))
@@ -97,6 +145,86 @@ def read_unpack(struct_fmt, file_object):
     size = struct.calcsize(struct_fmt)
     return struct.unpack(struct_fmt, file_object.read(size))
 
+def parse_utc(iso_datetime):
+    """ISO-8601 datetime in UTC to unixtime.
+
+    >>> parse_utc('1970-01-02T00:00:00')
+    86400.0
+    """
+    return dt.datetime.fromisoformat(iso_datetime).replace(
+        tzinfo=dt.timezone.utc).timestamp()
+
+HEADER_SIZE = 0x1000 # Bytes, larger than the header region of any file type.
+class PipeReader(object):
+    """A file object of non-seekable input, e.g. stdin or a pipe.
+
+    The first HEADER_SIZE bytes are kept in memory so that the header parsers 
+    can seek to the fixed addresses.  After that, only seeking forward (by 
+    skipping) is possible, which is enough to read the pause- and the 
+    trackpoint-data blocks sequentially.  mtime is the time of opening, used 
+    as the start time of routes (see file_mtime()).
+    """
+    def __init__(self, stream, name='<stdin>', header_size=HEADER_SIZE):
+        (self.stream, self.name) = (stream, name)
+        self.header = stream.read(header_size)
+        self.position = 0
+        self.mtime = time.time()
+
+    def read(self, size=-1):
+        data = b''
+        if self.position < len(self.header):
+            end = (len(self.header) if size < 0 
+                   else min(self.position + size, len(self.header)))
+            data = self.header[self.position:end]
+            self.position = end
+            if size >= 0: size -= len(data)
+        if size and self.position >= len(self.header):
+            rest = self.stream.read(size)
+            self.position += len(rest)
+            data += rest
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1: offset += self.position
+        elif whence == 2: raise OSError('Cannot seek from the end of a pipe.')
+        if offset < self.position and self.position > len(self.header):
+            raise OSError(f'Cannot seek back to {hex(offset)} in a pipe.')
+        if offset <= len(self.header):
+            self.position = offset
+        else: # Skip forward.
+            self.read(offset - self.position)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_input(in_file, header_size=HEADER_SIZE):
+    """Opens a path object of input file, or stdin if it is '-'.
+
+    Non-seekable input (stdin, named pipes, etc.) is wrapped by PipeReader, 
+    or read in memory if header_size is None.
+    """
+    f = (open(sys.stdin.fileno(), mode='rb', closefd=False) 
+         if str(in_file) == '-' else in_file.open(mode='rb'))
+    if f.seekable(): return f
+    if header_size is not None: return PipeReader(f, f.name, header_size)
+    with f:
+        buffer = io.BytesIO(f.read())
+    (buffer.name, buffer.mtime) = (str(in_file), time.time())
+    return buffer
+
 def scsu_reader(file_object, address=None):
     """Reads variable-length SCSU bytes and returns UTF-8 using scsu.py.
 
@@ -128,6 +256,126 @@ def scsu_reader(file_object, address=None):
     file_object.seek(start_of_scsu + byte_length, 0) # Go to the next field.
     return decoded_strings
 
+def _scsu_from_bytes(data, pos):
+    """Decode a length-prefixed SCSU string as in scsu_reader(), w/o exit.
+
+    Returns:
+        (decoded_strings, next_pos) or None if it does not look like a string.
+    """
+    if pos >= len(data): return None
+    size = data[pos]
+    if size & 0x1: # Character_length * 8 (U16).
+        if pos + 2 > len(data): return None
+        (size, ) = struct.unpack_from('<H', data, pos)
+        (size, pos) = (size >> 1, pos + 2)
+    else:
+        pos += 1
+    if size & 0x3 or size == 0 or pos >= len(data): return None
+    size >>= 2 # Character_length.
+    try:
+        (out_array, byte_length, character_length) = scsu.decode(
+            data[pos:pos + size * 4], size)
+        decoded_strings = out_array.decode('utf-8')
+    except (IndexError, ValueError):
+        return None
+    del character_length # Not in use.
+    if len(decoded_strings) != size or not decoded_strings.isprintable():
+        return None
+    return decoded_strings, pos + byte_length
+
+MAX_CONFIG_ENTRIES = 255 # Max. number of entries in a lookup table.
+def _read_lookup_table(data, pos):
+    """Try to read a table of U32 count followed by (U32 id, SCSU name)s.
+
+    Returns:
+        ({id: name}, next_pos) or None.
+    """
+    if pos + 4 > len(data): return None
+    (count, ) = struct.unpack_from('<I', data, pos)
+    if not 0 < count <= MAX_CONFIG_ENTRIES: return None
+    (table, pos) = ({}, pos + 4)
+    for _ in range(count):
+        if pos + 4 > len(data): return None
+        (id_, ) = struct.unpack_from('<I', data, pos)
+        result = _scsu_from_bytes(data, pos + 4)
+        if result is None or id_ in table: return None
+        (table[id_], pos) = result
+    return table, pos
+
+def read_config(file_obj):
+    """Read id--name lookup tables of users and activities from config.dat.
+
+    The layout of config.dat is not fully known (no sample file is at hand). 
+    After the header (APP_ID, FILE_TYPE == CONFIG), the tables are searched 
+    as a U32 count followed by the entries of U32 id and SCSU encoded name 
+    (see scsu_reader()); the first is users and the second is activities.
+
+    Returns:
+        (users, activities): dicts of {id: name}, empty if not found.
+    """
+    data = file_obj.read()
+    if len(data) < 12: return {}, {}
+    (application_id, file_type) = struct.unpack_from('<2I', data)
+    if application_id != APP_ID or file_type != CONFIG:
+        print(f'Unexpected file type of config: {file_type}',
+              file=sys.stderr)
+        return {}, {}
+
+    (tables, pos) = ([], 0x0C) # Next to app_id, file_type and version.
+    while pos < len(data) and len(tables) < 2:
+        result = _read_lookup_table(data, pos)
+        if result is None:
+            pos += 1
+            continue
+        (table, pos) = result
+        tables.append(table)
+    tables += [{}] * (2 - len(tables))
+    return tables[0], tables[1]
+
+@functools.lru_cache(maxsize=None)
+def lookup_tables(directory):
+    """Lookup tables from config.dat in the directory, cached per directory.
+
+    Returns:
+        (users, activities): see read_config().
+    """
+    for path in Path(directory).glob('*'):
+        if path.name.lower() == 'config.dat':
+            with path.open(mode='rb') as f:
+                return read_config(f)
+    return {}, {}
+
+def use_config(directory, tables=None):
+    """Use the lookup tables of the SportsTracker directory (once per dir.).
+
+    Sets user_names and activity_names used by user_name()/activity_name().
+
+    Args:
+        directory: a path object of the directory to search config.dat.
+        tables (optional): (users, activities) of read_config() to use instead,
+            e.g. of config.dat in an archive.
+    """
+    global user_names, activity_names
+    (user_names, activity_names) = (
+        tables if tables is not None 
+        else lookup_tables(Path(directory).resolve()))
+
+def user_name(user_id):
+    """Name of the user from config.dat, or user_id as str if unknown."""
+    return user_names.get(user_id, str(user_id))
+
+def activity_name(activity):
+    """Name of the activity, see ACTIVITIES and config.dat for custom ones.
+
+    >>> activity_name(2)
+    'Cycling'
+    >>> activity_name(100)
+    '100'
+    """
+    if activity in activity_names: return activity_names[activity]
+    return (str(activity) if activity >= len(ACTIVITIES) 
+            else ACTIVITIES[activity])
+
 def dmm_to_decdeg(dddmm_mmmm):
     """Convert signed int. DDDMM_MMMM format to decimal degree.
 
@@ -141,6 +389,8 @@ def dmm_to_decdeg(dddmm_mmmm):
     decimal_degree += mm_mmmm / 1e4 / 60
     return sign_dddmm_mmmm * decimal_degree
 
+LEAN = False # Set True to omit name/desc in each trackpt, see store_trackpt().
+WRITERS = [] # Writers fed with each trackpt in addition to gpx, see writers.py.
 def store_trackpt(tp, append_pt=None):
     """Do whatever with the trackpt data: print, gpx, store in a database, etc.
 
@@ -150,23 +400,37 @@ def store_trackpt(tp, append_pt=None):
              d_dist(cm), dist(cm), track_count(int), file_type(int: 2, 3 or 4))
         append_pt (optional): gpx.append_trkpt or gpx.append_rtept.
             Defaults to gpx_target.
+
+    Each of WRITERS (e.g. CSV, database) records tp as well, so that gpx and 
+    the other outputs are made in a single pass of decoding.
+
+    Time is handed as strings (see format_utc()).  If LEAN, lat/lon/ele/speed 
+    are also strings of fixed precision, and name/desc are omitted.
     """
     # Print delimited text.
     #times = f'{format_timedelta(tp.t_time)}\t{format_datetime(tp.unix_time)}Z'
     #print(f'{times}\t{tp.d_dist / 10**5:.3f}\t{tp.dist / 10**5:.3f}\t'
     #      f'{tp.y_degree:.6f}\t{tp.x_degree:.6f}\t{tp.z_ax:.1f}\t'
     #      f'{tp.v / 100 * 3.6:.3f}')
+    for writer in WRITERS: writer.record(tp)
     if append_pt is None: append_pt = gpx_target
+    if LEAN: # Fixed precision strings w/o name and desc.
+        append_pt(
+            lat=f'{tp.y_degree:.6f}', lon=f'{tp.x_degree:.6f}', 
+            ele=f'{tp.z_ax:.1f}', time=format_utc(tp.unix_time), 
+            speed=f'{tp.v / 100:.3f}')
+        return
     append_pt(
         lat=round(tp.y_degree, 6), # 1e-6 ~ 10 cm precision.
         lon=round(tp.x_degree, 6), 
         ele=round(tp.z_ax, 1), # Altitude (m).
-        time=dt_from_timestamp(tp.unix_time, dt.timezone.utc), 
+        time=format_utc(tp.unix_time), 
         name=str(tp.track_count + 1),
         desc=(f'Speed {round(tp.v / 100 * 3.6, 3)} km/h '
               f'Distance {round(tp.dist / 10**5, 3)} km'),
         speed=round(tp.v / 100, 3)) # Speed (m/s).
 
+STREAM_GPX = False # Set True to serialize trkpts in chunks, see memory.py.
 def initialize_gpx(file_type=None):
     """Initialize a route or a track segment (determined by the file_type).
 
@@ -174,15 +438,17 @@ def initialize_gpx(file_type=None):
         file_type (optional): int. 2, 3 or 4.  Defaults to FILE_TYPE.
 
     Returns:
-        gpx: an object to append tp, see Gpx() class in mini_gpx.py.
+        gpx: an object to append tp, see Gpx() class in mini_gpx.py.  
+            StreamingGpx if STREAM_GPX.
         gpx.append_rtept/gpx.append_trkpt: name it as gpx_target.
     """
     if file_type is None: file_type = FILE_TYPE
+    gpx_class = StreamingGpx if STREAM_GPX else Gpx
     if file_type == ROUTE:
-        gpx = Gpx(is_track=False)
+        gpx = gpx_class(is_track=False)
         return gpx, gpx.append_rtept
     else: # file_type in {TRACK, TMP}
-        gpx = Gpx()
+        gpx = gpx_class()
         return gpx, gpx.append_trkpt
 
 def add_gpx_summary(gpx, tp_store):
@@ -222,7 +488,7 @@ def add_gpx_summary(gpx, tp_store):
             f'Real time: {format_timedelta(real_time)}' '; '
             f'Gross speed: {round(gross_speed, 3)} km/h' ']')
         gpx_description = f'[{activity_type}]' # See ACTIVITIES.
-        author = str(USER_ID)
+        author = user_name(USER_ID) # See config.dat.
         time = dt_from_timestamp(
             START_TIME, dt.timezone(dt.timedelta(hours=TZ_HOURS), ))
 
@@ -236,12 +502,24 @@ def finalize_gpx(gpx, outfile_path=None):
     Args:
         gpx
         outfile_path (optional): write gpx xml to the file or print (if None).
+            Compressed if the suffix is .gz or .xz, see compress.py.
     """
     if outfile_path is not None:
-        with outfile_path.open(mode='wb') as f:
-            f.write(gpx.to_xml()) # to_xml() returns bytes.
+        compress.write_to(outfile_path, gpx.write) # Streaming to the file.
+    elif isinstance(gpx, StreamingGpx): # Not to make the xml in memory.
+        sys.stdout.flush()
+        gpx.write(sys.stdout.buffer)
+        sys.stdout.buffer.write(b'\n') # As print().
+        sys.stdout.buffer.flush()
     else:
         print(gpx.to_xml().decode())
+    if isinstance(gpx, StreamingGpx): gpx.close()
+
+ROUTE_START_TIME = None # Unixtime (s) used as the start time of routes.
+def file_mtime(file_obj):
+    """Mtime of the file, or file_obj.mtime if given (e.g. archive members)."""
+    if hasattr(file_obj, 'mtime'): return file_obj.mtime
+    return Path(file_obj.name).stat().st_mtime
 
 DEBUG_READ_PAUSE = False
 def read_pause_data(file_obj, new_format=None):
@@ -339,7 +617,8 @@ def define_data_structures_and_formats(new_format=None):
     if new_format is None: new_format = NEW_FORMAT
     # Factory functions of namedtuples used in reading/processing trackpoints.
     # TrackptType00, TrackptType80, TrackptTypeC0: used to wrap after reading.
-    # TrackptStore: used to wrap a trackpoint after processing.
+    # TrackptStore (module-level, see below): used to wrap a trackpoint after 
+    # processing.
     type00 = 't_time, y_ax, x_ax, z_ax, v, d_dist'
     type80 = 'dt_time, dy_ax, dx_ax, dz_ax, dv, d_dist'
     # Unknown1 & 2 show up in distant jumps.
@@ -347,13 +626,9 @@ def define_data_structures_and_formats(new_format=None):
     if new_format: # The fields shown below are added in the new version format.
         type00 += ', symbian_time'
         type80, typec0 = (t + ', dunix_time' for t in (type80, typec0))
-    type_store = ('unix_time, t_time, y_degree, x_degree, z_ax, v, d_dist, '
-                  'dist, track_count, file_type')
     TrackptType00 = namedtuple('TrackptType00', type00)
     TrackptType80 = namedtuple('TrackptType80', type80)
     TrackptTypeC0 = namedtuple('TrackptTypeC0', typec0)
-    TrackptStore_ = namedtuple('TrackptStore', type_store)
-    TrackptStore_.__new__.__defaults__ = (None,) * len(TrackptStore_._fields)
 
     # Defines dicts to change how to process trackpoints.  Keys are headers.
     if not new_format: # Old format.
@@ -398,7 +673,21 @@ def define_data_structures_and_formats(new_format=None):
             # 19 bytes (1+2+2+2+2+2+2+4+2). 2-byte dv, 4-byte d_dist.
             0xDF:(process_trackpt_type80, TrackptTypeC0, '<B6hiH')}
 
-    return switch, TrackptStore_
+    return switch, TrackptStore
+
+# A namedtuple to wrap a trackpoint after processing, see store_trackpt().
+TrackptStore = namedtuple(
+    'TrackptStore', 'unix_time, t_time, y_degree, x_degree, z_ax, v, d_dist, '
+    'dist, track_count, file_type', defaults=(None, ) * 10)
+
+def trackpt_columns(trackpts):
+    """Transpose a list of trackpt_store to a dict of columns (tuples).
+
+    >>> trackpt_columns([TrackptStore(t_time=0, dist=0), 
+    ...                  TrackptStore(t_time=1, dist=5)])['dist']
+    (0, 5)
+    """
+    return dict(zip(TrackptStore._fields, zip(*trackpts)))
 
 def process_trackpt_type00(tp, tp_store, new_format=None):
     """Process a trackpoint (tp) of the type with the previous one (tp_store).
@@ -456,13 +745,31 @@ def process_trackpt_type80(tp, tp_store, new_format=None):
 
     return unix_time, t_time, y, x, z, v, d_dist, dist
 
+# A checkpoint to resume reading trackpoints, see read_trackpoints().
+# Offset is the address of the next trackpt, track_count the number of trackpts 
+# and pause_count the number of pause data consumed before the offset.  
+# Trackpt_store holds the absolute state which the next delta trackpt needs.
+Checkpoint = namedtuple(
+    'Checkpoint', 'offset, track_count, pause_count, trackpt_store')
+CHECKPOINT_INTERVAL = 1000 # Trackpts.
+
 (DEBUG_READ_TRACK, PRINT_NUM_TRACKPT_ADDRESS) = (False, False)
-def read_trackpoints(file_obj, pause_list=None): # No pause_list if ROUTE.
+def read_trackpoints(file_obj, pause_list=None, store=None, checkpoints=None, 
+                     start=None, stop=None):
     """Read/process/store trackpoints.  Uses a few global constant (see below).
 
     Args:
         file_obj: the pointer must be at an appropriate position prior to read.
-        pause_list (optional): a list obtained from read_pause_data().
+        pause_list (optional): a list obtained from read_pause_data().  Not 
+            used in ROUTE.
+        store (optional): a function to handle each trackpt_store, e.g. 
+            list.append to collect trackpoints.  Defaults to store_trackpt.
+        checkpoints (optional): a list to be appended with a Checkpoint at 
+            every CHECKPOINT_INTERVAL trackpts, see time_index.py.
+        start (optional): a Checkpoint to resume reading from.  The pointer 
+            of file_obj is moved to its offset.
+        stop (optional): track_count to stop reading at.  Defaults to the 
+            number of trackpts.
 
     Returns:
         track_count: number of trackpoints read.
@@ -548,25 +855,40 @@ def read_trackpoints(file_obj, pause_list=None): # No pause_list if ROUTE.
     # Obtains a switch to change formats and a factory function of namedtuple.
     switch_formats, TrackptStore = define_data_structures_and_formats()
 
-    # For ROUTE, use mtime as starttime because no start/stop times are given.
-    starttime = (Path(file_obj.name).stat().st_mtime if FILE_TYPE == ROUTE 
-                 else START_TIME)
+    # For ROUTE, use ROUTE_START_TIME (or mtime) as starttime because no 
+    # start/stop times are given.
+    starttime = (START_TIME if FILE_TYPE != ROUTE 
+                 else ROUTE_START_TIME if ROUTE_START_TIME is not None 
+                 else file_mtime(file_obj))
     # A temporal storage for the processed trackpt.
     trackpt_store = TrackptStore(unix_time=starttime, t_time=0, dist=0)
 
-    # This is the main loop.
+    if store is None: store = store_trackpt
+
     track_count = 0
-    while track_count < num_trackpt:
+    num_pause = len(pause_list) if pause_list else 0
+    if start is not None: # Resume from a checkpoint.
+        file_obj.seek(start.offset, 0)
+        if pause_list: del pause_list[:start.pause_count]
+        (track_count, trackpt_store) = (start.track_count, start.trackpt_store)
+    stop_count = num_trackpt if stop is None else min(stop, num_trackpt)
+
+    # This is the main loop.
+    while track_count < stop_count:
 
         exit_code = read_trackpt() # In trackpt_store, after processing.
         if exit_code: break
 
-        store_trackpt(trackpt_store)
+        store(trackpt_store)
 
         track_count += 1
+        if checkpoints is not None and track_count % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append(Checkpoint(
+                file_obj.tell(), track_count, 
+                num_pause - len(pause_list or ()), trackpt_store))
 
     # Handling of errors.
-    if track_count != num_trackpt:
+    if track_count != stop_count:
         print(f'Trackpoint count error: {track_count}, {num_trackpt}')
         print(*trackpt_store)
         sys.exit(1)
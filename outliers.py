@@ -0,0 +1,154 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for removing outliers (spikes) of tracks/routes of any file type.
+
+The columns of a list of trackpt_store (see store_trackpt() in nst.py) are
+filtered as a whole:
+1) Hampel filter: a value further than n_sigma * 1.4826 * MAD (median absolute
+   deviation) from the median of the window around it is an outlier.  Applied
+   to lat./lon. and altitude; deviations within MIN_DEVIATION are not.
+2) Speed: a point of which the speeds from the previous and to the next point
+   are both over MAX_SPEEDS of the activity is a spike.  A jump (e.g. after
+   the GPS signal is lost) is not, since the points after it stay there.
+Outliers are replaced by linear interpolation of the good points before and
+after them in t_time (in index for routes); unixtime, speed and distance are
+kept.  Vectorized by using NumPy if available, though a fallback to pure
+python is implemented.
+"""
+import math
+import statistics
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    USE_NUMPY = True
+except ImportError: # Fallback to pure python.
+    USE_NUMPY = False
+
+import nst
+import simplify
+import resample
+
+WINDOW = 7 # Points in the window of the Hampel filter (odd).
+N_SIGMA = 3.0
+MAD_SCALE = 1.4826 # MAD to the standard deviation of a normal distribution.
+MIN_DEVIATION = {'y_degree': 0.0002, 'x_degree': 0.0002, 'z_ax': 20.0}
+# Max. speed (m/s) of each activity, see ACTIVITIES in nst.py.
+MAX_SPEEDS = {'Walking': 10, 'Running': 12, 'Cycling': 30, 'Skiing': 25,
+              'Mountain biking': 25, 'Hiking': 10, 'Roller skating': 20,
+              'Downhill skiing': 50, 'Paddling': 10, 'Rowing': 10,
+              'Golf': 10, 'Indoor': 10}
+DEFAULT_MAX_SPEED = 100 # Of the other activities.
+
+def hampel(values, window=WINDOW, n_sigma=N_SIGMA, min_deviation=0):
+    """Outliers by the Hampel filter; the ends are padded by the edge values.
+
+    Returns:
+        a list (or numpy array) of bool.
+
+    >>> [bool(b) for b in hampel([0, 0, 0, 9, 0, 0, 0], 5)]
+    [False, False, False, True, False, False, False]
+    """
+    half = window // 2
+    if USE_NUMPY:
+        values = np.asarray(values, dtype=float)
+        windows = sliding_window_view(np.pad(values, half, mode='edge'),
+                                      2 * half + 1)
+        medians = np.median(windows, axis=1)
+        mads = np.median(np.abs(windows - medians[:, None]), axis=1)
+        return np.abs(values - medians) > np.maximum(
+            n_sigma * MAD_SCALE * mads, min_deviation)
+    padded = [values[0]] * half + list(values) + [values[-1]] * half
+    outliers = []
+    for (i, value) in enumerate(values):
+        window_ = padded[i:i + 2 * half + 1]
+        median = statistics.median(window_)
+        mad = statistics.median(abs(v - median) for v in window_)
+        outliers.append(abs(value - median)
+                        > max(n_sigma * MAD_SCALE * mad, min_deviation))
+    return outliers
+
+def spikes(trackpts, max_speed):
+    """Points too fast both from the previous and to the next point."""
+    (xs, ys) = simplify.project(trackpts)
+    times = [tp.unix_time for tp in trackpts]
+    if USE_NUMPY:
+        speeds = np.hypot(np.diff(xs), np.diff(ys)) / np.maximum(
+            np.diff(times), 1.0)
+        fast = speeds > max_speed
+        return (np.concatenate(([False], fast))
+                & np.concatenate((fast, [False])))
+    fast = [math.hypot(xs[i + 1] - xs[i], ys[i + 1] - ys[i])
+            / max(times[i + 1] - times[i], 1.0) > max_speed
+            for i in range(len(trackpts) - 1)]
+    return [False] + [a and b for (a, b) in zip(fast, fast[1:])] + [False]
+
+def _or(a, b):
+    if USE_NUMPY: return np.logical_or(a, b)
+    return [x or y for (x, y) in zip(a, b)]
+
+def _replace(xs, values, outliers):
+    """Values of outliers replaced by interpolation of the others in xs."""
+    if USE_NUMPY:
+        (values, outliers) = (np.asarray(values, dtype=float),
+                              np.asarray(outliers, dtype=bool))
+        good = ~outliers
+        values[outliers] = np.interp(np.asarray(xs)[outliers],
+                                     np.asarray(xs)[good], values[good])
+        return values.tolist()
+    good = [i for (i, bad) in enumerate(outliers) if not bad]
+    bad = [i for (i, bad) in enumerate(outliers) if bad]
+    interpolated = resample._interpolate(
+        [xs[i] for i in good], [values[i] for i in good], [xs[i] for i in bad])
+    values = list(values)
+    for (i, value) in zip(bad, interpolated): values[i] = value
+    return values
+
+def filter_outliers(trackpts, activity=None, window=WINDOW, n_sigma=N_SIGMA):
+    """Replaces outliers of positions and altitudes, see module docstring.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        activity (optional): name of the activity, see nst.activity_name().
+        window, n_sigma (optional): of the Hampel filter.
+
+    Returns:
+        a list of trackpt_store and the number of points replaced.
+    """
+    if len(trackpts) < 3: return list(trackpts), 0
+    columns = nst.trackpt_columns(trackpts)
+    is_track = trackpts[0].file_type != nst.ROUTE
+    position = _or(*(hampel(columns[key], window, n_sigma, MIN_DEVIATION[key])
+                     for key in ('y_degree', 'x_degree')))
+    if is_track: # No times in routes.
+        position = _or(position, spikes(
+            trackpts, MAX_SPEEDS.get(activity, DEFAULT_MAX_SPEED)))
+    altitude = hampel(columns['z_ax'], window, n_sigma, MIN_DEVIATION['z_ax'])
+    (num_position, num_altitude) = (int(sum(position)), int(sum(altitude)))
+    if (num_position in (0, len(trackpts))
+            and num_altitude in (0, len(trackpts))):
+        return list(trackpts), 0
+    xs = columns['t_time'] if is_track else range(len(trackpts))
+    (ys, xs_, zs) = (columns['y_degree'], columns['x_degree'],
+                     columns['z_ax'])
+    if 0 < num_position < len(trackpts):
+        (ys, xs_) = (_replace(xs, ys, position), _replace(xs, xs_, position))
+    if 0 < num_altitude < len(trackpts): zs = _replace(xs, zs, altitude)
+    filtered = [tp._replace(y_degree=y, x_degree=x, z_ax=z)
+                for (tp, y, x, z) in zip(trackpts, ys, xs_, zs)]
+    return filtered, int(sum(_or(position, altitude)))
+
+def add_arguments(parser):
+    """Adds options of the outlier filter to an argparse parser."""
+    group = parser.add_argument_group('outlier filter')
+    group.add_argument('--filter', action='store_true', help='replace spikes '
+                       'of positions/altitudes (Hampel filter and max. speed '
+                       'of the activity) by interpolation.')
+    group.add_argument('--filter-window', type=int, default=WINDOW,
+                       metavar='POINTS', help='window of the Hampel filter '
+                       f'(default: {WINDOW}).')
+    group.add_argument('--filter-sigma', type=float, default=N_SIGMA,
+                       metavar='N', help='threshold of the Hampel filter in '
+                       f'sigma (default: {N_SIGMA}).')
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A packed file of decoded tracks for instant reload without decoding.
+
+The file consists of:
+1) header: MAGIC, VERSION, number of tracks and offset of the index.
+2) columns of each track: COLUMNS of trackpt_store as float64 arrays, one
+   after another (8-byte aligned).
+3) metadata: UTF-8 JSON of each track (path, name, activity, etc.).
+4) index: a fixed-width record (INDEX_FMT) per track of offsets and sizes of
+   the columns and the metadata, with start time, total time and distance.
+Pack opens the file by mmap; a track is located in O(1) by the index and its
+columns are NumPy views (or memoryview.cast('d') without NumPy) of the mmap,
+i.e. no copy and no decoding.  PackWriter writes tracks one by one as they
+are decoded, e.g. by convert_nst_files_to_gpx.py --pack, appending to the
+existing pack (the tracks of the same paths are replaced); the header is
+rewritten at the end, so that an interrupted pack keeps the tracks before.
+
+Usage:
+    python pack.py pack_file
+lists the tracks in the pack.
+"""
+import json
+import mmap
+import math
+import struct
+import argparse
+from pathlib import Path
+try:
+    import numpy as np
+except ImportError: # memoryview.cast('d') instead.
+    np = None
+
+import nst
+
+MAGIC = b'NSTP'
+VERSION = 1
+HEADER_FMT = '<4sIQQ' # Magic, version, number of tracks, index offset.
+# Offset of columns, number of points, offset and size of metadata, file
+# type, start time (unixtime), total time (s) and total distance (km).
+INDEX_FMT = '<QQQIBxxx3d'
+COLUMNS = ('unix_time', 't_time', 'y_degree', 'x_degree', 'z_ax', 'v',
+           'd_dist', 'dist') # Float64 each, see TrackptStore in nst.py.
+
+class PackWriter(object):
+    """Writes decoded tracks to a pack file, appended if it exists.
+
+    A track of the same path as one in the pack replaces it; the old columns
+    are left unused.  The header on the disk is provisional until close(), of
+    no tracks in a new file or that of the existing pack, so that a pack
+    interrupted (e.g. killed in a batch) is still readable without the tracks
+    added since it was opened.
+    """
+    def __init__(self, path):
+        path = Path(path)
+        (self.index, self.metadata, self.paths) = ([], [], [])
+        if path.exists() and path.stat().st_size > 0:
+            pack = Pack(path) # ValueError if it is not a pack file.
+            for i in range(len(pack)):
+                (offset, size, meta_offset, meta_size, *rest) = pack._entry(i)
+                self.metadata.append(pack.mm[meta_offset:
+                                             meta_offset + meta_size])
+                self.index.append((offset, size, meta_size, *rest))
+                self.paths.append(pack.header(i)['path'])
+            pack.close()
+            self.f = path.open(mode='r+b')
+            self.f.seek(0, 2) # The old index is valid until close().
+        else:
+            self.f = path.open(mode='wb')
+            self.f.write(struct.pack(HEADER_FMT, MAGIC, VERSION, 0, 0))
+
+    def add(self, trackpts, metadata, file_type=nst.TRACK, start_time=None,
+            total_time=0, total_distance=0):
+        """Appends the columns of a track (a list of trackpt_store)."""
+        path = metadata.get('path')
+        if path is not None and path in self.paths: # Replaced.
+            i = self.paths.index(path)
+            del self.index[i], self.metadata[i], self.paths[i]
+        offset = self.f.tell()
+        columns = nst.trackpt_columns(trackpts)
+        for name in COLUMNS: # None (e.g. no times in routes) as NaN.
+            self.f.write(struct.pack(f'<{len(trackpts)}d', *(
+                math.nan if v is None else v for v in columns.get(name, ()))))
+        data = json.dumps(metadata, ensure_ascii=False).encode()
+        self.metadata.append(data)
+        self.index.append((offset, len(trackpts), len(data), file_type,
+                           math.nan if start_time is None else start_time,
+                           total_time or 0, total_distance or 0))
+        self.paths.append(path)
+
+    def add_decoded(self, in_file, trackpts):
+        """Appends a track just decoded, of which the header is in nst.py."""
+        is_track = nst.FILE_TYPE == nst.TRACK
+        self.add(trackpts, {
+            'path': str(in_file),
+            'name': nst.track_name if is_track else nst.route_name,
+            'activity': nst.activity_type, 'comment': nst.comment,
+            'user': nst.user_name(nst.USER_ID) if is_track else None,
+            'tz_hours': nst.TZ_HOURS}, nst.FILE_TYPE,
+                 nst.START_TIME if is_track else None, nst.total_time,
+                 nst.total_distance)
+
+    def close(self):
+        metadata_offset = self.f.tell()
+        for data in self.metadata: self.f.write(data)
+        self.f.write(bytes(-self.f.tell() % 8)) # Align the index.
+        index_offset = self.f.tell()
+        for (offset, size, meta_size, *rest) in self.index:
+            self.f.write(struct.pack(INDEX_FMT, offset, size,
+                                     metadata_offset, meta_size, *rest))
+            metadata_offset += meta_size
+        self.f.seek(0, 0)
+        self.f.write(struct.pack(HEADER_FMT, MAGIC, VERSION, len(self.index),
+                                 index_offset))
+        self.f.close()
+
+class Pack(object):
+    """A read-only pack file by mmap, see module-level docstring."""
+    def __init__(self, path):
+        with Path(path).open(mode='rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.num_tracks, self.index_offset) = (
+            struct.unpack_from(HEADER_FMT, self.mm)
+            if len(self.mm) >= struct.calcsize(HEADER_FMT) else (None, ) * 4)
+        if (magic, version) != (MAGIC, VERSION):
+            raise ValueError(f'Not a pack file of version {VERSION}: {path}')
+        self.paths = None # {path: i}, made at the first find().
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.num_tracks
+
+    def _entry(self, i):
+        if not 0 <= i < self.num_tracks: raise IndexError(i)
+        return struct.unpack_from(INDEX_FMT, self.mm, self.index_offset
+                                  + i * struct.calcsize(INDEX_FMT))
+
+    def header(self, i):
+        """Metadata of the i-th track with file_type, start_time, etc."""
+        (_, size, meta_offset, meta_size, file_type, start_time, total_time,
+         total_distance) = self._entry(i)
+        header = json.loads(self.mm[meta_offset:meta_offset + meta_size])
+        header.update(file_type=file_type, num_points=size,
+                      start_time=None if math.isnan(start_time) else start_time,
+                      total_time=total_time, total_distance=total_distance)
+        return header
+
+    def columns(self, i):
+        """Columns of the i-th track as read-only views of the mmap.
+
+        Returns:
+            a dict of {name: numpy array (or memoryview of 'd')}.
+        """
+        (offset, size) = self._entry(i)[:2]
+        views = {}
+        for name in COLUMNS:
+            views[name] = (
+                np.frombuffer(self.mm, np.float64, size, offset) if np
+                else memoryview(self.mm)[offset:offset + size * 8].cast('d'))
+            offset += size * 8
+        return views
+
+    def trackpts(self, i):
+        """A list of trackpt_store of the i-th track, e.g. for analytics.py.
+
+        NaN in the columns is restored to None.
+        """
+        columns = self.columns(i)
+        file_type = self._entry(i)[4]
+        return [nst.TrackptStore(*(None if v != v else v for v in values),
+                                 track_count=count, file_type=file_type)
+                for (count, values) in enumerate(zip(
+                    *(columns[name].tolist() for name in COLUMNS)))]
+
+    def find(self, path):
+        """Index of the track of the input path, or None."""
+        if self.paths is None:
+            self.paths = {self.header(i)['path']: i for i in range(len(self))}
+        return self.paths.get(str(path))
+
+def main():
+    parser = argparse.ArgumentParser(description='List tracks in a pack file.')
+    parser.add_argument('pack', type=Path)
+    args = parser.parse_args()
+
+    pack = Pack(args.pack)
+    for i in range(len(pack)):
+        header = pack.header(i)
+        start = (nst.format_datetime(header['start_time']) + 'Z'
+                 if header['start_time'] is not None else '')
+        print(f'{i}\t{header["path"]}\t{header["name"]}\t{start}\t'
+              f'{header["num_points"]}')
+    pack.close()
+
+
+if __name__ == '__main__':
+    main()
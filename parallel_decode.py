@@ -0,0 +1,200 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Decoding of a very large track/route in parallel (--decode-jobs).
+
+The trackpoint-data block is split at absolute trackpts (0x07 in the new
+format, 0x00/0x02/0x03 in the old), of which the position, altitude and speed
+do not depend on the previous one.  scan() reads the block once without
+processing the positions, i.e. only the headers, t_time, unix_time, d_dist and
+the pause data to be consumed, in the same arithmetic as nst.read_trackpoints()
+does.  The state before each absolute trackpt is an nst.Checkpoint, from which
+a chunk is decoded in a worker process by nst.read_trackpoints(start=, stop=).
+Chunks are stored in order, so that the output is identical to that of serial
+decoding.  Small files, non-seekable input, blocks with errors (reported by
+the serial decoder) and files in worker processes (e.g. of async_convert.py)
+are decoded serially.
+"""
+import gc
+import io
+import struct
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import nst
+
+JOBS = 1 # Worker processes per file; 1 to decode serially.
+MIN_CHUNK = 20000 # Min. trackpts per chunk (worker).
+# Module-level variables of nst.py used in nst.read_trackpoints().
+STATE_VARIABLES = ('NEW_FORMAT', 'FILE_TYPE', 'TZ_HOURS', 'START_TIME',
+                   'ROUTE_START_TIME')
+
+_executor = None
+def executor():
+    """A process pool of JOBS workers, shared by the files."""
+    global _executor
+    if _executor is None: _executor = ProcessPoolExecutor(max_workers=JOBS)
+    return _executor
+
+@contextlib.contextmanager
+def no_gc():
+    """Disables the cyclic garbage collector, e.g. to make many trackpts.
+
+    Trackpts (tuples of numbers) are never in cycles, though the collector
+    traverses all of them repeatedly as they grow; the decoding of a large
+    track takes about twice as long with it.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled: gc.enable()
+
+def scan(data, num_trackpt, pause_list, starttime):
+    """Checkpoints at absolute trackpts of a trackpoint-data block.
+
+    Args:
+        data: bytes of the trackpoint-data block after the number of trackpts.
+        num_trackpt: number of trackpts.
+        pause_list: a list obtained from nst.read_pause_data() (not consumed).
+        starttime: unixtime of the start, see nst.read_trackpoints().
+
+    Returns:
+        a list of nst.Checkpoint (offsets in data), the size of the block and
+        the number of pause data consumed, or None if there is an error.
+    """
+    switch, TrackptStore = nst.define_data_structures_and_formats()
+    # {header: (struct, index of d_dist, absolute)}
+    records = {header: (struct.Struct(fmt), Trackpt._fields.index('d_dist'),
+                        process is nst.process_trackpt_type00)
+               for (header, (process, Trackpt, fmt)) in switch.items()}
+    (new_format, header_size) = (nst.NEW_FORMAT, 2 if nst.NEW_FORMAT else 1)
+    tz_seconds = (nst.TZ_HOURS or 0) * 3600
+    num_pause = len(pause_list) if pause_list else 0
+
+    (unix_time, t_time, dist, pause_count, offset) = (starttime, 0, 0, 0, 0)
+    checkpoints = []
+    for track_count in range(num_trackpt):
+        try:
+            (record, d_dist_index, absolute) = records[data[offset]]
+        except (KeyError, IndexError): # Unknown header or the end of data.
+            return None
+        if absolute or track_count == 0:
+            checkpoints.append(nst.Checkpoint(
+                offset, track_count, pause_count, TrackptStore(
+                    unix_time=unix_time, t_time=t_time, dist=dist)))
+        if offset + header_size + record.size > len(data): return None
+        fields = record.unpack_from(data, offset + header_size)
+        offset += header_size + record.size
+
+        if absolute: # See nst.process_trackpt_type00().
+            t_time_ = fields[0] / 100
+            unix_time = (nst.symbian_to_unix_time(fields[-1]) if new_format
+                         else unix_time + (t_time_ - t_time))
+        else: # See nst.process_trackpt_type80().
+            t_time_ = t_time + fields[0] / 100
+            unix_time += (fields[-1] if new_format else fields[0]) / 100
+        t_time = t_time_
+        dist += fields[d_dist_index]
+
+        if pause_count < num_pause: # See read_trackpt() of read_trackpoints().
+            (t4_time, _, resume_time) = pause_list[pause_count]
+            if t_time + 0.5 >= t4_time:
+                pause_count += 1
+                if not new_format: resume_time -= tz_seconds
+                if ((not new_format or not absolute)
+                        and unix_time < resume_time):
+                    unix_time = (t_time - t4_time) + resume_time
+    return checkpoints, offset, pause_count
+
+def split(checkpoints, num_trackpt, num_chunks):
+    """Checkpoints to start the chunks of about the same number of trackpts.
+
+    >>> [cp.track_count for cp in split(
+    ...     [nst.Checkpoint(0, i, 0, None) for i in range(0, 100, 7)], 100, 4)]
+    [0, 28, 56, 77]
+    """
+    starts = []
+    for i in range(num_chunks):
+        target = i * num_trackpt // num_chunks
+        start = next((cp for cp in checkpoints if cp.track_count >= target),
+                     None)
+        if start is not None and (not starts or start is not starts[-1]):
+            starts.append(start)
+    return starts
+
+def decode_chunk(state, data, start, stop, pause_list):
+    """Decodes trackpts of data (from start to stop) in a worker process.
+
+    Returns:
+        a dict of columns, see nst.trackpt_columns().  Columns of numbers are
+        pickled and unpickled much faster than namedtuples.
+    """
+    vars(nst).update(state)
+    trackpts = []
+    # The number of trackpts followed by the chunk, see read_trackpoints().
+    with io.BytesIO(struct.pack('<I', stop) + data) as f, no_gc():
+        nst.read_trackpoints(f, pause_list, trackpts.append,
+                             start=start._replace(offset=4), stop=stop)
+        return nst.trackpt_columns(trackpts)
+
+def read_trackpoints(file_obj, pause_list=None, store=None, **kwargs):
+    """nst.read_trackpoints() decoding in JOBS processes if it is worth it.
+
+    Args and returns are the same as those of nst.read_trackpoints().
+    Kwargs (checkpoints, start, stop) are only supported in serial.
+    """
+    seekable = getattr(file_obj, 'seekable', None) # Mmap has no seekable().
+    if (JOBS <= 1 or kwargs or nst.FILE_TYPE not in {nst.TRACK, nst.ROUTE}
+            or (seekable is not None and not seekable())
+            # Not to nest pools, e.g. in workers of async_convert.py.
+            or multiprocessing.parent_process() is not None):
+        return nst.read_trackpoints(file_obj, pause_list, store, **kwargs)
+    address = file_obj.tell()
+    (num_trackpt, ) = nst.read_unpack('<I', file_obj)
+    num_chunks = min(JOBS, num_trackpt // MIN_CHUNK)
+    starttime = (nst.START_TIME if nst.FILE_TYPE != nst.ROUTE
+                 else nst.ROUTE_START_TIME if nst.ROUTE_START_TIME is not None
+                 else nst.file_mtime(file_obj))
+    data = file_obj.read() if num_chunks > 1 else b''
+    scanned = (scan(data, num_trackpt, pause_list, starttime)
+               if num_chunks > 1 else None)
+    if scanned is None: # Small, or errors to be reported in serial.
+        file_obj.seek(address, 0)
+        return nst.read_trackpoints(file_obj, pause_list, store)
+
+    (checkpoints, size, pause_count) = scanned
+    starts = split(checkpoints, num_trackpt, num_chunks)
+    stops = [cp.track_count for cp in starts[1:]] + [num_trackpt]
+    ends = [cp.offset for cp in starts[1:]] + [size]
+    state = {name: getattr(nst, name) for name in STATE_VARIABLES}
+    state['ROUTE_START_TIME'] = starttime # Not to stat() in workers.
+    pauses = list(pause_list or ())
+    chunks = executor().map(
+        decode_chunk, [state] * len(starts),
+        [data[cp.offset:end] for (cp, end) in zip(starts, ends)],
+        starts, stops, [pauses] * len(starts))
+
+    if store is None: store = nst.store_trackpt
+    trackpt_store = None
+    with no_gc(): # Chunks are unpickled in a thread of the executor.
+        for columns in chunks:
+            for trackpt_store in map(nst.TrackptStore._make,
+                                     zip(*columns.values())):
+                store(trackpt_store)
+    if pause_list: # Consumed as in nst.read_trackpoints().
+        del pause_list[:pause_count]
+    file_obj.seek(address + 4 + size, 0)
+    return num_trackpt, trackpt_store
+
+def add_arguments(parser):
+    """Adds options of parallel decoding to an argparse parser."""
+    group = parser.add_argument_group('parallel decoding')
+    group.add_argument('--decode-jobs', type=int, default=1, metavar='N',
+                       help='decode a large track (over '
+                       f'{MIN_CHUNK} trackpts per job) in N processes; 0 for '
+                       'the number of CPUs (default: 1).')
@@ -0,0 +1,136 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for resampling tracks of Symbian (Nokia) SportsTracker files.
+
+Trackpoints of the old (0x80/0x92/...) and the new (0x87/0x97/...) formats are
+irregularly sampled.  resample() interpolates the columns of a list of
+trackpt_store (see store_trackpt() in nst.py) linearly onto a fixed grid of
+unixtime, which is aligned to multiples of the interval so that tracks can be
+compared to each other.  Grid points are not made in pauses; the pauses are
+taken from the pause_list of nst.read_pause_data(), or found as jumps of
+unix_time relative to t_time if no pause_list is given (e.g. in Rec*.tmp).
+
+Vectorized by using NumPy if available, though a fallback to pure python is
+implemented.
+"""
+import math
+try:
+    import numpy as np
+    USE_NUMPY = True
+except ImportError: # Fallback to pure python.
+    USE_NUMPY = False
+
+import nst
+
+MIN_PAUSE = 5 # Min. jump (s) of unix_time relative to t_time seen as pause.
+COLUMNS = ('unix_time', 't_time', 'y_degree', 'x_degree', 'z_ax', 'v', 'dist')
+
+def find_breaks(trackpts, pause_list=None):
+    """Find indices of the first trackpoint after each pause.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        pause_list (optional): a list of (t_time, pause_time, unix_time) from
+            nst.read_pause_data().  Pauses are found by MIN_PAUSE if None.
+
+    Returns:
+        a sorted list of indices.
+    """
+    breaks = set()
+    if pause_list is not None:
+        # The same criterion as in nst.read_trackpoints().
+        t4_times = sorted(t4_time for (t4_time, pause_time, _) in pause_list
+                          if pause_time > 0)
+        index = 0
+        for t4_time in t4_times:
+            while (index < len(trackpts)
+                   and trackpts[index].t_time + 0.5 < t4_time):
+                index += 1
+            if 0 < index < len(trackpts): breaks.add(index)
+    else:
+        for i in range(1, len(trackpts)):
+            (previous, tp) = (trackpts[i - 1], trackpts[i])
+            if ((tp.unix_time - previous.unix_time)
+                    - (tp.t_time - previous.t_time) >= MIN_PAUSE):
+                breaks.add(i)
+    return sorted(breaks)
+
+def _grid(start, stop, interval):
+    """Unixtimes of multiples of the interval in [start, stop]."""
+    first = math.ceil(start / interval)
+    last = math.floor(stop / interval)
+    return [i * interval for i in range(first, last + 1)]
+
+def _interpolate(xs, ys, grid):
+    """Pure python version of numpy.interp() for increasing xs and grid."""
+    (result, j) = ([], 0)
+    for x in grid:
+        while j < len(xs) - 2 and xs[j + 1] < x:
+            j += 1
+        if len(xs) == 1 or x <= xs[j]:
+            result.append(ys[j])
+            continue
+        (x0, x1, y0, y1) = (xs[j], xs[j + 1], ys[j], ys[j + 1])
+        result.append(y1 if x >= x1 else y0 + (y1 - y0) * (x - x0) / (x1 - x0))
+    return result
+
+def _resample_segment(segment, interval):
+    """Returns a dict of interpolated columns of a segment (w/o pauses)."""
+    # Drop non-increasing unix_times which would break the interpolation.
+    (increasing, last_time) = ([], -math.inf)
+    for tp in segment:
+        if tp.unix_time > last_time:
+            increasing.append(tp)
+            last_time = tp.unix_time
+    columns = nst.trackpt_columns(increasing)
+    grid = _grid(columns['unix_time'][0], columns['unix_time'][-1], interval)
+    if not grid: return None
+
+    if USE_NUMPY:
+        (xs, grid_) = (np.array(columns['unix_time']), np.array(grid))
+        return {key: (grid_ if key == 'unix_time'
+                      else np.interp(grid_, xs, np.array(columns[key])))
+                for key in COLUMNS}
+    return {key: (grid if key == 'unix_time'
+                  else _interpolate(columns['unix_time'], columns[key], grid))
+            for key in COLUMNS}
+
+def resample(trackpts, interval=1, pause_list=None):
+    """Resample trackpoints onto a fixed grid of unixtime.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        interval (optional): of the grid in seconds.  Defaults to 1.
+        pause_list (optional): see find_breaks().
+
+    Returns:
+        a list of trackpt_store.  d_dist is recalculated and track_count is
+        renumbered.
+    """
+    if not trackpts: return []
+    file_type = trackpts[0].file_type
+    breaks = [0] + find_breaks(trackpts, pause_list) + [len(trackpts)]
+
+    (resampled, track_count, last_dist) = ([], 0, 0)
+    for (start, stop) in zip(breaks[:-1], breaks[1:]):
+        columns = _resample_segment(trackpts[start:stop], interval)
+        if columns is None: continue
+        for (unix_time, t_time, y_degree, x_degree, z_ax, v, dist) in zip(
+                *(columns[key] for key in COLUMNS)):
+            dist = round(float(dist)) # Int. distance (cm).
+            resampled.append(nst.TrackptStore(
+                unix_time=float(unix_time), t_time=float(t_time),
+                y_degree=float(y_degree), x_degree=float(x_degree),
+                z_ax=float(z_ax), v=round(float(v)),
+                d_dist=dist - last_dist if track_count else dist, dist=dist,
+                track_count=track_count, file_type=file_type))
+            (track_count, last_dist) = (track_count + 1, dist)
+    return resampled
+
+def add_arguments(parser):
+    """Adds an option of resampling to an argparse parser."""
+    parser.add_argument('--resample', type=float, default=0, metavar='SECONDS',
+                        help='resample trackpoints onto a fixed time grid.')
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A local HTTP API of tracks/routes (W*.dat and R*.dat) in a directory.
+
+Endpoints (GET, JSON unless noted):
+    /tracks                 list of files: path, size and mtime.
+    /meta/PATH              header (name, activity, start time, totals, etc.),
+                            number of points and bounding box.
+    /geojson/PATH           a GeoJSON Feature (LineString) of the points.
+    /gpx/PATH               gpx (application/gpx+xml), as the converter.
+    /metrics                latencies (ms) per endpoint and the cache.
+where PATH is relative to the directory.  /meta, /geojson and /gpx take an
+optional time window in UTC, ?start=2009-08-27T09:00:00&stop=...
+
+Decoded tracks are kept in an LRU cache bounded by (estimated) bytes, keyed on
+path, size and mtime of the file so that a modified file is decoded again.
+The ETag of a response is of the size and mtime; If-None-Match of the same
+file is answered by 304.  The server is threaded, but decoding is serialized
+by DECODE_LOCK because nst.py keeps the header in module-level variables.
+
+Usage:
+    python serve.py [--port 8000] [--cache-size 256] directory
+The server listens on localhost only (by default).
+"""
+import io
+import sys
+import json
+import time
+import threading
+import argparse
+from collections import OrderedDict, deque, namedtuple
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import nst
+import convert_nst_files_to_gpx as converter
+
+DECODE_LOCK = threading.Lock() # Module-level variables in nst.py.
+# Module-level variables of the header in nst.py, restored to make gpx.
+HEADER_VARIABLES = ('total_time', 'total_distance', 'comment', 'route_name',
+                    'track_name', 'TZ_HOURS', 'START_LOCALTIME',
+                    'activity_type', 'USER_ID', 'START_TIME', 'NEW_FORMAT',
+                    'FILE_TYPE', 'stop_localtime')
+# Estimated bytes of a trackpt_store in a list: the namedtuple, its floats
+# and the pointer.
+POINT_SIZE = (sys.getsizeof(nst.TrackptStore(*(0.0, ) * 8, 0, nst.TRACK))
+              + 8 * sys.getsizeof(0.0) + 8)
+ENDPOINTS = ('tracks', 'meta', 'geojson', 'gpx', 'metrics')
+NUM_LATENCIES = 1000 # Latencies kept per endpoint for percentiles.
+
+# A decoded file: header variables (dict), trackpts, the last trackpt_store
+# after processing (for the gpx summary) and estimated size in bytes.
+Track = namedtuple('Track', 'header, trackpts, last, size')
+
+class LRUCache(object):
+    """A thread-safe LRU cache of Track bounded by the sum of Track.size."""
+    def __init__(self, max_bytes):
+        (self.max_bytes, self.size) = (max_bytes, 0)
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        (self.hits, self.misses) = (0, 0)
+
+    def get(self, key):
+        with self.lock:
+            track = self.items.get(key)
+            if track is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.items.move_to_end(key)
+            return track
+
+    def put(self, key, track):
+        with self.lock:
+            if key in self.items: return
+            if track.size > self.max_bytes: return # Never fits.
+            self.items[key] = track
+            self.size += track.size
+            while self.size > self.max_bytes:
+                (_, evicted) = self.items.popitem(last=False)
+                self.size -= evicted.size
+
+    def stats(self):
+        with self.lock:
+            return {'tracks': len(self.items), 'bytes': self.size,
+                    'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses}
+
+class Metrics(object):
+    """Counts and latencies (the last NUM_LATENCIES) of each endpoint."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {} # {endpoint: [count, deque of latencies (s)]}
+
+    def add(self, endpoint, latency):
+        with self.lock:
+            (count, latencies) = self.endpoints.setdefault(
+                endpoint, [0, deque(maxlen=NUM_LATENCIES)])
+            self.endpoints[endpoint][0] = count + 1
+            latencies.append(latency)
+
+    def stats(self):
+        with self.lock:
+            stats = {}
+            for (endpoint, (count, latencies)) in self.endpoints.items():
+                ms = sorted(latency * 1000 for latency in latencies)
+                stats[endpoint] = {
+                    'count': count, 'mean': round(sum(ms) / len(ms), 3),
+                    'p50': round(ms[len(ms) // 2], 3),
+                    'p95': round(ms[int(len(ms) * 0.95)], 3),
+                    'max': round(ms[-1], 3)}
+            return stats
+
+def decode(in_file):
+    """Decodes a file to Track (the caller holds DECODE_LOCK)."""
+    trackpts = []
+    last = converter.read_file(in_file, trackpts.append)
+    header = {name: getattr(nst, name) for name in HEADER_VARIABLES}
+    return Track(header, trackpts, last, POINT_SIZE * len(trackpts))
+
+def in_window(trackpts, start=None, stop=None):
+    """Trackpts of unix_time in [start, stop], all if not specified."""
+    if start is None and stop is None: return trackpts
+    return [tp for tp in trackpts if tp.unix_time is not None
+            and (start is None or tp.unix_time >= start)
+            and (stop is None or tp.unix_time <= stop)]
+
+def metadata(in_file, track, trackpts):
+    """A dict of the header and the points (in a window) of a Track."""
+    header = track.header
+    is_track = header['FILE_TYPE'] == nst.TRACK
+    times = [tp.unix_time for tp in trackpts if tp.unix_time is not None]
+    return {
+        'path': in_file, 'type': 'track' if is_track else 'route',
+        'name': header['track_name'] if is_track else header['route_name'],
+        'activity': header['activity_type'], 'comment': header['comment'],
+        'start_time': (nst.format_utc(header['START_TIME'])
+                       if is_track else None),
+        'tz_hours': header['TZ_HOURS'],
+        'total_time': header['total_time'],
+        'total_distance': header['total_distance'], # km.
+        'points': len(trackpts),
+        'first_time': nst.format_utc(min(times)) if times else None,
+        'last_time': nst.format_utc(max(times)) if times else None,
+        'bbox': ([min(tp.y_degree for tp in trackpts),
+                  min(tp.x_degree for tp in trackpts),
+                  max(tp.y_degree for tp in trackpts),
+                  max(tp.x_degree for tp in trackpts)]
+                 if trackpts else None)} # South, west, north and east.
+
+def geojson(in_file, track, trackpts):
+    """A GeoJSON Feature (LineString of lon, lat and ele) of trackpts."""
+    properties = metadata(in_file, track, trackpts)
+    if properties['type'] == 'track':
+        properties['coordTimes'] = [nst.format_utc(tp.unix_time)
+                                    for tp in trackpts]
+    return {'type': 'Feature', 'properties': properties,
+            'geometry': {'type': 'LineString', 'coordinates': [
+                [round(tp.x_degree, 6), round(tp.y_degree, 6),
+                 round(tp.z_ax, 1)] for tp in trackpts]}}
+
+def gpx_bytes(in_file, track, trackpts, summary=True):
+    """Gpx of trackpts, with the summary of the file (a path object)."""
+    with DECODE_LOCK:
+        nst.use_config(in_file.parent) # For the name of the user.
+        vars(nst).update(track.header)
+        (gpx, append_pt) = nst.initialize_gpx()
+        for tp in trackpts: nst.store_trackpt(tp, append_pt)
+        if summary and trackpts: nst.add_gpx_summary(gpx, track.last)
+    f = io.BytesIO()
+    gpx.write(f)
+    return f.getvalue()
+
+class Handler(BaseHTTPRequestHandler):
+    """Requests to the server, see module-level docstring."""
+    server_version = 'nst-serve/1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose: super().log_message(format, *args)
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        (endpoint, _, rest) = url.path.lstrip('/').partition('/')
+        try:
+            self.route(endpoint, unquote(rest), parse_qs(url.query))
+        except BrokenPipeError:
+            pass
+        finally:
+            self.server.metrics.add(endpoint if endpoint in ENDPOINTS
+                                    else 'other', time.perf_counter() - start)
+
+    def route(self, endpoint, rest, query):
+        if endpoint == 'tracks' and not rest:
+            self.send_json(self.server.list_files())
+        elif endpoint == 'metrics' and not rest:
+            self.send_json({'endpoints': self.server.metrics.stats(),
+                            'cache': self.server.cache.stats()})
+        elif endpoint in ('meta', 'geojson', 'gpx'):
+            self.track(endpoint, rest, query)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def track(self, endpoint, rest, query):
+        in_file = self.server.resolve(rest)
+        if in_file is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        stat = in_file.stat()
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        try:
+            (start, stop) = (
+                nst.parse_utc(query[name][0]) if name in query else None
+                for name in ('start', 'stop'))
+        except ValueError as e:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+        try:
+            track = self.server.get_track(in_file, stat)
+        except converter.DECODE_ERRORS as e: # E.g. a truncated file.
+            self.send_json({'error': 'Failed to decode the file.',
+                            'detail': str(e) or type(e).__name__},
+                           status=HTTPStatus.UNPROCESSABLE_ENTITY)
+            return
+        trackpts = in_window(track.trackpts, start, stop)
+        if endpoint == 'gpx':
+            self.send(gpx_bytes(in_file, track, trackpts,
+                                summary=start is None and stop is None),
+                      'application/gpx+xml', etag)
+        else:
+            self.send_json((metadata if endpoint == 'meta' else geojson)(
+                rest, track, trackpts), etag)
+
+    def send_json(self, obj, etag=None, status=HTTPStatus.OK):
+        content_type = 'application/json'
+        self.send(json.dumps(obj).encode(), content_type, etag, status)
+
+    def send(self, body, content_type, etag=None, status=HTTPStatus.OK):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None: self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+class TrackServer(ThreadingHTTPServer):
+    """A threaded HTTP server of the tracks/routes in a directory."""
+    daemon_threads = True
+
+    def __init__(self, address, directory, cache_size, verbose=False):
+        super().__init__(address, Handler)
+        self.directory = Path(directory).resolve()
+        self.cache = LRUCache(cache_size)
+        self.metrics = Metrics()
+        self.verbose = verbose
+
+    def list_files(self):
+        files = []
+        for in_file in converter.find_files([self.directory]):
+            stat = in_file.stat()
+            files.append({
+                'path': in_file.relative_to(self.directory).as_posix(),
+                'size': stat.st_size, 'mtime': nst.format_utc(stat.st_mtime)})
+        return files
+
+    def resolve(self, relative_path):
+        """Path object of a file in the directory, or None."""
+        in_file = (self.directory / relative_path).resolve()
+        if (self.directory not in in_file.parents or not in_file.is_file()
+                or not any(in_file.match(pattern)
+                           for pattern in ('W*.dat', 'R*.dat'))):
+            return None
+        return in_file
+
+    def get_track(self, in_file, stat):
+        """Track from the cache or decoded; converter.DECODE_ERRORS if not."""
+        key = (in_file, stat.st_size, stat.st_mtime_ns)
+        track = self.cache.get(key)
+        if track is not None: return track
+        with DECODE_LOCK:
+            track = self.cache.get(key) # Decoded by another thread.
+            if track is not None: return track
+            track = decode(in_file)
+        self.cache.put(key, track)
+        return track
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A local HTTP API of Symbian SportsTracker files.')
+    parser.add_argument('directory', type=Path,
+                        help='directory of W*.dat and R*.dat.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen (default: 8000).')
+    parser.add_argument('--cache-size', type=float, default=256,
+                        metavar='MB', help='max size of decoded tracks in '
+                        'the cache (default: 256 MB).')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log each request to stderr.')
+    args = parser.parse_args()
+    if not args.directory.is_dir():
+        print(f'Not a directory: {args.directory}', file=sys.stderr)
+        sys.exit(1)
+
+    server = TrackServer((args.host, args.port), args.directory,
+                         int(args.cache_size * 1e6), args.verbose)
+    print(f'Serving {args.directory} at http://{args.host}:{args.port}/',
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module for simplifying tracks/routes of Symbian (Nokia) SportsTracker.
+
+Trackpoints are given as a list of trackpt_store (see store_trackpt() in
+nst.py), which is collected by handing list.append to nst.read_trackpoints().
+Two methods are implemented:
+1) decimate(): a streaming decimator which drops trackpoints closer than
+   min_distance (m) and min_time (s) to the last trackpoint kept.
+2) rdp(): Ramer-Douglas-Peucker with a tolerance in meters.  This is iterative
+   (an explicit stack instead of recursion) and vectorized if NumPy is
+   available, though a fallback to pure python is implemented.
+The first and the last trackpoints are always kept.
+"""
+import math
+try:
+    import numpy as np
+    USE_NUMPY = True
+except ImportError: # Fallback to pure python.
+    USE_NUMPY = False
+
+EARTH_RADIUS = 6371008.8 # Mean radius of the earth (m).
+
+def project(trackpts):
+    """Equirectangular projection of lat./lon. to local x/y in meters.
+
+    Precise enough for the size of a track (up to a few hundred km).
+
+    Returns:
+        (xs, ys): lists (or numpy arrays) of x and y in meters.
+    """
+    if not trackpts: return [], []
+    cos_lat = math.cos(math.radians(
+        sum(tp.y_degree for tp in trackpts) / len(trackpts)))
+    (k_x, k_y) = (math.radians(EARTH_RADIUS) * cos_lat,
+                  math.radians(EARTH_RADIUS))
+    if USE_NUMPY:
+        coordinates = np.array([(tp.x_degree, tp.y_degree) for tp in trackpts],
+                               dtype=float)
+        return coordinates[:, 0] * k_x, coordinates[:, 1] * k_y
+    return ([tp.x_degree * k_x for tp in trackpts],
+            [tp.y_degree * k_y for tp in trackpts])
+
+def _farthest_point(xs, ys, first, last):
+    """Returns the index and the squared distance of the farthest point.
+
+    Distances of points between first and last are measured from the segment
+    (not the infinite line) to handle loops where first and last are close.
+    """
+    (x0, y0) = (xs[first], ys[first])
+    (d_x, d_y) = (xs[last] - x0, ys[last] - y0)
+    seg2 = d_x * d_x + d_y * d_y
+
+    if USE_NUMPY:
+        (p_x, p_y) = (xs[first + 1:last] - x0, ys[first + 1:last] - y0)
+        if seg2 > 0:
+            t = np.clip((p_x * d_x + p_y * d_y) / seg2, 0.0, 1.0)
+            (p_x, p_y) = (p_x - t * d_x, p_y - t * d_y)
+        dist2 = p_x * p_x + p_y * p_y
+        k = int(np.argmax(dist2))
+        return first + 1 + k, float(dist2[k])
+
+    (index, max_dist2) = (first, -1.0)
+    for i in range(first + 1, last):
+        (p_x, p_y) = (xs[i] - x0, ys[i] - y0)
+        if seg2 > 0:
+            t = min(max((p_x * d_x + p_y * d_y) / seg2, 0.0), 1.0)
+            (p_x, p_y) = (p_x - t * d_x, p_y - t * d_y)
+        dist2 = p_x * p_x + p_y * p_y
+        if dist2 > max_dist2: (index, max_dist2) = (i, dist2)
+    return index, max_dist2
+
+def rdp(trackpts, tolerance):
+    """Ramer-Douglas-Peucker simplification without recursion.
+
+    Args:
+        trackpts: a list of trackpt_store.
+        tolerance: max. allowed deviation from the simplified track (m).
+
+    Returns:
+        a list of trackpt_store kept.
+    """
+    num_trackpt = len(trackpts)
+    if num_trackpt < 3 or tolerance <= 0: return list(trackpts)
+    (xs, ys) = project(trackpts)
+    tolerance2 = tolerance * tolerance
+
+    keep = [False] * num_trackpt
+    (keep[0], keep[-1]) = (True, True)
+    stack = [(0, num_trackpt - 1)]
+    while stack:
+        (first, last) = stack.pop()
+        if last - first < 2: continue
+        (index, max_dist2) = _farthest_point(xs, ys, first, last)
+        if max_dist2 > tolerance2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [tp for (tp, k) in zip(trackpts, keep) if k]
+
+def decimate(trackpts, min_distance=0, min_time=0):
+    """Streaming decimation by distance (m) and time (s) from the last kept.
+
+    A trackpoint is kept if it is at least min_distance (measured along the
+    track by using dist) and min_time apart from the last kept one.  Zero
+    disables each of the conditions.
+
+    Args:
+        trackpts: an iterable of trackpt_store.
+        min_distance (optional): in meters.
+        min_time (optional): in seconds.
+
+    Yields:
+        trackpt_store kept.
+    """
+    (last_kept, tp) = (None, None)
+    for tp in trackpts:
+        if (last_kept is None
+                or ((tp.dist - last_kept.dist) / 100 >= min_distance
+                    and tp.t_time - last_kept.t_time >= min_time)):
+            last_kept = tp
+            yield tp
+    if tp is not None and tp is not last_kept: yield tp # The last trackpt.
+
+def add_arguments(parser):
+    """Adds options of the simplification stage to an argparse parser."""
+    group = parser.add_argument_group('simplification')
+    group.add_argument('--rdp', type=float, default=0, metavar='METERS', 
+                       help='Ramer-Douglas-Peucker tolerance in meters.')
+    group.add_argument('--min-distance', type=float, default=0, 
+                       metavar='METERS', help='drop trackpoints closer than '
+                       'this distance (along the track) to the last kept.')
+    group.add_argument('--min-time', type=float, default=0, metavar='SECONDS', 
+                       help='drop trackpoints within this time from the last '
+                       'kept.')
+
+def simplify(trackpts, tolerance=0, min_distance=0, min_time=0):
+    """Decimate (if min_distance or min_time) and then apply RDP (tolerance).
+
+    Returns:
+        a list of trackpt_store kept.
+    """
+    if min_distance or min_time:
+        trackpts = list(decimate(trackpts, min_distance, min_time))
+    return rdp(trackpts, tolerance) if tolerance else list(trackpts)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A spatial index of tracks of Symbian (Nokia) SportsTracker files.
+
+The index is a sqlite3 database consisting of two tables:
+1) tracks: bounding box, start/stop times, size and mtime of each file.
+2) segments: segments of the track simplified by RDP (see simplify.py), which
+   are registered in every grid cell (CELL degrees) they pass through.
+Queries of bounding boxes and "passes near a point" return matching files and
+time ranges from the index without decoding W*.dat files.  The index is built
+incrementally; unchanged files (size and mtime) are skipped.
+
+Usage:
+    python spatial_index.py index.sqlite build input_files_or_directories
+    python spatial_index.py index.sqlite bbox south west north east
+    python spatial_index.py index.sqlite near lat lon radius_m
+"""
+import sys
+import math
+import sqlite3
+import argparse
+from pathlib import Path
+
+import nst
+import simplify
+
+CELL = 0.01 # Size of grid cells in degrees (~1 km).
+RDP_TOLERANCE = 10 # Tolerance (m) in simplification of segments.
+
+def _cell(degree):
+    return math.floor(degree / CELL)
+
+def _cells_of_segment(y0, x0, y1, x1):
+    """Grid cells (cell_y, cell_x) a segment passes through."""
+    steps = max(1, math.ceil(max(abs(y1 - y0), abs(x1 - x0)) / (CELL / 2)))
+    return {(_cell(y0 + (y1 - y0) * i / steps),
+             _cell(x0 + (x1 - x0) * i / steps)) for i in range(steps + 1)}
+
+def distance_to_segment(lat, lon, y0, x0, y1, x1):
+    """Distance (m) from a point to a segment in equirectangular projection."""
+    k_y = math.radians(simplify.EARTH_RADIUS)
+    k_x = k_y * math.cos(math.radians(lat))
+    (p_x, p_y) = ((lon - x0) * k_x, (lat - y0) * k_y)
+    (d_x, d_y) = ((x1 - x0) * k_x, (y1 - y0) * k_y)
+    seg2 = d_x * d_x + d_y * d_y
+    t = min(max((p_x * d_x + p_y * d_y) / seg2, 0.0), 1.0) if seg2 > 0 else 0
+    return math.hypot(p_x - t * d_x, p_y - t * d_y)
+
+def crosses_bbox(y0, x0, y1, x1, south, west, north, east):
+    """True if a segment intersects a bounding box (Liang-Barsky clipping).
+
+    >>> crosses_bbox(0, -1, 1, 2, 0.2, 0, 0.8, 1) # Across, no end inside.
+    True
+    >>> crosses_bbox(0, 0.5, 0.5, 1.5, 0.6, 0, 1, 1) # Passes by the corner.
+    False
+    """
+    (d_y, d_x) = (y1 - y0, x1 - x0)
+    (t0, t1) = (0.0, 1.0) # The part of the segment in the bbox.
+    for (p, q) in ((-d_x, x0 - west), (d_x, east - x0),
+                   (-d_y, y0 - south), (d_y, north - y0)):
+        if p == 0: # Parallel to the edge.
+            if q < 0: return False
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+        if t0 > t1: return False
+    return True
+
+class SpatialIndex(object):
+    """A sqlite3 database of bounding boxes and gridded segments of tracks."""
+    def __init__(self, path):
+        self.connection = sqlite3.connect(str(path))
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER,
+                mtime REAL, name TEXT, start REAL, stop REAL,
+                south REAL, west REAL, north REAL, east REAL);
+            CREATE TABLE IF NOT EXISTS segments (
+                track INTEGER, cell_y INTEGER, cell_x INTEGER,
+                y0 REAL, x0 REAL, y1 REAL, x1 REAL, t0 REAL, t1 REAL);
+            CREATE INDEX IF NOT EXISTS cells ON segments (cell_y, cell_x);''')
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def is_current(self, in_file):
+        """True if the file is indexed and not changed since then."""
+        stat = Path(in_file).stat()
+        row = self.connection.execute(
+            'SELECT size, mtime FROM tracks WHERE path = ?',
+            (str(in_file), )).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime)
+
+    def add_track(self, in_file, trackpts, name=''):
+        """Add (or replace) a track by using a list of trackpt_store."""
+        stat = Path(in_file).stat()
+        cursor = self.connection.cursor()
+        row = cursor.execute('SELECT id FROM tracks WHERE path = ?',
+                             (str(in_file), )).fetchone()
+        if row is not None:
+            cursor.execute('DELETE FROM segments WHERE track = ?', row)
+            cursor.execute('DELETE FROM tracks WHERE id = ?', row)
+        if not trackpts: return
+
+        ys = [tp.y_degree for tp in trackpts]
+        xs = [tp.x_degree for tp in trackpts]
+        cursor.execute(
+            'INSERT INTO tracks (path, size, mtime, name, start, stop, south, '
+            'west, north, east) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(in_file), stat.st_size, stat.st_mtime, name,
+             trackpts[0].unix_time, trackpts[-1].unix_time,
+             min(ys), min(xs), max(ys), max(xs)))
+        track = cursor.lastrowid
+
+        simplified = simplify.rdp(trackpts, RDP_TOLERANCE)
+        if len(simplified) == 1: simplified *= 2 # A segment of zero length.
+        rows = []
+        for (tp0, tp1) in zip(simplified[:-1], simplified[1:]):
+            segment = (tp0.y_degree, tp0.x_degree, tp1.y_degree, tp1.x_degree)
+            for (cell_y, cell_x) in _cells_of_segment(*segment):
+                rows.append((track, cell_y, cell_x, *segment,
+                             tp0.unix_time, tp1.unix_time))
+        cursor.executemany(
+            'INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _segments_in(self, south, west, north, east):
+        return self.connection.execute(
+            'SELECT tracks.path, y0, x0, y1, x1, t0, t1 FROM segments '
+            'JOIN tracks ON segments.track = tracks.id '
+            'WHERE cell_y BETWEEN ? AND ? AND cell_x BETWEEN ? AND ? '
+            'AND north >= ? AND south <= ? AND east >= ? AND west <= ?',
+            (_cell(south), _cell(north), _cell(west), _cell(east),
+             south, north, west, east))
+
+    @staticmethod
+    def _time_ranges(matches):
+        """Merges (path, t0, t1) to {path: (min t0, max t1)}."""
+        ranges = {}
+        for (path, t0, t1) in matches:
+            (start, stop) = ranges.get(path, (t0, t1))
+            ranges[path] = (min(start, t0), max(stop, t1))
+        return sorted(ranges.items())
+
+    def query_bbox(self, south, west, north, east):
+        """Tracks passing through the bounding box.
+
+        Returns:
+            a list of (path, (start_unix_time, stop_unix_time)) of segments.
+        """
+        # The grid is coarse; check if the segment crosses the bbox.
+        matches = [
+            (path, t0, t1) for (path, y0, x0, y1, x1, t0, t1)
+            in self._segments_in(south, west, north, east)
+            if crosses_bbox(y0, x0, y1, x1, south, west, north, east)]
+        return self._time_ranges(matches)
+
+    def query_near(self, lat, lon, radius):
+        """Tracks passing within radius (m) of the point (lat, lon).
+
+        Returns:
+            a list of (path, (start_unix_time, stop_unix_time)) of segments.
+        """
+        d_lat = math.degrees(radius / simplify.EARTH_RADIUS)
+        d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+        matches = [
+            (path, t0, t1) for (path, y0, x0, y1, x1, t0, t1)
+            in self._segments_in(lat - d_lat, lon - d_lon,
+                                 lat + d_lat, lon + d_lon)
+            if distance_to_segment(lat, lon, y0, x0, y1, x1) <= radius]
+        return self._time_ranges(matches)
+
+def build(index, in_files):
+    """Decode and add the files which are new or changed since the last build.
+
+    Returns:
+        number of files added.
+    """
+    import convert_nst_files_to_gpx as converter # Header parsers.
+
+    count = 0
+    for in_file in in_files:
+        if index.is_current(in_file): continue
+        trackpts = []
+        try:
+            converter.read_file(in_file, trackpts.append)
+        except converter.DECODE_ERRORS as error: # E.g. a truncated file.
+            print(f'Failed to read: {in_file} ({error!r})', file=sys.stderr)
+            continue
+        name = nst.track_name if nst.FILE_TYPE == nst.TRACK else nst.route_name
+        index.add_track(in_file, trackpts, name)
+        count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A spatial index of Symbian SportsTracker files.')
+    parser.add_argument('index', type=Path, help='sqlite3 file of the index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='add new or changed files.')
+    command.add_argument('in_file', type=Path, nargs='+',
+                         help='files or directories of W*.dat and R*.dat.')
+    command = commands.add_parser('bbox', help='tracks in a bounding box.')
+    for name in ('south', 'west', 'north', 'east'):
+        command.add_argument(name, type=float)
+    command = commands.add_parser('near', help='tracks passing near a point.')
+    for name in ('lat', 'lon', 'radius'):
+        command.add_argument(name, type=float)
+    args = parser.parse_args()
+
+    import convert_nst_files_to_gpx as converter # Header parsers.
+    index = SpatialIndex(args.index)
+    try:
+        if args.command == 'build':
+            count = build(index, converter.find_files(args.in_file))
+            print(f'Added: {count}', file=sys.stderr)
+        else:
+            matches = (index.query_bbox(args.south, args.west, args.north,
+                                        args.east) if args.command == 'bbox'
+                       else index.query_near(args.lat, args.lon, args.radius))
+            for (path, (start, stop)) in matches:
+                print(f'{path}\t{nst.format_datetime(start)}Z\t'
+                      f'{nst.format_datetime(stop)}Z')
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Markers of pytest, see test_golden.py."""
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'performance: time and peak memory against the baseline.')
@@ -0,0 +1,293 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Golden-output regression and performance test of the converters.
+
+Every input in references/ (W*.dat, R*.dat and Rec*.tmp) is converted by each
+of ENGINES (the ways the converters read input and write gpx), and the gpx is
+compared with the golden file of the same stem (e.g. references/W146739328.gpx)
+semantically, i.e. the trees of elements, attributes and stripped texts,
+ignoring formatting.  Inputs without a golden file are timed only.
+
+Time (the best of --repeat runs) and peak memory by tracemalloc (a separate
+run) are recorded per input and engine.  Time is also relative to that of a
+fixed workload of Python (see calibrate()), so that the baseline committed
+(test_golden/baseline.json, made by --update-baseline) is comparable on other
+machines.  The test fails if the relative time or the peak memory is worse
+than the baseline by more than --threshold.
+
+Usage:
+    python test_golden/test_golden.py [--update-baseline] [--threshold 0.2]
+exits with 1 on failures.  By pytest, the comparison is run by test_golden()
+and the timing by test_performance() (marked as performance) if the
+environment variable GOLDEN_PERFORMANCE is set to the threshold, e.g.
+    GOLDEN_PERFORMANCE=0.5 python -m pytest test_golden -m performance
+test_parallel_decode() compares trackpts decoded by parallel_decode.py in
+small chunks with those decoded serially, and test_stdin() the gpx printed of
+input from a pipe.
+"""
+import io
+import os
+import sys
+import json
+import mmap
+import time
+import asyncio
+import subprocess
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+try:
+    import pytest
+except ImportError: # Only to run as a script.
+    pytest = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import nst
+import convert_nst_files_to_gpx
+import convert_nst_rec_to_gpx
+import async_convert
+import parallel_decode
+
+REFERENCES = ROOT / 'references'
+PATTERNS = ('W*.dat', 'R*.dat', 'Rec*.tmp')
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+THRESHOLD = 0.2 # Allowed increase from the baseline.
+
+def converter_of(in_file):
+    return (convert_nst_rec_to_gpx if in_file.suffix.lower() == '.tmp'
+            else convert_nst_files_to_gpx)
+
+def to_gpx(in_file, file_obj=None):
+    converter = converter_of(in_file)
+    args = converter.make_parser().parse_args([str(in_file)])
+    # Rec*.tmp converter prints a lot for debugging purposes.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return converter.to_gpx(in_file, args, file_obj=file_obj)
+
+# Engines: functions of an input path returning gpx bytes.
+def in_memory(in_file):
+    """Decoded from the file and serialized by Gpx.to_xml()."""
+    return to_gpx(in_file).to_xml()
+
+def streaming(in_file):
+    """Written to a file by Gpx.write() (nst.finalize_gpx()), then read."""
+    gpx = to_gpx(in_file)
+    with tempfile.TemporaryDirectory() as directory:
+        gpx_path = Path(directory) / 'out.gpx'
+        nst.finalize_gpx(gpx, gpx_path)
+        return gpx_path.read_bytes()
+
+def chunked(in_file):
+    """Trkpts serialized in chunks by StreamingGpx (--max-memory)."""
+    nst.STREAM_GPX = True
+    try:
+        return streaming(in_file)
+    finally:
+        nst.STREAM_GPX = False
+
+def mmapped(in_file):
+    """Decoded from mmap of the file."""
+    with in_file.open(mode='rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return to_gpx(in_file, mm).to_xml()
+
+def piped(in_file):
+    """Decoded from a non-seekable stream as stdin, see nst.open_input().
+
+    Rec*.tmp files are read in memory as the converter does.
+    """
+    with in_file.open(mode='rb') as f:
+        with (nst.PipeReader(f, str(in_file))
+              if converter_of(in_file) is convert_nst_files_to_gpx
+              else io.BytesIO(f.read())) as reader:
+            reader.mtime = in_file.stat().st_mtime # Start time of routes.
+            return to_gpx(in_file, reader).to_xml()
+
+def async_pipeline(in_file):
+    """async_convert.py with a worker process (not traced by tracemalloc)."""
+    stat = in_file.stat()
+    async def items():
+        yield (in_file, in_file.read_bytes(), None, stat.st_mtime)
+    outputs = []
+    def write(path, gpx): outputs.append(gpx)
+    asyncio.run(async_convert.run_pipeline(items(), write, concurrency=1,
+                                           queue_size=1))
+    return outputs[0]
+
+ENGINES = {'in_memory': in_memory, 'streaming': streaming, 'chunked': chunked,
+           'mmap': mmapped, 'pipe': piped, 'async': async_pipeline}
+
+def first_difference(a, b, path=''):
+    """Path to the first difference of two elements, or None if the same."""
+    path = f'{path}/{a.tag.split("}")[-1]}'
+    if a.tag != b.tag: return f'{path}: tag {a.tag} != {b.tag}'
+    if a.attrib != b.attrib: return f'{path}: {a.attrib} != {b.attrib}'
+    (text_a, text_b) = ((a.text or '').strip(), (b.text or '').strip())
+    if text_a != text_b: return f'{path}: {text_a!r} != {text_b!r}'
+    if len(a) != len(b): return f'{path}: {len(a)} != {len(b)} children'
+    for (i, (child_a, child_b)) in enumerate(zip(a, b)):
+        difference = first_difference(child_a, child_b, f'{path}[{i}]')
+        if difference is not None: return difference
+    return None
+
+def measure(engine, in_file, repeat):
+    """Output, the best time (s) of repeat runs and peak memory (bytes)."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = engine(in_file)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    engine(in_file)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return output, min(times), peak
+
+def calibrate(repeat=5):
+    """The best time (s) of a fixed workload, i.e. the speed of the machine.
+
+    The workload (formatting numbers) is of the same kind as writing gpx.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        [f'{i / 7:.6f}' for i in range(200000)]
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run(repeat=3, engines=ENGINES, file=None):
+    """Converts the references by the engines.
+
+    Returns:
+        results: {'stem/engine': {'seconds': s, 'relative': seconds per
+            calibrate(), 'peak_bytes': b}}
+        failures: a list of messages of golden-output differences.
+    """
+    (results, failures) = ({}, [])
+    unit = calibrate()
+    in_files = sorted(p for pattern in PATTERNS
+                      for p in REFERENCES.glob(pattern))
+    for in_file in in_files:
+        golden_path = in_file.with_suffix('.gpx')
+        golden = (ET.parse(golden_path).getroot() if golden_path.exists()
+                  else None)
+        for (name, engine) in engines.items():
+            key = f'{in_file.stem}/{name}'
+            (output, seconds, peak) = measure(engine, in_file, repeat)
+            results[key] = {'seconds': round(seconds, 6),
+                            'relative': round(seconds / unit, 4),
+                            'peak_bytes': peak}
+            difference = (None if golden is None else first_difference(
+                ET.fromstring(output), golden))
+            if difference is not None: failures.append(f'{key}: {difference}')
+            print(f'{key:30}{seconds * 1000:10.1f} ms{peak / 1e6:10.2f} MB  '
+                  f'{"no golden" if golden is None else difference or "ok"}',
+                  file=file or sys.stderr)
+    return results, failures
+
+def regressions(results, baseline, threshold):
+    """Messages of results worse than the baseline by more than threshold."""
+    messages = []
+    for (key, result) in results.items():
+        if key not in baseline: continue
+        for (measure_, unit) in (('relative', ''), ('peak_bytes', ' bytes')):
+            if measure_ not in baseline[key]: continue # An old baseline.
+            (now, before) = (result[measure_], baseline[key][measure_])
+            if now > before * (1 + threshold):
+                messages.append(f'{key}: {measure_} {now}{unit} > '
+                                f'{before}{unit} (+{now / before - 1:.0%})')
+    return messages
+
+def test_golden():
+    """Golden outputs of all engines (for pytest)."""
+    (_, failures) = run(repeat=1)
+    assert not failures, failures
+
+def test_parallel_decode():
+    """Trackpts decoded in 4 processes (small chunks) are those in serial."""
+    (jobs, min_chunk) = (parallel_decode.JOBS, parallel_decode.MIN_CHUNK)
+    decoded = {} # {stem: [serial, parallel]}
+    try:
+        for (parallel_decode.JOBS, parallel_decode.MIN_CHUNK) in (
+                (1, min_chunk), (4, 100)):
+            for stem in ('W146739328', 'W178218105'):
+                trackpts = []
+                convert_nst_files_to_gpx.read_file(REFERENCES / f'{stem}.dat',
+                                                   trackpts.append)
+                decoded.setdefault(stem, []).append(trackpts)
+    finally:
+        (parallel_decode.JOBS, parallel_decode.MIN_CHUNK) = (jobs, min_chunk)
+    assert parallel_decode._executor is not None # Not fallen back to serial.
+    for (stem, (serial, parallel)) in decoded.items():
+        assert len(parallel) == len(serial) > 0, stem
+        assert parallel == serial, stem
+
+def test_stdin():
+    """Gpx printed by the converters of input from a pipe (-) is the same.
+
+    Messages of the decoding (e.g. of Rec*.tmp) must not be in the output.
+    """
+    for in_file in (REFERENCES / 'W146739328.dat',
+                    REFERENCES / 'Rec211109168.tmp'):
+        output = subprocess.run(
+            [sys.executable, f'{converter_of(in_file).__name__}.py', '-'],
+            cwd=ROOT, input=in_file.read_bytes(), capture_output=True,
+            check=True).stdout
+        expected = ET.fromstring(in_memory(in_file))
+        difference = first_difference(ET.fromstring(output), expected)
+        assert difference is None, f'{in_file.name}: {difference}'
+
+def performance(test):
+    """Marks a test as performance, skipped unless GOLDEN_PERFORMANCE is set."""
+    if pytest is None: return test
+    return pytest.mark.performance(pytest.mark.skipif(
+        not os.environ.get('GOLDEN_PERFORMANCE'),
+        reason='timing; set GOLDEN_PERFORMANCE=THRESHOLD to run.')(test))
+
+@performance
+def test_performance():
+    """Time and peak memory within the threshold of the baseline (pytest)."""
+    (results, _) = run()
+    failures = regressions(results, json.loads(BASELINE.read_text()),
+                           float(os.environ['GOLDEN_PERFORMANCE']))
+    assert not failures, failures
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Golden-output regression and performance test.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per input and engine (default: 3).')
+    parser.add_argument('--engine', choices=tuple(ENGINES), action='append',
+                        help='engines to run (default: all).')
+    parser.add_argument('--baseline', type=Path, default=BASELINE,
+                        help='JSON file of the baseline (default: '
+                        'test_golden/baseline.json).')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed increase of relative time and peak '
+                        'memory from the baseline (default: 0.2, i.e. 20%%).')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='save the results as the baseline.')
+    args = parser.parse_args()
+
+    engines = ({name: ENGINES[name] for name in args.engine} if args.engine
+               else ENGINES)
+    (results, failures) = run(args.repeat, engines)
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=1) + '\n')
+        print(f'Baseline saved: {args.baseline}', file=sys.stderr)
+    elif args.baseline.exists():
+        failures.extend(regressions(
+            results, json.loads(args.baseline.read_text()), args.threshold))
+    for failure in failures: print(f'FAIL {failure}', file=sys.stderr)
+    if failures: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Behavior tests of the modules used by the converters (for pytest).
+
+Tests marked as performance are skipped unless GOLDEN_PERFORMANCE is set, see
+test_golden.py.
+"""
+import io
+import os
+import sys
+import math
+import time
+import struct
+import random
+import datetime as dt
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import nst
+import mini_gpx
+import fit
+import aggregates
+import pack
+import dedup
+import resample
+import simplify
+import convert_nst_files_to_gpx as converter
+
+REFERENCES = ROOT / 'references'
+
+performance = pytest.mark.skipif(
+    not os.environ.get('GOLDEN_PERFORMANCE'),
+    reason='timing; set GOLDEN_PERFORMANCE=THRESHOLD to run.')
+
+def _isoformat(timestamp):
+    """Gpx time by datetime, as before format_utc()."""
+    d_t = nst.dt_from_timestamp(timestamp, dt.timezone.utc)
+    return None if d_t is None else mini_gpx.format_time(d_t)
+
+def test_format_utc():
+    """The same strings as datetime.isoformat(), e.g. around midnights."""
+    random.seed(0)
+    timestamps = [random.uniform(0, 2**32) for _ in range(10000)]
+    timestamps += [86400 * 14000 + d for d in (-1, -0.5, -1e-7, 0, 1e-7)]
+    timestamps += [-1, 0, 1251359794.37425]
+    for timestamp in timestamps:
+        assert nst.format_utc(timestamp) == _isoformat(timestamp), timestamp
+
+@pytest.mark.performance
+@performance
+def test_format_utc_time():
+    """Format_utc() of a 1 Hz track is not slower than datetime."""
+    timestamps = [1251359794.374 + i + (i % 7) / 10 for i in range(100000)]
+    times = []
+    for format_ in (nst.format_utc, _isoformat):
+        start = time.perf_counter()
+        for timestamp in timestamps: format_(timestamp)
+        times.append(time.perf_counter() - start)
+    assert times[0] <= times[1], times
+
+# Struct formats of FIT base types, see fit.py.
+FIT_TYPES = {0x00: 'B', 0x84: 'H', 0x85: 'i', 0x86: 'I', 0x8C: 'I'}
+
+def read_fit(path):
+    """Checks the header and the CRCs of a FIT file and decodes it.
+
+    Returns:
+        a list of (global message number, {field number: value}).
+    """
+    data = path.read_bytes()
+    (header_size, _, _, data_size, magic) = struct.unpack_from('<2BHI4s', data)
+    assert (magic, header_size) == (b'.FIT', 14)
+    assert len(data) == header_size + data_size + 2
+    assert struct.unpack_from('<H', data, 12)[0] == fit.crc16(data[:12])
+    assert struct.unpack_from('<H', data, len(data) - 2)[0] == fit.crc16(
+        data[:-2])
+    (definitions, messages, pos) = ({}, [], header_size)
+    while pos < header_size + data_size:
+        (record_header, pos) = (data[pos], pos + 1)
+        local_type = record_header & 0x0F
+        if record_header & 0x40: # Definition.
+            (_, architecture, global_number, num_fields) = struct.unpack_from(
+                '<2BHB', data, pos)
+            assert architecture == 0 # Little endian.
+            fields = [struct.unpack_from('<3B', data, pos + 5 + 3 * i)
+                      for i in range(num_fields)]
+            pos += 5 + 3 * num_fields
+            definitions[local_type] = (
+                global_number, [number for (number, _, _) in fields],
+                struct.Struct('<' + ''.join(FIT_TYPES[base_type]
+                                            for (_, _, base_type) in fields)))
+        else:
+            (global_number, numbers, unpacker) = definitions[local_type]
+            messages.append((global_number, dict(zip(
+                numbers, unpacker.unpack_from(data, pos)))))
+            pos += unpacker.size
+    return messages
+
+def test_fit(tmp_path):
+    """Records of a FIT file are the trackpts: count, time and position."""
+    in_file = REFERENCES / 'W146739328.dat'
+    trackpts = []
+    converter.read_file(in_file, trackpts.append)
+    fit_path = tmp_path / 'W146739328.fit'
+    num_records = fit.convert(
+        in_file, converter.make_parser().parse_args([str(in_file)]), fit_path)
+    messages = read_fit(fit_path)
+    records = [fields for (number, fields) in messages if number == 20]
+    assert messages[0][0] == 0 # File_id first.
+    assert len(records) == num_records == len(trackpts)
+    (first, tp) = (records[0], trackpts[0])
+    assert first[253] == int(tp.unix_time) - fit.FIT_EPOCH # Timestamp.
+    assert abs(first[0] / fit.SEMICIRCLES - tp.y_degree) < 1e-6
+    assert abs(first[1] / fit.SEMICIRCLES - tp.x_degree) < 1e-6
+    assert [number for (number, _) in messages[-3:]] == [19, 18, 34]
+
+def _trackpts(stem='W146739328'):
+    trackpts = []
+    converter.read_file(REFERENCES / f'{stem}.dat', trackpts.append)
+    return trackpts
+
+def _distance(p_x, p_y, x0, y0, x1, y1):
+    """Distance of a point from a segment in a plane."""
+    (d_x, d_y) = (x1 - x0, y1 - y0)
+    seg2 = d_x * d_x + d_y * d_y
+    t = (min(max(((p_x - x0) * d_x + (p_y - y0) * d_y) / seg2, 0), 1)
+         if seg2 else 0)
+    return math.hypot(p_x - x0 - t * d_x, p_y - y0 - t * d_y)
+
+@pytest.mark.parametrize('use_numpy', (True, False))
+def test_rdp(monkeypatch, use_numpy):
+    """RDP keeps the endpoints, and dropped points are within the tolerance."""
+    if use_numpy and not simplify.USE_NUMPY: pytest.skip('no NumPy')
+    monkeypatch.setattr(simplify, 'USE_NUMPY', use_numpy)
+    (trackpts, tolerance) = (_trackpts(), 10)
+    kept = simplify.rdp(trackpts, tolerance)
+    assert 2 < len(kept) < len(trackpts)
+    assert (kept[0], kept[-1]) == (trackpts[0], trackpts[-1])
+    (xs, ys) = (list(c) for c in simplify.project(trackpts))
+    indices = [tp.track_count for tp in kept] # In order, a subset.
+    assert indices == sorted(set(indices))
+    for (first, last) in zip(indices[:-1], indices[1:]):
+        for i in range(first + 1, last):
+            assert _distance(xs[i], ys[i], xs[first], ys[first], xs[last],
+                             ys[last]) <= tolerance * (1 + 1e-9), i
+
+def test_decimate():
+    """Kept trackpts are min_distance/min_time apart, and the last is kept."""
+    trackpts = _trackpts()
+    kept = simplify.simplify(trackpts, min_distance=50, min_time=10)
+    assert (kept[0], kept[-1]) == (trackpts[0], trackpts[-1])
+    for (tp0, tp1) in zip(kept[:-2], kept[1:-1]):
+        assert (tp1.dist - tp0.dist) / 100 >= 50
+        assert tp1.t_time - tp0.t_time >= 10
+
+def _linear(times, pause=None):
+    """Trackpts moving linearly in t_time, at irregular times w/ a pause."""
+    trackpts = []
+    for (i, t_time) in enumerate(times):
+        unix_time = 1e9 + 0.3 + t_time + (
+            pause[1] if pause and t_time >= pause[0] else 0)
+        trackpts.append(nst.TrackptStore(
+            unix_time=unix_time, t_time=t_time, y_degree=35 + t_time * 1e-5,
+            x_degree=139 - t_time * 2e-5, z_ax=10 + t_time / 2,
+            v=300, d_dist=0, dist=300 * t_time, track_count=i,
+            file_type=nst.TRACK))
+    return trackpts
+
+@pytest.mark.parametrize('use_numpy', (True, False))
+@pytest.mark.parametrize('use_pause_list', (True, False))
+def test_resample(monkeypatch, use_numpy, use_pause_list):
+    """Grid of the interval, exact linear interpolation and no pts in pause."""
+    if use_numpy and not resample.USE_NUMPY: pytest.skip('no NumPy')
+    monkeypatch.setattr(resample, 'USE_NUMPY', use_numpy)
+    (times, pause) = ([0, 1.5, 2, 4.7, 7, 10, 10.2, 13, 17.5, 20], (10, 60))
+    trackpts = _linear(times, pause)
+    pause_list = ([(pause[0], pause[1], None)] if use_pause_list else None)
+    resampled = resample.resample(trackpts, interval=2, pause_list=pause_list)
+
+    (start, resume) = (1e9 + 0.3, 1e9 + 0.3 + pause[0] + pause[1])
+    assert [tp.track_count for tp in resampled] == list(range(len(resampled)))
+    for tp in resampled:
+        assert tp.unix_time % 2 == 0
+        # Not in the pause between the last trackpt before and the resume.
+        assert not start + 7 < tp.unix_time < resume
+        t_time = tp.t_time
+        assert tp.unix_time - t_time == pytest.approx(
+            start + (pause[1] if t_time >= pause[0] else 0))
+        assert tp.y_degree == pytest.approx(35 + t_time * 1e-5, abs=1e-12)
+        assert tp.x_degree == pytest.approx(139 - t_time * 2e-5, abs=1e-12)
+        assert tp.z_ax == pytest.approx(10 + t_time / 2)
+        assert (tp.v, tp.dist) == (300, round(300 * t_time))
+    # Every grid point in the segments is made.
+    assert len(resampled) == len(resample._grid(start, start + 7, 2)) + len(
+        resample._grid(resume, start + 20 + pause[1], 2))
+
+def test_dedup(tmp_path):
+    """Truncated copies are duplicates; modified copies are not."""
+    data = (REFERENCES / 'W146739328.dat').read_bytes()
+    assert len(data) > dedup.CHUNK_SIZE # To check the partial last chunk.
+    paths = [tmp_path / name for name in
+             ('a/W146739328.dat', 'b/W146739328.dat', 'c/W146739328.dat',
+              'W178218105.dat')]
+    for path in paths: path.parent.mkdir(exist_ok=True)
+    paths[0].write_bytes(data[:70000]) # Truncated.
+    paths[1].write_bytes(data)
+    modified = bytearray(data)
+    modified[75000] ^= 0xFF # In the main part, after the truncation.
+    paths[2].write_bytes(modified)
+    paths[3].write_bytes((REFERENCES / 'W178218105.dat').read_bytes())
+
+    assert dedup.fingerprint(paths[0]).key == dedup.fingerprint(paths[1]).key
+    (kept, duplicates) = dedup.find_duplicates(paths)
+    assert kept == paths[1:]
+    assert duplicates == {paths[0]: paths[1]}
+
+    # A different last partial chunk of the truncated is not a prefix.
+    modified = bytearray(data[:70000])
+    modified[-1] ^= 0xFF
+    paths[0].write_bytes(modified)
+    (kept, duplicates) = dedup.find_duplicates(paths)
+    assert (kept, duplicates) == (paths, {})
+
+def test_pack(tmp_path):
+    """Tracks are appended/replaced and read back as they were written."""
+    (path, tracks) = (tmp_path / 'tracks.pack', {})
+    for stem in ('W146739328', 'W178218105'):
+        tracks[stem] = _trackpts(stem)
+    writer = pack.PackWriter(path)
+    for (stem, trackpts) in tracks.items():
+        writer.add(trackpts, {'path': stem, 'name': stem}, nst.TRACK,
+                   trackpts[0].unix_time, trackpts[-1].t_time,
+                   trackpts[-1].dist / 1e5)
+    writer.close()
+
+    writer = pack.PackWriter(path)
+    writer.add(tracks['W178218105'][:10], {'path': 'W178218105',
+                                           'name': 'replaced'})
+    writer.add(tracks['W146739328'][::2], {'path': 'new'})
+    # Interrupted (not closed): the pack as before is read.
+    writer.f.flush()
+    packed = pack.Pack(path)
+    assert len(packed) == 2
+    assert packed.trackpts(1) == tracks['W178218105']
+    packed.close()
+    writer.close()
+
+    packed = pack.Pack(path)
+    assert len(packed) == 3
+    assert [packed.find(p) for p in ('W146739328', 'W178218105', 'new', 'x')
+            ] == [0, 1, 2, None]
+    header = packed.header(0)
+    trackpts = tracks['W146739328']
+    assert header == {
+        'path': 'W146739328', 'name': 'W146739328', 'file_type': nst.TRACK,
+        'num_points': len(trackpts), 'start_time': trackpts[0].unix_time,
+        'total_time': trackpts[-1].t_time,
+        'total_distance': trackpts[-1].dist / 1e5}
+    assert packed.trackpts(0) == trackpts
+    assert packed.header(1)['name'] == 'replaced'
+    assert packed.header(1)['start_time'] is None
+    assert packed.trackpts(1) == tracks['W178218105'][:10]
+    assert packed.trackpts(2) == [tp._replace(track_count=i) for (i, tp)
+                                  in enumerate(trackpts[::2])]
+    packed.close()
+
+    path.write_bytes(b'not a pack')
+    with pytest.raises(ValueError):
+        pack.Pack(path)
+
+def test_aggregates(tmp_path):
+    """Rollups of the headers are added and subtracted incrementally."""
+    paths = [tmp_path / name for name in
+             ('a/W146739328.dat', 'b/W146739328.dat', 'W178218105.dat')]
+    for path in paths:
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes((REFERENCES / path.name).read_bytes())
+    values = [aggregates.read_header(path) for path in paths]
+    assert None not in values and values[0] == values[1]
+
+    def expected(period, paths_values):
+        rows = {}
+        for (day, activity, user_id, total_time, total_distance
+             ) in paths_values:
+            key = ({'day': day, 'month': day[:7], 'year': day[:4]}[period],
+                   activity, user_id)
+            (tracks, time_, distance) = rows.get(key, (0, 0, 0))
+            rows[key] = (tracks + 1, time_ + total_time,
+                         distance + total_distance)
+        return sorted(key + value for (key, value) in rows.items())
+
+    def check(totals):
+        for period in ('day', 'month', 'year'):
+            rows = totals.totals(period)
+            assert [row[:4] for row in rows] == [
+                row[:4] for row in expected(period, values)]
+            for (row, row_) in zip(rows, expected(period, values)):
+                assert row[4:] == pytest.approx(row_[4:])
+
+    totals = aggregates.Aggregates(tmp_path / 'totals.sqlite')
+    assert totals.update(paths) == (3, 0)
+    check(totals)
+    assert totals.update(paths) == (0, 0) # Not changed.
+    totals.close()
+
+    paths[0].unlink()
+    del values[0]
+    totals = aggregates.Aggregates(tmp_path / 'totals.sqlite')
+    assert totals.update(paths[1:]) == (0, 1)
+    check(totals)
+    assert totals.totals('year', activity='x') == []
+    totals.close()
+
+def _table(entries):
+    """A lookup table of config.dat, see nst.read_config()."""
+    data = struct.pack('<I', len(entries))
+    for (id_, name) in entries.items():
+        encoded = name.encode('latin-1') # SCSU of Latin-1 (single-byte mode).
+        data += struct.pack('<IB', id_, len(name) * 4) + encoded
+    return data
+
+def test_read_config(tmp_path, monkeypatch, capsys):
+    """Tables of users and activities in config.dat, and the fallbacks."""
+    (users, activities) = ({1: 'Jürgen', 7: 'Anna'}, {200: 'Kayaking'})
+    data = (struct.pack('<3I', nst.APP_ID, nst.CONFIG, 1) + bytes(5) # Unknown.
+            + _table(users) + bytes(3) + _table(activities))
+    assert nst.read_config(io.BytesIO(data)) == (users, activities)
+    assert nst.read_config(io.BytesIO(data[:-1])) == (users, {}) # Broken.
+    assert nst.read_config(io.BytesIO(data[:11])) == ({}, {})
+    assert capsys.readouterr().err == ''
+
+    wrong = struct.pack('<2I', nst.APP_ID, nst.TRACK) + data[8:]
+    assert nst.read_config(io.BytesIO(wrong)) == ({}, {})
+    assert 'Unexpected file type' in capsys.readouterr().err
+
+    (tmp_path / 'Config.dat').write_bytes(data)
+    monkeypatch.setattr(nst, 'user_names', {})
+    monkeypatch.setattr(nst, 'activity_names', {})
+    nst.use_config(tmp_path)
+    assert (nst.user_name(1), nst.user_name(2)) == ('Jürgen', '2')
+    assert (nst.activity_name(200), nst.activity_name(2)) == (
+        'Kayaking', 'Cycling')
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A sidecar index for random access to trackpoints of long tracks.
+
+Most of the trackpoints (0x87/0x97/0xC7, etc.) are deltas to the previous one,
+so nst.read_trackpoints() has to decode from the first.  The index, W*.dat.idx
+next to the track file, keeps a checkpoint (see nst.Checkpoint) at every
+nst.CHECKPOINT_INTERVAL trackpoints: the address of the next trackpoint, the
+number of trackpoints and of pause data consumed, and the absolute state of
+the trackpoint.  read_window() seeks to the nearest checkpoint and decodes
+just the requested time or point range.
+
+Usage:
+    python time_index.py build input_files_or_directories
+    python time_index.py window input_file start stop > output.gpx
+where start/stop are ISO-8601 datetimes in UTC, e.g. 2009-08-27T09:00:00.
+"""
+import sys
+import struct
+import argparse
+from pathlib import Path
+
+import nst
+import convert_nst_files_to_gpx as converter
+
+MAGIC = b'NSTI'
+VERSION = 1
+# Magic, version, size and mtime_ns of the track file.
+HEADER_FMT = '<4sIQq'
+# Offset, track_count, pause_count and the state of trackpt_store (unix_time,
+# t_time, y_degree, x_degree, z_ax, v, d_dist, dist, track_count, file_type).
+CHECKPOINT_FMT = '<QII5d3qIB'
+
+def index_path(in_file):
+    return Path(in_file).with_name(Path(in_file).name + '.idx')
+
+def write_index(in_file, checkpoints):
+    stat = Path(in_file).stat()
+    with index_path(in_file).open(mode='wb') as f:
+        f.write(struct.pack(HEADER_FMT, MAGIC, VERSION, stat.st_size,
+                            stat.st_mtime_ns))
+        for (offset, track_count, pause_count, tp) in checkpoints:
+            f.write(struct.pack(CHECKPOINT_FMT, offset, track_count,
+                                pause_count, *tp))
+
+def read_index(in_file):
+    """Read the index if it is up to date (size and mtime of the track file).
+
+    Returns:
+        a list of nst.Checkpoint or None.
+    """
+    path = index_path(in_file)
+    if not path.exists(): return None
+    stat = Path(in_file).stat()
+    with path.open(mode='rb') as f:
+        (magic, version, size, mtime_ns) = nst.read_unpack(HEADER_FMT, f)
+        if ((magic, version, size, mtime_ns)
+                != (MAGIC, VERSION, stat.st_size, stat.st_mtime_ns)):
+            return None
+        data = f.read()
+    return [nst.Checkpoint(*values[:3], nst.TrackptStore(*values[3:]))
+            for values in struct.iter_unpack(CHECKPOINT_FMT, data)]
+
+def build_index(in_file):
+    """Decode the whole track once to make the index.
+
+    Returns:
+        a list of nst.Checkpoint.
+    """
+    checkpoints = []
+    converter.read_file(in_file, store=lambda tp: None,
+                        checkpoints=checkpoints)
+    write_index(in_file, checkpoints)
+    return checkpoints
+
+def read_window(in_file, store, start_time=None, stop_time=None,
+                first=None, last=None):
+    """Decode trackpoints in a time (unixtime) or a point (index) range.
+
+    Args:
+        in_file: a path object of the track file.
+        store: a function to handle each trackpt_store in the range.
+        start_time, stop_time (optional): range of unixtime (s, UTC).
+        first, last (optional): range of trackpt index (track_count).
+
+    Returns:
+        number of trackpoints in the range.
+    """
+    checkpoints = read_index(in_file)
+    if checkpoints is None: checkpoints = build_index(in_file)
+
+    def before(cp):
+        if first is not None and cp.track_count > first: return False
+        return start_time is None or cp.trackpt_store.unix_time <= start_time
+    def after(cp):
+        if last is not None and cp.track_count > last: return True
+        return stop_time is not None and cp.trackpt_store.unix_time > stop_time
+    start = ([cp for cp in checkpoints if before(cp)] or [None])[-1]
+    stop = next((cp.track_count for cp in checkpoints if after(cp)), None)
+
+    count = 0
+    def store_in_range(tp):
+        nonlocal count
+        if ((first is None or tp.track_count >= first)
+                and (last is None or tp.track_count <= last)
+                and (start_time is None or tp.unix_time >= start_time)
+                and (stop_time is None or tp.unix_time <= stop_time)):
+            store(tp)
+            count += 1
+    converter.read_file(in_file, store_in_range, start=start, stop=stop)
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='A sidecar index for random access to trackpoints.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='make/update the indices.')
+    command.add_argument('in_file', type=Path, nargs='+',
+                         help='track files or directories of W*.dat.')
+    command = commands.add_parser('window', help='gpx of a time range.')
+    command.add_argument('in_file', type=Path)
+    command.add_argument('start', type=nst.parse_utc)
+    command.add_argument('stop', type=nst.parse_utc)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for in_file in converter.find_files(args.in_file, ('W*.dat', )):
+            if read_index(in_file) is None: build_index(in_file)
+    else:
+        gpx = None
+        def store(tp): # Initialize gpx after FILE_TYPE is known.
+            nonlocal gpx
+            if gpx is None: (gpx, nst.gpx_target) = nst.initialize_gpx()
+            nst.store_trackpt(tp)
+        count = read_window(args.in_file, store, args.start, args.stop)
+        print(f'Trackpoints in the window: {count}', file=sys.stderr)
+        if gpx is not None: nst.finalize_gpx(gpx)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""A module to check consistency of track/route files, e.g. for corruption.
+
+Trackpoints are decoded without gpx and checked in columns (vectorized if
+NumPy is available, though a fallback to pure python is implemented):
+1) time_order: unix_time and t_time do not decrease.
+2) distance: d_dist agrees with the haversine distance of the segment
+   within DISTANCE_TOLERANCE.
+3) cumulative: dist is the sum of d_dist.
+4) speed: the speed of each segment (haversine / time, at least 1 s) is under
+   MAX_SPEED, i.e. no jumps of the position.
+5) total_distance, total_time: the totals in the header (see
+   parse_track_informations()) agree with the last trackpoint within
+   TOTAL_TOLERANCE.
+Each check gives the ratio of good segments (1 or 0 of the totals), and the
+score of a file is the mean of them in percent; 0 if it fails to decode.
+Checks of times are skipped in routes.
+
+Usage:
+    python verify.py [-j N] [--min-score SCORE] input_files_or_directories
+prints score, number of points, path and the checks failed of each file.
+"""
+import io
+import sys
+import math
+import argparse
+import contextlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import numpy as np
+    USE_NUMPY = True
+except ImportError: # Fallback to pure python.
+    USE_NUMPY = False
+
+import nst
+import convert_nst_files_to_gpx as converter
+from simplify import EARTH_RADIUS
+
+DISTANCE_TOLERANCE = (1.0, 0.01) # Meters or ratio, the larger.
+MAX_SPEED = 100 # m/s.
+TOTAL_TOLERANCE = (2.0, 0.01) # Seconds/meters or ratio, the larger.
+CHECKS = ('time_order', 'distance', 'cumulative', 'speed', 'total_distance',
+          'total_time')
+
+def haversine(ys, xs):
+    """Distances (m) between consecutive points of lat./lon. (degrees).
+
+    >>> [round(d) for d in haversine([0.0, 0.0, 1.0], [0.0, 1.0, 1.0])]
+    [111195, 111195]
+    """
+    if USE_NUMPY:
+        (lat, lon) = (np.radians(ys), np.radians(xs))
+        a = (np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:])
+             * np.sin(np.diff(lon) / 2) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    (lat, lon) = ([math.radians(y) for y in ys], [math.radians(x) for x in xs])
+    distances = []
+    for i in range(1, len(lat)):
+        a = (math.sin((lat[i] - lat[i - 1]) / 2) ** 2
+             + math.cos(lat[i - 1]) * math.cos(lat[i])
+             * math.sin((lon[i] - lon[i - 1]) / 2) ** 2)
+        distances.append(2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+def _within(value, expected, tolerance):
+    (absolute, ratio) = tolerance
+    return abs(value - expected) <= max(absolute, abs(expected) * ratio)
+
+def _ratio_good(bad, total):
+    return None if not total else 1 - bad / total
+
+def check_columns(columns, file_type=nst.TRACK, total_time=0,
+                  total_distance=0):
+    """Checks of the columns of trackpoints, see module-level docstring.
+
+    Args:
+        columns: a dict of columns, see nst.trackpt_columns().
+        file_type (optional): nst.TRACK or nst.ROUTE.
+        total_time, total_distance (optional): in the header (s, km).
+
+    Returns:
+        a dict of {check: ratio of good segments, or None if not checked}.
+    """
+    checks = dict.fromkeys(CHECKS)
+    num_points = len(columns.get('dist', ()))
+    if num_points < 2: return checks
+    (d_dist, dist) = (columns['d_dist'][1:], columns['dist'])
+    distances = haversine(columns['y_degree'], columns['x_degree'])
+    (abs_tolerance, ratio) = DISTANCE_TOLERANCE
+    is_track = file_type == nst.TRACK
+    if USE_NUMPY:
+        (d_dist, dist) = (np.asarray(d_dist) / 100, np.asarray(dist) / 100)
+        bad = np.abs(distances - d_dist) > np.maximum(abs_tolerance,
+                                                      d_dist * ratio)
+        checks['distance'] = _ratio_good(int(bad.sum()), len(bad))
+        bad = np.abs(np.diff(dist) - d_dist) > 0.01 # 1 cm.
+        checks['cumulative'] = _ratio_good(int(bad.sum()), len(bad))
+        if is_track:
+            (unix_time, t_time) = (np.asarray(columns['unix_time']),
+                                   np.asarray(columns['t_time']))
+            d_time = np.diff(unix_time)
+            bad = (d_time < 0) | (np.diff(t_time) < 0)
+            checks['time_order'] = _ratio_good(int(bad.sum()), len(bad))
+            bad = distances > MAX_SPEED * np.maximum(d_time, 1.0)
+            checks['speed'] = _ratio_good(int(bad.sum()), len(bad))
+    else:
+        (d_dist, dist) = ([d / 100 for d in d_dist], [d / 100 for d in dist])
+        checks['distance'] = _ratio_good(sum(
+            not _within(h, d, DISTANCE_TOLERANCE)
+            for (h, d) in zip(distances, d_dist)), len(d_dist))
+        checks['cumulative'] = _ratio_good(sum(
+            abs(dist[i + 1] - dist[i] - d) > 0.01
+            for (i, d) in enumerate(d_dist)), len(d_dist))
+        if is_track:
+            (unix_time, t_time) = (columns['unix_time'], columns['t_time'])
+            d_time = [unix_time[i + 1] - unix_time[i]
+                      for i in range(num_points - 1)]
+            checks['time_order'] = _ratio_good(sum(
+                d_time[i] < 0 or t_time[i + 1] < t_time[i]
+                for i in range(num_points - 1)), num_points - 1)
+            checks['speed'] = _ratio_good(sum(
+                h > MAX_SPEED * max(d, 1.0)
+                for (h, d) in zip(distances, d_time)), num_points - 1)
+    if total_distance:
+        checks['total_distance'] = float(_within(
+            float(dist[-1]), total_distance * 1000, TOTAL_TOLERANCE))
+    if is_track and total_time:
+        checks['total_time'] = float(_within(
+            columns['t_time'][-1], total_time, TOTAL_TOLERANCE))
+    return checks
+
+def score(checks):
+    """Mean of the checks done in percent (100 if none).
+
+    >>> score({'distance': 1.0, 'total_time': 0.0, 'speed': None})
+    50.0
+    """
+    done = [ratio for ratio in checks.values() if ratio is not None]
+    return round(100 * sum(done) / len(done), 2) if done else 100.0
+
+def verify(in_file):
+    """Decodes a file and checks it.
+
+    Returns:
+        (in_file, score, number of points, checks or None if failed).
+    """
+    trackpts = []
+    try:
+        # Not to mix the messages of errors in nst.py with the results.
+        with contextlib.redirect_stdout(io.StringIO()):
+            converter.read_file(in_file, trackpts.append)
+    except converter.DECODE_ERRORS:
+        return in_file, 0.0, len(trackpts), None
+    checks = check_columns(nst.trackpt_columns(trackpts), nst.FILE_TYPE,
+                           nst.total_time, nst.total_distance)
+    return in_file, score(checks), len(trackpts), checks
+
+def verify_all(in_files, jobs=None):
+    """Yields the results of verify() of files, checked in parallel."""
+    if jobs == 1:
+        yield from map(verify, in_files)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(verify, in_files, chunksize=4)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check consistency of Symbian SportsTracker files.')
+    parser.add_argument('in_file', type=Path, nargs='+',
+                        help='files or directories of W*.dat and R*.dat.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of processes (default: number of CPUs).')
+    parser.add_argument('--min-score', type=float, default=0, metavar='SCORE',
+                        help='exit with 1 if any file scores under this.')
+    args = parser.parse_args()
+
+    (num_files, num_low) = (0, 0)
+    for (in_file, score_, num_points, checks) in verify_all(
+            converter.find_files(args.in_file), args.jobs):
+        failed = ('decode' if checks is None else ','.join(
+            f'{name}={ratio:.4g}' for (name, ratio) in checks.items()
+            if ratio is not None and ratio < 1))
+        print(f'{score_:.2f}\t{num_points}\t{in_file}\t{failed}')
+        num_files += 1
+        num_low += score_ < args.min_score
+    print(f'Verified: {num_files}, under {args.min_score}: {num_low}',
+          file=sys.stderr)
+    if num_low: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
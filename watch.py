@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Script to watch a directory tree and convert new/modified files to gpx.
+
+W*.dat and R*.dat files are converted by convert_nst_files_to_gpx.py and
+Rec*.tmp files by convert_nst_rec_to_gpx.py in a pool of worker processes,
+which stay alive (with nst.py, lxml, etc. imported) so that the latency per
+file is only the time to parse.  A file is converted after its size and mtime
+are unchanged for the debounce time, not to read partially written files.
+
+The watcher is pluggable; anything with a changes() method that yields paths
+of new or modified files can replace PollingWatcher.
+
+Usage:
+    python watch.py [options] directory [-- converter options]
+e.g. python watch.py -o gpx_dir --index index.sqlite phone_dir -- --lean
+"""
+import io
+import sys
+import time
+import contextlib
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import nst
+import compress
+import convert_nst_files_to_gpx
+import convert_nst_rec_to_gpx
+import spatial_index
+import writers
+
+PATTERNS = ('W*.dat', 'R*.dat', 'Rec*.tmp')
+WRITER_OPTIONS = ('--csv', '--database') # Supported in the workers.
+
+class PollingWatcher(object):
+    """Polls a directory tree for new/modified files matching PATTERNS."""
+    def __init__(self, directory, debounce=2.0, patterns=PATTERNS):
+        self.directory = Path(directory)
+        (self.debounce, self.patterns) = (debounce, patterns)
+        self.done = {} # {path: (size, mtime_ns)} of files handed out.
+        self.pending = {} # {path: ((size, mtime_ns), first seen stable)}.
+
+    def scan(self):
+        for pattern in self.patterns:
+            for path in self.directory.rglob(pattern):
+                try:
+                    stat = path.stat()
+                except OSError: # Removed while scanning.
+                    continue
+                yield path, (stat.st_size, stat.st_mtime_ns)
+
+    def changes(self):
+        """Yields paths of files stable for the debounce time (one poll)."""
+        now = time.monotonic()
+        for (path, state) in self.scan():
+            if self.done.get(path) == state: continue
+            (pending_state, since) = self.pending.get(path, (None, now))
+            if pending_state != state: # New or still being written.
+                self.pending[path] = (state, now)
+            elif now - since >= self.debounce:
+                del self.pending[path]
+                self.done[path] = state
+                yield path
+
+    def skip_converted(self, output_of):
+        """Mark files whose outputs are newer than themselves as done."""
+        for (path, state) in self.scan():
+            output = output_of(path)
+            if output.exists() and output.stat().st_mtime_ns >= state[1]:
+                self.done[path] = state
+
+def output_path(in_file, output_dir=None, compression=None):
+    return compress.with_suffix(output_dir / f'{in_file.stem}.gpx' 
+                                if output_dir else in_file.with_suffix('.gpx'),
+                                compression)
+
+def convert_file(in_file, output_dir, converter_args, index_path=None):
+    """Convert a file in a worker process.  Returns (in_file, error or None).
+    """
+    is_rec = in_file.suffix.lower() == '.tmp'
+    converter = convert_nst_rec_to_gpx if is_rec else convert_nst_files_to_gpx
+    args = converter.make_parser().parse_args(
+        [*converter_args, str(in_file)])
+    nst.LEAN = args.lean
+    compress.LEVEL = args.compress_level
+    gpx_path = output_path(in_file, output_dir, args.compress)
+    index = (spatial_index.SpatialIndex(index_path)
+             if index_path and not is_rec else None)
+    nst.WRITERS = writers.from_args(args) # --csv and --database, per file.
+    try:
+        # Rec*.tmp converter prints a lot for debugging purposes.
+        with contextlib.redirect_stdout(io.StringIO()):
+            if is_rec:
+                converter.convert(in_file, args, gpx_path)
+            else:
+                converter.convert(in_file, args, gpx_path, index=index)
+    except convert_nst_files_to_gpx.DECODE_ERRORS as error: # E.g. truncated.
+        return in_file, f'failed to convert ({error!r})'
+    finally:
+        if index is not None: index.close()
+        for writer in nst.WRITERS: writer.close()
+    return in_file, None
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Watch a directory and convert Symbian SportsTracker '
+        'files to gpx.  Arguments after -- are passed to the converters.')
+    parser.add_argument('directory', type=Path)
+    parser.add_argument('-o', '--output-dir', type=Path, metavar='DIR',
+                        help='write gpx files in the directory.  Defaults to '
+                        'next to the input files.')
+    parser.add_argument('--index', type=Path, metavar='SQLITE_FILE',
+                        help='update a spatial index, see spatial_index.py.')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='polling interval in seconds.')
+    parser.add_argument('--debounce', type=float, default=2.0,
+                        help='seconds a file must be unchanged to convert.')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of worker processes.')
+    parser.add_argument('--once', action='store_true',
+                        help='convert what is found and exit.')
+    argv = sys.argv[1:]
+    (argv, converter_args) = ((argv[:argv.index('--')],
+                               argv[argv.index('--') + 1:])
+                              if '--' in argv else (argv, []))
+    args = parser.parse_args(argv)
+    # Of the batch (main() of the converter), not in the workers.
+    options = convert_nst_files_to_gpx.main_options(
+        converter_args, [option for option in convert_nst_files_to_gpx
+                         .MAIN_OPTIONS if option not in WRITER_OPTIONS])
+    if options: parser.error(f'not supported: {", ".join(options)}')
+    if args.output_dir: args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    watcher = PollingWatcher(args.directory, args.debounce)
+    compression = compress.parse_arguments(converter_args).compress
+    watcher.skip_converted(
+        lambda p: output_path(p, args.output_dir, compression))
+    executor = ProcessPoolExecutor(max_workers=args.jobs)
+    futures = {} # {future: (path, executor)}
+    try:
+        while True:
+            for path in watcher.changes():
+                futures[executor.submit(
+                    convert_file, path, args.output_dir, converter_args,
+                    args.index)] = (path, executor)
+            for future in [f for f in futures if f.done()]:
+                (path, pool) = futures.pop(future)
+                try:
+                    (in_file, error) = future.result()
+                except Exception as exception: # E.g. a worker was killed.
+                    (in_file, error) = (path, repr(exception))
+                    if (isinstance(exception, BrokenProcessPool)
+                            and pool is executor): # Replaced only once.
+                        executor.shutdown(wait=False)
+                        executor = ProcessPoolExecutor(max_workers=args.jobs)
+                print(f'{"Failed" if error else "Converted"}: {in_file}'
+                      + (f' ({error})' if error else ''), file=sys.stderr)
+            if args.once and not futures and not watcher.pending: break
+            time.sleep(min(args.interval, args.debounce) if watcher.pending
+                       else args.interval)
+    finally:
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
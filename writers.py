@@ -0,0 +1,173 @@
+#coding:utf-8
+#
+# (c) 2020 ekspla.
+# This code is written by ekspla and distributed at the following site under
+# LGPL v2.1 license.  https://github.com/ekspla/Read-Symbian-SportsTracker-file
+"""Writers of trackpts in addition to gpx, fed in the same pass (fan-out).
+
+nst.store_trackpt() appends each trackpt (after filtering, resampling and
+simplification) to gpx by nst.gpx_target and hands it to every writer in
+nst.WRITERS, so that a file is decoded once for all of the outputs.  A writer
+has the methods below, called by convert() of the converters:
+    start(in_file, gpx_path): before decoding a file.
+    record(trackpt_store): each trackpt.
+    finish(): after gpx is written.
+    abort(): instead of finish() if the file failed to convert.
+    close(): after all the files, also in a finally of errors.
+Each writer buffers on its own: CsvWriter in BUFFER_ROWS rows per file and
+DatabaseWriter in BUFFER_TRACKS rows per transaction, of which the rows of the
+files finished are committed on abort() and close().
+
+The writers are supported by the converters and watch.py (per file in the
+workers), but not by async_convert.py and archive.py, of which gpx bytes are
+written apart from the workers decoding the files.
+"""
+import csv
+import sqlite3
+import contextlib
+from pathlib import Path
+
+import nst
+import compress
+
+BUFFER_ROWS = 1000 # Rows of CsvWriter per write.
+BUFFER_TRACKS = 100 # Rows of DatabaseWriter per transaction.
+
+def csv_path(in_file, gpx_path=None):
+    """Path of CSV next to gpx (or the input), compressed as gpx is.
+
+    >>> str(csv_path(Path('W1.dat'), Path('out/W1.gpx.gz')))
+    'out/W1.csv.gz'
+    """
+    if gpx_path is None: return in_file.with_suffix('.csv')
+    compression = compress.compression_of(gpx_path)
+    if compression: gpx_path = gpx_path.with_suffix('') # .gpx.gz -> .gpx
+    return compress.with_suffix(gpx_path.with_suffix('.csv'), compression)
+
+class CsvWriter(object):
+    """Trackpts of each file to a CSV file, see csv_path()."""
+    COLUMNS = ('time', 'total_time', 'lat', 'lon', 'ele', 'speed',
+               'distance') # UTC, s, degrees, m, m/s and m.
+
+    def __init__(self):
+        (self.path, self.f, self.writer, self.rows) = (None, None, None, [])
+
+    def start(self, in_file, gpx_path):
+        self.path = csv_path(in_file, gpx_path)
+        self.f = compress.open_output(self.path, mode='wt')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(self.COLUMNS)
+
+    def record(self, tp):
+        self.rows.append((nst.format_utc(tp.unix_time), round(tp.t_time, 2),
+                          round(tp.y_degree, 6), round(tp.x_degree, 6),
+                          round(tp.z_ax, 1), round(tp.v / 100, 3),
+                          round(tp.dist / 100, 2)))
+        if len(self.rows) >= BUFFER_ROWS: self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows.clear()
+
+    def finish(self):
+        self.flush()
+        self.f.close()
+        self.f = None
+
+    def abort(self):
+        self.rows.clear()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            self.path.unlink() # Not to leave a broken one.
+
+    def close(self):
+        pass
+
+class DatabaseWriter(object):
+    """A row of each track/route in a sqlite3 database (table tracks)."""
+    def __init__(self, path):
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY, name TEXT, activity TEXT,
+                user_id INTEGER, start REAL, stop REAL, points INTEGER,
+                total_time REAL, total_distance REAL, south REAL, west REAL,
+                north REAL, east REAL)''')
+        self.rows = []
+
+    def start(self, in_file, gpx_path):
+        self.in_file = in_file
+        (self.first, self.last, self.points) = (None, None, 0)
+        (self.south, self.west, self.north, self.east) = (
+            float('inf'), float('inf'), float('-inf'), float('-inf'))
+
+    def record(self, tp):
+        if self.first is None: self.first = tp
+        self.last = tp
+        self.points += 1
+        (self.south, self.north) = (min(self.south, tp.y_degree),
+                                    max(self.north, tp.y_degree))
+        (self.west, self.east) = (min(self.west, tp.x_degree),
+                                  max(self.east, tp.x_degree))
+
+    def finish(self):
+        if self.points == 0: return
+        is_track = nst.FILE_TYPE != nst.ROUTE
+        self.rows.append((
+            str(self.in_file), nst.track_name if is_track else nst.route_name,
+            nst.activity_type, nst.USER_ID,
+            self.first.unix_time, self.last.unix_time, self.points,
+            nst.total_time or self.last.t_time,
+            nst.total_distance or self.last.dist / 10**5,
+            self.south, self.west, self.north, self.east))
+        if len(self.rows) >= BUFFER_TRACKS: self.flush()
+
+    def abort(self):
+        self.flush() # The files finished, not to lose them by the error.
+
+    def flush(self):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO tracks VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.rows)
+        self.connection.commit()
+        self.rows.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+@contextlib.contextmanager
+def feeding(in_file, gpx_path=None):
+    """Starts nst.WRITERS for a file, and finishes (or aborts) them.
+
+    Usage:
+        with feeding(in_file, gpx_path):
+            gpx = to_gpx(in_file, args) # Trackpts to the writers.
+            nst.finalize_gpx(gpx, gpx_path)
+    """
+    for writer in nst.WRITERS: writer.start(in_file, gpx_path)
+    try:
+        yield
+    except BaseException: # Including SystemExit of errors in nst.py.
+        for writer in nst.WRITERS: writer.abort()
+        raise
+    for writer in nst.WRITERS: writer.finish()
+
+def add_arguments(parser):
+    """Adds options of the writers to an argparse parser."""
+    group = parser.add_argument_group('more outputs (in the same pass)')
+    group.add_argument('--csv', action='store_true', help='also write '
+                       'trackpts to *.csv next to the gpx.')
+    group.add_argument('--database', type=Path, metavar='SQLITE_FILE',
+                       help='also write a row (name, times, points, totals '
+                       'and bounding box) of each file to the database.')
+
+def from_args(args):
+    """A list of the writers of the arguments, see add_arguments()."""
+    writers = []
+    if args.csv: writers.append(CsvWriter())
+    if args.database: writers.append(DatabaseWriter(args.database))
+    return writers